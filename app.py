@@ -1,35 +1,105 @@
 import streamlit as st
+import copy
 import json
-import openai
-from datetime import datetime, timedelta
 import os
-import re
-import shutil
 import time
-import re
-import google.generativeai as genai
+import uuid
+from dialog_store import DialogStore, atomic_write_json
+from debug_store import DebugStore
+from context_builder import DEFAULT_TOKEN_BUDGET, CharacterIndexCache
+from prompt_builder import PromptLayout
+from turn_pipeline import TurnPipeline
+from turn_worker import TurnExecutor
+from resources import ModelPool, get_genai, get_openai_client, json_cache
+from state_store import WorldStore
+from sqlite_store import SqliteWorldStore
+from version_log import VersionLog
+from memory_index import MemoryIndex
+from world_log import LogArchive
+from story_summary import RECENT_MESSAGES, SUMMARY_TOKEN_CAP, SummaryStore
+from campaign import DEFAULT_CAMPAIGN, campaign_paths, create_campaign, list_campaigns
+from file_lock import FileLock
+from llm_cache import ResponseCache
+from metrics import TRACE_CAPACITY, Metrics
+from router import FAST, FAST_ACTIONS, FULL, PROFILE_BUDGETS, ModelRouter
+from scheduler import TimelineCache
+from providers import DEFAULT_TIMEOUT, ChatProvider, CircuitBreaker, StoryProvider, http_pool
 
 # ================= CONFIG =================
+# response cache ของ LLM: off / cache / record / replay (replay = เล่นจากที่บันทึกไว้ ไม่ต้องใช้ key ไม่ต่อเน็ต)
+LLM_CACHE_MODE = st.secrets.get("LLM_CACHE_MODE", "off")
+
 if "OPENAI_API_KEY" in st.secrets:
     api_key = st.secrets["OPENAI_API_KEY"]
+elif LLM_CACHE_MODE == "replay":
+    api_key = "replay"
 else:
     st.error("ไม่พบ API Key ใน Secrets")
     st.stop()
 
 if "GOOGLE_API_KEY" in st.secrets:
     google_api_key = st.secrets["GOOGLE_API_KEY"]
+elif LLM_CACHE_MODE == "replay":
+    google_api_key = "replay"
 else:
     st.error("ไม่พบ API Key ใน Secrets")
     st.stop()
 
-genai.configure(api_key=google_api_key)
-
-client = openai.OpenAI(api_key=api_key)
+# endpoint อื่นแทน API จริง (proxy / fake server ตอนทดสอบ) ว่างไว้ = ของ provider
+OPENAI_BASE_URL = st.secrets.get("OPENAI_BASE_URL", "") or None
+GEMINI_BASE_URL = st.secrets.get("GEMINI_BASE_URL", "") or None
+# ลองใหม่กี่ครั้ง (backoff แบบสุ่ม) timeout ต่อ call และ circuit breaker: ล้มติดกันกี่ครั้งถึงพักกี่วินาที
+PROVIDER_RETRIES = int(st.secrets.get("PROVIDER_RETRIES", 2))
+PROVIDER_TIMEOUT = float(st.secrets.get("PROVIDER_TIMEOUT", DEFAULT_TIMEOUT))
+BREAKER_FAILURES = int(st.secrets.get("BREAKER_FAILURES", 5))
+BREAKER_RESET = float(st.secrets.get("BREAKER_RESET", 30))
 
 DB_FILE = 'db.json'
 DIALOG_FILE = 'dialog.json'
+DIALOG_JOURNAL_FILE = 'dialog.jsonl'
+DEBUG_STORE_DIR = 'debug_store'
+HISTORY_DIR = 'history'
+SUMMARY_FILE = 'summary.json'
+# log เก่าที่ย้ายออกจาก db (ดู world_log.py)
+LOG_ARCHIVE_DIR = 'log_archive'
+# ตั้ง WORLD_BACKEND = "sqlite" ใน Secrets เพื่อเก็บโลกใน SQLite แทน db.json
+WORLD_BACKEND = st.secrets.get("WORLD_BACKEND", "json")
+WORLD_SQLITE_FILE = st.secrets.get("WORLD_SQLITE_FILE", 'world.sqlite')
 PROMPT_FILE = 'prompt.json'
-TIME_FMT = "%Y-%m-%d %H:%M:%S"
+LLM_CACHE_DIR = st.secrets.get("LLM_CACHE_DIR", 'llm_cache')
+LLM_CACHE_MAX_MB = int(st.secrets.get("LLM_CACHE_MAX_MB", 256))
+STORY_MODEL = 'gemini-2.5-flash'
+# แสดงคำตอบ GPT ทีละ token ระหว่าง generate (ปิดได้ใน Secrets)
+STREAM_REPLY = bool(st.secrets.get("STREAM_REPLY", True))
+# งบ token สำหรับรายละเอียด NPC ที่ส่งเข้า prompt ต่อเทิร์น (ปรับได้ใน Secrets)
+CONTEXT_TOKEN_BUDGET = int(st.secrets.get("CONTEXT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+# เวลาสูงสุดต่อเทิร์น (วินาที) และจำนวน worker thread ที่รันเทิร์นพร้อมกันได้
+TURN_TIMEOUT = float(st.secrets.get("TURN_TIMEOUT", 300))
+TURN_WORKERS = int(st.secrets.get("TURN_WORKERS", 4))
+# จำนวนข้อความที่แสดงในหน้าแชทต่อหนึ่งหน้า (10 เทิร์น = user + assistant)
+HISTORY_PAGE_SIZE = int(st.secrets.get("HISTORY_PAGE_SIZE", 20))
+# สรุปแคมเปญ: เพดาน token ของสรุป และจำนวนข้อความล่าสุดที่ยังส่งแบบเต็ม
+SUMMARY_CAP = int(st.secrets.get("SUMMARY_TOKEN_CAP", SUMMARY_TOKEN_CAP))
+RECENT_HISTORY = int(st.secrets.get("RECENT_MESSAGES", RECENT_MESSAGES))
+# จำนวนเหตุการณ์เก่า (จาก dialog / log) ที่ค้นมาใส่ context ต่อเทิร์น (0 = ปิด)
+MEMORY_TOP_K = int(st.secrets.get("MEMORY_TOP_K", 4))
+# ให้ mechanics.py คิดเวลา/เส้นทางเดินทางเองแทน LLM (ปิดได้ใน Secrets)
+MECHANICS_ENGINE = bool(st.secrets.get("MECHANICS_ENGINE", True))
+# จำนวนเทิร์นล่าสุดที่เก็บ trace ไว้ดูใน Metrics panel และราคา token ({model: [input, output]} USD ต่อ 1M)
+METRICS_CAPACITY = int(st.secrets.get("METRICS_CAPACITY", TRACE_CAPACITY))
+MODEL_PRICES = {k: list(v) for k, v in dict(st.secrets.get("MODEL_PRICES", {})).items()}
+# เลือก pipeline ต่อเทิร์น: action ง่ายๆ (คุย / พัก) ข้าม Gemini แล้วใช้ model เร็วตัวเดียว (ปิดได้ใน Secrets)
+MODEL_ROUTER = bool(st.secrets.get("MODEL_ROUTER", True))
+GPT_MODEL = st.secrets.get("GPT_MODEL", "gpt-5.2-pro")
+FAST_MODEL = st.secrets.get("FAST_MODEL", "gpt-5-mini")
+FALLBACK_MODEL = st.secrets.get("FALLBACK_MODEL", "gpt-5-mini")
+FAST_ACTIONS_CFG = list(st.secrets.get("FAST_ACTIONS", FAST_ACTIONS))
+# งบเวลา (วินาที) ต่อ profile และเวลารอ chunk แรกก่อนยิง request สำรอง (0 = ไม่ hedge)
+FAST_BUDGET = float(st.secrets.get("FAST_BUDGET", PROFILE_BUDGETS[FAST]))
+FULL_BUDGET = float(st.secrets.get("FULL_BUDGET", PROFILE_BUDGETS[FULL]))
+HEDGE_AFTER = float(st.secrets.get("HEDGE_AFTER", 0)) or None
+# model ที่ใช้ซ่อม JSON block ที่ parser อ่านไม่ได้ ("" = ปิด ข้อความนั้นจะไม่อัปเดต state)
+JSON_REPAIR_MODEL = st.secrets.get("JSON_REPAIR_MODEL", FAST_MODEL)
 
 
 # ================= FUNCTIONS =================
@@ -43,58 +113,442 @@ def load_json(filepath, default_value):
 
 
 def save_json(filepath, data):
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # หลาย session ใช้ prompt.json ร่วมกัน ล็อกไว้กันเขียนทับกันกลางทาง
+    with get_metrics().span("save_json", path=filepath) as span, FileLock(filepath):
+        atomic_write_json(filepath, data)
+        span["bytes_out"] = os.path.getsize(filepath)
+
+
+# ไฟล์ของแต่ละแคมเปญ (default อยู่ที่ root, แคมเปญอื่นอยู่ใน campaigns/<ชื่อ>/)
+CAMPAIGN_FILES = {
+    "db": DB_FILE,
+    "dialog": DIALOG_FILE,
+    "dialog_journal": DIALOG_JOURNAL_FILE,
+    "debug_store": DEBUG_STORE_DIR,
+    "history": HISTORY_DIR,
+    "sqlite": WORLD_SQLITE_FILE,
+    "summary": SUMMARY_FILE,
+    "log_archive": LOG_ARCHIVE_DIR,
+}
+
+
+@st.cache_resource
+def get_stores(slot):
+    # store ระดับ process ต่อแคมเปญ: parse ไฟล์ครั้งเดียวแล้วเช็ค mtime ทุก rerun แทนการอ่านใหม่ทั้งไฟล์
+    # ทุก session ที่เล่นแคมเปญเดียวกันใช้ store ชุดเดียวกัน (การเขียนมี lock + version check)
+    paths = campaign_paths(slot, CAMPAIGN_FILES)
+    if WORLD_BACKEND == "sqlite":
+        world = SqliteWorldStore(paths["sqlite"])
+        # ครั้งแรกยังไม่มีข้อมูล ดึงจาก db.json เข้ามา
+        if world.is_empty() and os.path.exists(paths["db"]):
+            world.import_json(paths["db"])
+    else:
+        world = WorldStore(paths["db"])
+    return (world, DialogStore(paths["dialog"], paths["dialog_journal"]),
+            VersionLog(paths["history"]), DebugStore(paths["debug_store"]), SummaryStore(paths["summary"]),
+            MemoryIndex(), LogArchive(paths["log_archive"]), TimelineCache(), CharacterIndexCache())
+
+
+def detach_debug(messages):
+    # ย้าย gpt_raw / gemini_raw / debug_json ออกไปเก็บแยก ให้ dialog เหลือแต่เนื้อเรื่อง
+    # ข้อความเก่าที่ไม่มี id ให้ใส่ id ด้วย เพราะ debug/UI อ้างอิงข้อความด้วย id
+    moved = False
+    for msg in messages:
+        if not isinstance(msg, dict):
+            continue
+        if 'id' not in msg:
+            msg['id'] = DialogStore.new_id()
+            moved = True
+        if debug_store.detach(msg):
+            moved = True
+    return moved
+
+
+# โหลด prompt.json ใหม่เฉพาะตอนไฟล์เปลี่ยน (เช็คจาก mtime)
+prompt_data = json_cache.load(PROMPT_FILE, None)
+
+@st.cache_resource
+def get_story_model_pool():
+    # GenerativeModel ต่อ system instruction เก็บไว้ใช้ซ้ำ
+    return ModelPool(
+        lambda model_name, instruction: get_genai(google_api_key, GEMINI_BASE_URL).GenerativeModel(
+            model_name=model_name,
+            system_instruction=instruction
+        )
+    )
+
+
+def _provider_options():
+    return dict(retries=PROVIDER_RETRIES, timeout=PROVIDER_TIMEOUT,
+                breaker=CircuitBreaker(failures=BREAKER_FAILURES, reset_after=BREAKER_RESET))
+
+
+@st.cache_resource
+def get_chat_provider():
+    # client / SDK / connection pool สร้างครั้งเดียวต่อ process, breaker ต้องอยู่ข้าม rerun ด้วย
+    client = get_openai_client(api_key, OPENAI_BASE_URL, http_pool(timeout=PROVIDER_TIMEOUT))
+    return ChatProvider(client, **_provider_options())
+
+
+@st.cache_resource
+def get_story_provider():
+    return StoryProvider(lambda instruction: get_story_model_pool().get(STORY_MODEL, instruction), **_provider_options())
+
+
+@st.cache_resource
+def get_llm_cache():
+    # ใช้ร่วมทุกแคมเปญ (key เป็น hash ของ prompt + state อยู่แล้ว ไม่ปนกัน)
+    return ResponseCache(LLM_CACHE_DIR, max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024, mode=LLM_CACHE_MODE)
+
+
+@st.cache_resource
+def get_metrics():
+    # trace ของทุก session อยู่ใน ring buffer เดียว (panel กรองเฉพาะ session ตัวเอง)
+    return Metrics(capacity=METRICS_CAPACITY, prices=MODEL_PRICES)
+
+
+@st.cache_resource
+def get_turn_executor():
+    # thread pool เดียวใช้ร่วมทุก session แต่ละ session มีคิวของตัวเอง
+    return TurnExecutor(max_workers=TURN_WORKERS)
+
 
+turn_executor = get_turn_executor()
 
-def add_time(db, days=0, hours=0, minutes=0):
-    curr = datetime.strptime(db['world']['current_time'], TIME_FMT)
-    new_time = curr + timedelta(days=days, hours=hours, minutes=minutes)
-    db['world']['current_time'] = new_time.strftime(TIME_FMT)
 
-previous_story = []
-prompt_data = load_json(PROMPT_FILE,None)
+JSON_EDITOR_WHOLE = "(ทั้งหมด)"
 
-def ask_gemini_story(prompt, context):
-    validator_instruction = prompt_data.get("story_prompt", "").format(
-        context=context,
-        previous_story=previous_story
+
+def _child_keys(node):
+    if isinstance(node, dict):
+        return list(node.keys())
+    if isinstance(node, list):
+        return list(range(len(node)))
+    return []
+
+
+def _set_path(data, path, value):
+    # copy เฉพาะ container ตามเส้นทางที่แก้ ส่วนอื่นใช้ของเดิมร่วมกัน (ไม่ต้อง deepcopy ทั้งโลก)
+    if not path:
+        return value
+    root = copy.copy(data)
+    node = root
+    for key in path[:-1]:
+        node[key] = copy.copy(node[key])
+        node = node[key]
+    node[path[-1]] = value
+    return root
+
+
+@st.fragment
+def json_editor(name, label, load, save, depth=2, item_label=lambda node, k: str(k)):
+    # serialize เฉพาะตอนเปิด editor และเลือกแก้ได้ทีละส่วน (เช่นตัวละครตัวเดียว)
+    # พิมพ์/เลือกใน fragment นี้ rerun แค่ตัวมันเอง ไม่ไปรันหน้าแชทใหม่
+    if not st.toggle("📝 เปิด Editor", key=f"{name}_editor_open"):
+        return
+
+    data = load()
+    path = []
+    node = data
+    for level in range(depth):
+        keys = _child_keys(node)
+        if not keys:
+            break
+        choice = st.selectbox(
+            "ส่วนที่จะแก้" if level == 0 else "รายการย่อย",
+            [JSON_EDITOR_WHOLE] + keys,
+            key=f"{name}_editor_path_{level}_" + "/".join(map(str, path)),
+            format_func=lambda k, node=node: k if k == JSON_EDITOR_WHOLE else item_label(node, k)
+        )
+        if choice == JSON_EDITOR_WHOLE:
+            break
+        path.append(choice)
+        node = node[choice]
+
+    node_text = json.dumps(node, indent=4, ensure_ascii=False)
+    editor_key = f"{name}_editor::" + "/".join(map(str, path))
+    edited_json_str = st.text_area(label, value=node_text, height=500, key=editor_key)
+
+    # 3. ปุ่ม Save
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        if st.button("💾 Save & Refresh", key=f"btn_save_{name}"):
+            try:
+                new_value = json.loads(edited_json_str)
+                save(_set_path(data, path, new_value))
+
+                st.toast("✅ Database Updated Successfully!", icon="💾")
+                time.sleep(1.5)
+
+                st.rerun()
+            except json.JSONDecodeError as e:
+                st.error(f"❌ JSON พังครับเช็ควงเล็บหรือลูกน้ำใหม่!\nError: {e}")
+            except Exception as e:
+                st.error(f"❌ Error: {e}")
+
+    with col2:
+        st.button(
+            "🔄 Reset View",
+            key=f"btn_reset_{name}",
+            on_click=lambda: st.session_state.update({editor_key: node_text})
+        )
+
+
+def save_db_edit(new_data, label="edit"):
+    # แก้ DB ด้วยมือไม่มี delta ให้ replay เก็บเป็น snapshot version แทน
+    world_store.save(new_data)
+    version_log.record_snapshot(new_data, len(st.session_state.chat_history), label)
+
+
+def rewind_to(version):
+    # ย้อน DB ไปหลังเทิร์น version และตัด dialog ให้ตรงกับตอนนั้น
+    old_db = version_log.state_at(version)
+    meta = version_log.truncate(version)
+    world_store.save(old_db)
+    messages = dialog_store.load()[:meta.get("dialog_len", 0)]
+    dialog_store.replace(messages)
+    st.session_state.chat_history = messages
+
+
+def branch_to(version, slot):
+    # แตกแคมเปญใหม่จาก version นี้ แคมเปญเดิมไม่ถูกแตะ
+    meta = next(m for m in version_log.versions() if m["v"] == version)
+    messages = dialog_store.load()[:meta.get("dialog_len", 0)]
+    branch_db = version_log.state_at(version)
+
+    def populate(paths):
+        # เขียนลงโฟลเดอร์ชั่วคราวของ create_campaign แคมเปญใหม่โผล่มาเมื่อครบทุกไฟล์แล้วเท่านั้น
+        version_log.branch(version, paths["history"])
+        # debug ของข้อความที่ติดไปด้วย copy ไปไว้ใน store ของแคมเปญใหม่ (hash เดิม ref ไม่เปลี่ยน)
+        branch_debug = DebugStore(paths["debug_store"])
+        for msg in messages:
+            if msg.get("debug_ref"):
+                branch_debug.put(debug_store.get(msg["debug_ref"]))
+        # สรุปแคมเปญที่ยังตรงกับ dialog ณ จุดนั้นก็ติดไปด้วย
+        summary, upto = summary_store.for_history(messages)
+        if upto:
+            SummaryStore(paths["summary"]).save(summary, upto, messages)
+        # log ที่ถูกย้ายไป archive ก่อนจุดนั้น
+        log_archive.copy_to(LogArchive(paths["log_archive"]), branch_db.get('log_base', 0))
+
+    create_campaign(slot, CAMPAIGN_FILES, branch_db, messages, populate=populate)
+
+
+def select_campaign(slot):
+    # state ของ session ผูกกับแคมเปญ เปลี่ยนแคมเปญต้องล้างทิ้ง (ไม่งั้นเนื้อเรื่องจะปนกัน)
+    st.session_state.campaign = slot
+    for key in ("chat_history", "previous_story", "prompt_layout", "prompt_stats", "history_window"):
+        st.session_state.pop(key, None)
+
+
+def save_dialog(new_d_data):
+    detach_debug(new_d_data)
+    dialog_store.replace(new_d_data)
+
+
+@st.fragment
+def metrics_panel():
+    metrics = get_metrics()
+    stats = metrics.summary(session_id)
+    if not stats["turns"]:
+        st.caption("ยังไม่มีเทิร์นที่จบแล้ว")
+    else:
+        totals = stats["totals"]
+        st.caption(f"⏱️ {stats['turns']} เทิร์น · p50 {stats['p50_ms'] / 1000:.1f}s · p95 {stats['p95_ms'] / 1000:.1f}s")
+        st.caption(
+            f"🔤 prompt {totals['prompt_tokens']:,} tok (cached {totals['cached_tokens']:,}) / "
+            f"completion {totals['completion_tokens']:,} tok"
+            + (f" · 💲{totals['cost']:.4f}" if totals["cost"] else "")
+        )
+        st.caption(f"📦 ส่ง {totals['bytes_in']:,} B / รับ-เขียน {totals['bytes_out']:,} B · retries {totals['retries']}")
+        st.dataframe(stats["spans"], hide_index=True, use_container_width=True)
+        last = metrics.recent(session_id, kind="turn")[-1].as_dict()
+        st.caption(f"เทิร์นล่าสุด: {last['label']} ({last['status']})")
+        st.dataframe(
+            [{"span": sp["name"], "ms": sp["ms"], **{k: v for k, v in sp.items() if k not in ("name", "start", "ms")}}
+             for sp in last["spans"]],
+            hide_index=True, use_container_width=True
+        )
+    for provider in (get_story_provider(), get_chat_provider()):
+        st.caption(f"🔌 {provider.name}: {provider.calls} calls · {provider.retried} retries · "
+                   f"{provider.failed} failed · breaker {provider.breaker.state}")
+    # เปิดไฟล์ใน chrome://tracing หรือ ui.perfetto.dev
+    st.download_button(
+        label="⬇️ Export Trace",
+        data=metrics.export_trace(session_id),
+        file_name=f"trace_{session_id[:8]}.json",
+        mime="application/json"
     )
 
-    try:
-        model = genai.GenerativeModel(
-            model_name='gemini-2.5-flash',
-            system_instruction=validator_instruction
+
+@st.fragment
+def prompt_editor():
+    # แก้ prompt ใน fragment พิมพ์แก้แล้วไม่ต้อง rerun หน้าแชททั้งหน้า
+    # สถิติ prefix ที่ซ้ำกับเทิร์นก่อน (ส่วนที่ provider cache ได้)
+    for name, stats in st.session_state.prompt_stats.items():
+        st.caption(
+            f"♻️ {name}: reused {stats['reused_bytes']:,} B (~{stats['reused_tokens']:,} tok) / "
+            f"new {stats['new_bytes']:,} B (~{stats['new_tokens']:,} tok)"
         )
 
-        gemini_clean_response = re.sub(r'([a-zA-Z\u0E00-\u0E7F])\1{10,}', r'\1\1\1\1\1', model.generate_content(prompt).text)
-        return gemini_clean_response
+    if LLM_CACHE_MODE != "off":
+        llm_cache = get_llm_cache()
+        st.caption(f"🗄️ LLM cache ({LLM_CACHE_MODE}): hit {llm_cache.hits} / miss {llm_cache.misses}")
+
+    current_system = str(prompt_data.get("system_prompt", ""))
+    current_story = str(prompt_data.get("story_prompt", ""))
+
+    # 2. สร้าง Tabs แยกกันเลย จะได้ไม่งง
+    tab1, tab2 = st.tabs(["⚙️ System Prompt", "📖 Story Prompt"])
+
+    with tab1:
+        st.caption("กฎหลักของเกม (System Prompt)")
+        # height สูงๆ จะได้เหมือนเขียน Word
+        new_system_prompt = st.text_area(
+            "แก้ไข System Prompt:",
+            value=current_system,
+            height=400,
+            key="input_system_prompt"
+        )
+
+    with tab2:
+        st.caption("คำสั่งดำเนินเรื่อง (Story Prompt)")
+        new_story_prompt = st.text_area(
+            "แก้ไข Story Prompt:",
+            value=current_story,
+            height=400,
+            key="input_story_prompt"
+        )
+
+    # 3. ปุ่ม Save
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        if st.button("💾 Save Prompts", key="btn_save_visual_prompt"):
+            try:
+                new_prompt_data = {
+                    "system_prompt": new_system_prompt,
+                    "story_prompt": new_story_prompt
+                }
+                save_json(PROMPT_FILE, new_prompt_data)
+
+                st.toast("✅ บันทึก Prompt เรียบร้อย!", icon="💾")
+                time.sleep(1)
+                st.rerun()
 
-    except Exception as e:
-        print(f"[Gemini Crosscheck Error]: {e}")
-        return f"error {e}"
+            except Exception as e:
+                st.error(f"❌ Error: {e}")
+
+    with col2:
+        st.button(
+            "🔄 Discard & Reset All",
+            key="btn_reset_prompts",
+            on_click=lambda: st.session_state.update({
+                "input_system_prompt": current_system,
+                "input_story_prompt": current_story
+            })
+        )
 
 
 # ================= UI SETUP =================
 st.set_page_config(page_title="One Piece RPG", page_icon="🏴‍☠️", layout="wide")
 
-dialog_db = load_json(DIALOG_FILE, [])
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+    st.session_state.consumed_jobs = set()
+session_id = st.session_state.session_id
+turn_busy = bool(turn_executor.active(session_id))
 
-# 1. โหลดประวัติแชทจากไฟล์ (ถ้ามี)
+# แคมเปญของ session นี้ (แต่ละ session เลือกเล่นคนละแคมเปญได้)
+if "campaign" not in st.session_state:
+    st.session_state.campaign = DEFAULT_CAMPAIGN
+campaign = st.session_state.campaign
+(world_store, dialog_store, version_log, debug_store, summary_store, memory_index, log_archive,
+ timeline_cache, character_index) = get_stores(campaign)
+
+# 1. โหลดประวัติแชทจากไฟล์ (ถ้ามี) ครั้งแรกของ session เท่านั้น
 if "chat_history" not in st.session_state:
+    dialog_db = dialog_store.load()
+    # dialog เก่าที่ยังเก็บ debug ไว้ในตัวข้อความ ย้ายออกครั้งเดียวแล้วเขียน snapshot ใหม่
+    if detach_debug(dialog_db):
+        dialog_store.replace(dialog_db)
     st.session_state.chat_history = dialog_db
 
+if "prompt_layout" not in st.session_state:
+    st.session_state.prompt_layout = PromptLayout()
+    st.session_state.prompt_stats = {}
+
+# เนื้อเรื่อง Gemini ล่าสุดของ session นี้ (เดิมเป็น list ระดับ module ที่ทุกคนใช้ร่วมกัน)
+if "previous_story" not in st.session_state:
+    st.session_state.previous_story = []
+
+turn_pipeline = TurnPipeline(
+    story_model=get_story_provider(),
+    gpt_client=get_chat_provider(),
+    dialog_store=dialog_store,
+    debug_store=debug_store,
+    world_store=world_store,
+    stream=STREAM_REPLY,
+    token_budget=CONTEXT_TOKEN_BUDGET,
+    version_log=version_log,
+    summary_store=summary_store,
+    summary_cap=SUMMARY_CAP,
+    recent_messages=RECENT_HISTORY,
+    memory_index=memory_index,
+    memory_top_k=MEMORY_TOP_K,
+    mechanics=MECHANICS_ENGINE,
+    llm_cache=get_llm_cache() if LLM_CACHE_MODE != "off" else None,
+    gpt_model=GPT_MODEL,
+    story_model_name=STORY_MODEL,
+    metrics=get_metrics(),
+    router=ModelRouter(
+        full_model=GPT_MODEL, fast_model=FAST_MODEL, fallback_model=FALLBACK_MODEL, fast_actions=FAST_ACTIONS_CFG,
+        budgets={FAST: FAST_BUDGET, FULL: FULL_BUDGET}, hedge_after=HEDGE_AFTER
+    ) if MODEL_ROUTER else None,
+    repair_model=JSON_REPAIR_MODEL or None,
+    log_archive=log_archive,
+    timeline_cache=timeline_cache,
+    character_index=character_index,
+)
+
 # 2. โหลด Database เกม
-db = load_json(DB_FILE, None)
+db = world_store.get()  # ของที่ cache ไว้ ห้ามแก้ตรงๆ (ใช้ snapshot ก่อน)
 if not db:
-    st.error(f"ไม่พบไฟล์ {DB_FILE}")
+    st.error(f"ไม่พบไฟล์ {campaign_paths(campaign, CAMPAIGN_FILES)['db']}")
     st.stop()
+# ครั้งแรกที่ยังไม่มี version log ใช้ DB ตอนนี้เป็น version 0
+version_log.ensure_base(db, len(st.session_state.chat_history))
 
 # --- SIDEBAR HUD ---
 p = db['player']
 w = db['world']
 
 with st.sidebar:
+    # 0. CAMPAIGN
+    campaigns = list_campaigns()
+    picked_campaign = st.selectbox(
+        "🗺️ Campaign", campaigns, index=campaigns.index(campaign) if campaign in campaigns else 0, disabled=turn_busy
+    )
+    if picked_campaign != campaign:
+        select_campaign(picked_campaign)
+        st.rerun()
+    with st.expander("➕ New Campaign", expanded=False):
+        new_slot = st.text_input("ชื่อแคมเปญ (A-Z, 0-9, _ -)", key="new_campaign_slot")
+        if st.button("➕ Create", key="btn_new_campaign", disabled=not new_slot):
+            try:
+                # แคมเปญใหม่เริ่มจาก db_backup.json เหมือน Reset Story
+                with open('db_backup.json', 'r', encoding='utf-8') as f:
+                    create_campaign(new_slot, CAMPAIGN_FILES, json.load(f))
+                select_campaign(new_slot)
+                st.rerun()
+            except FileNotFoundError:
+                st.error("ไม่พบไฟล์ db_backup.json! กรุณาสร้างไฟล์ backup ไว้ก่อนครับ")
+            except ValueError as e:
+                st.error(str(e))
+
+    st.divider()
+
     # 1. HEADER & IDENTITY
     st.title(f"🏴‍☠️ {p['name']}")
 
@@ -189,132 +643,18 @@ with st.sidebar:
     st.divider()
 
     with st.expander("🛠️ Debug: Raw Database (JSON)", expanded=False):
-        db_text = json.dumps(db, indent=4, ensure_ascii=False)
-        edited_json_str = st.text_area(
-            "📝 แก้ไข JSON DB ตรงนี้:",
-            value=db_text,
-            height=500,
-            key="db_editor"
-        )
-
-        # 3. ปุ่ม Save
-        col1, col2 = st.columns([1, 1])
-
-        with col1:
-            if st.button("💾 Save & Refresh DB", key="btn_save_db"):
-                try:
-                    new_data = json.loads(edited_json_str)
-                    save_json(DB_FILE, new_data)
-
-                    st.toast("✅ Database Updated Successfully!", icon="💾")
-                    time.sleep(1.5)
-
-                    st.rerun()
-                except json.JSONDecodeError as e:
-                    st.error(f"❌ JSON พังครับเช็ควงเล็บหรือลูกน้ำใหม่!\nError: {e}")
-                except Exception as e:
-                    st.error(f"❌ Error: {e}")
-
-        with col2:
-            st.button(
-                "🔄 Reset View DB",
-                key="btn_reset_db",
-                on_click=lambda: st.session_state.update({"db_editor": db_text})
-            )
+        json_editor("db", "📝 แก้ไข JSON DB ตรงนี้:", world_store.get, save_db_edit)
 
     st.divider()
 
     with st.expander("🛠️ Debug: Raw Prompt (JSON)", expanded=False):
-        current_system = str(prompt_data.get("system_prompt", ""))
-        current_story = str(prompt_data.get("story_prompt", ""))
-
-        # 2. สร้าง Tabs แยกกันเลย จะได้ไม่งง
-        tab1, tab2 = st.tabs(["⚙️ System Prompt", "📖 Story Prompt"])
-
-        with tab1:
-            st.caption("กฎหลักของเกม (System Prompt)")
-            # height สูงๆ จะได้เหมือนเขียน Word
-            new_system_prompt = st.text_area(
-                "แก้ไข System Prompt:",
-                value=current_system,
-                height=400,
-                key="input_system_prompt"
-            )
-
-        with tab2:
-            st.caption("คำสั่งดำเนินเรื่อง (Story Prompt)")
-            new_story_prompt = st.text_area(
-                "แก้ไข Story Prompt:",
-                value=current_story,
-                height=400,
-                key="input_story_prompt"
-            )
-
-        # 3. ปุ่ม Save
-        col1, col2 = st.columns([1, 1])
-
-        with col1:
-            if st.button("💾 Save Prompts", key="btn_save_visual_prompt"):
-                try:
-                    new_prompt_data = {
-                        "system_prompt": new_system_prompt,
-                        "story_prompt": new_story_prompt
-                    }
-                    save_json(PROMPT_FILE, new_prompt_data)
-
-                    st.toast("✅ บันทึก Prompt เรียบร้อย!", icon="💾")
-                    time.sleep(1)
-                    st.rerun()
-
-                except Exception as e:
-                    st.error(f"❌ Error: {e}")
-
-        with col2:
-            st.button(
-                "🔄 Discard & Reset All",
-                key="btn_reset_prompts",
-                on_click=lambda: st.session_state.update({
-                    "input_system_prompt": current_system,
-                    "input_story_prompt": current_story
-                })
-            )
+        prompt_editor()
 
     st.divider()
 
     with st.expander("🛠️ Debug: Raw Dialog (JSON)", expanded=False):
-        dialog_text = json.dumps(dialog_db, indent=4, ensure_ascii=False)
-        edited_json_dialog = st.text_area(
-            "📝 แก้ไข JSON prompt ตรงนี้:",
-            value=dialog_text,
-            height=500,
-            key="dialog_editor"
-        )
-
-        # 3. ปุ่ม Save
-        col1, col2 = st.columns([1, 1])
-
-        with col1:
-            if st.button("💾 Save & Refresh Dialog", key="btn_save_dialog"):
-                try:
-                    new_d_data = json.loads(edited_json_dialog)
-                    save_json(DIALOG_FILE, new_d_data)
-
-                    st.toast("✅ Database Updated Successfully!", icon="💾")
-                    time.sleep(1.5)
-
-                    st.rerun()
-
-                except json.JSONDecodeError as e:
-                    st.error(f"❌ JSON พังครับเช็ควงเล็บหรือลูกน้ำใหม่!\nError: {e}")
-                except Exception as e:
-                    st.error(f"❌ Error: {e}")
-
-        with col2:
-            st.button(
-                "🔄 Reset View Dialog",
-                key="btn_reset_dialog",
-                on_click=lambda: st.session_state.update({"dialog_editor": dialog_text})
-            )
+        json_editor("dialog", "📝 แก้ไข JSON dialog ตรงนี้:", dialog_store.load, save_dialog, depth=1,
+                    item_label=lambda node, k: f"#{k} {node[k].get('role', '?')}: {str(node[k].get('content', ''))[:30]}")
 
     st.divider()
 
@@ -323,15 +663,13 @@ with st.sidebar:
     with tab_db:
         st.write("จัดการข้อมูลผู้เล่น (db.json)")
 
-        # Download
-        if os.path.exists(DB_FILE):
-            with open(DB_FILE, "rb") as f:
-                st.download_button(
-                    label="⬇️ Download DB",
-                    data=f,
-                    file_name="db.json",
-                    mime="application/json"
-                )
+        # Download (export เป็นรูปแบบ db.json เสมอ ไม่ว่า backend ไหน)
+        st.download_button(
+            label="⬇️ Download DB",
+            data=world_store.export_bytes(),
+            file_name="db.json",
+            mime="application/json"
+        )
 
         # Upload
         uploaded_db = st.file_uploader("Upload DB", type=["json"], key="up_db")
@@ -339,7 +677,7 @@ with st.sidebar:
             try:
                 # แปลงไฟล์ที่อัปโหลดเป็น Dict แล้วเซฟทับ
                 new_data = json.load(uploaded_db)
-                save_json(DB_FILE, new_data)
+                save_db_edit(new_data, label="upload")
                 st.success("✅ อัปเดต DB สำเร็จ! (Reloading...)")
                 st.rerun()  # รีเฟรชหน้าจอทันที
             except Exception as e:
@@ -350,21 +688,22 @@ with st.sidebar:
         st.write("จัดการประวัติแชท (dialog.json)")
 
         # Download
-        if os.path.exists(DIALOG_FILE):
-            with open(DIALOG_FILE, "rb") as f:
-                st.download_button(
-                    label="⬇️ Download Dialog",
-                    data=f,
-                    file_name="dialog.json",
-                    mime="application/json"
-                )
+        if os.path.exists(dialog_store.snapshot_path) or os.path.exists(dialog_store.journal_path):
+            # รวม snapshot + journal เป็น dialog.json ก้อนเดียวตอน export
+            st.download_button(
+                label="⬇️ Download Dialog",
+                data=dialog_store.export_bytes(),
+                file_name="dialog.json",
+                mime="application/json"
+            )
 
         # Upload
         uploaded_dialog = st.file_uploader("Upload Dialog", type=["json"], key="up_dialog")
         if uploaded_dialog:
             try:
                 new_data = json.load(uploaded_dialog)
-                save_json(DIALOG_FILE, new_data)
+                detach_debug(new_data)
+                dialog_store.replace(new_data)
                 # โหลดเข้า session state ด้วยถ้าจำเป็น
                 # st.session_state.chat_history = new_data
                 st.success("✅ อัปเดต Dialog สำเร็จ!")
@@ -401,39 +740,126 @@ with st.sidebar:
             except Exception as e:
                 st.error(f"ไฟล์เสียหาย: {e}")
 
+    st.divider()
+
+    # ย้อนเวลา: สร้าง state จาก snapshot ที่ใกล้ที่สุด + delta ของแต่ละเทิร์น
+    with st.expander("⏪ Rewind (Version Log)", expanded=False):
+        versions = version_log.versions()
+        if len(versions) > 1:
+            picked = st.selectbox(
+                "ย้อนไปหลังเทิร์น:",
+                [v["v"] for v in reversed(versions)],
+                format_func=lambda v: next(
+                    f"v{m['v']} · {m.get('time') or '-'} · {m.get('label') or m['kind']}" for m in versions if m["v"] == v
+                ),
+                key="rewind_version"
+            )
+            if st.button("⏪ Rewind", key="btn_rewind", disabled=turn_busy):
+                rewind_to(picked)
+                st.toast(f"⏪ ย้อนกลับไป v{picked} แล้ว")
+                st.rerun()
+            # หรือแตกเป็นแคมเปญใหม่จากจุดนั้น แคมเปญนี้ยังอยู่ครบ
+            branch_slot = st.text_input("ชื่อแคมเปญใหม่ (Branch)", key="branch_slot")
+            if st.button("🌿 Branch", key="btn_branch", disabled=turn_busy or not branch_slot):
+                try:
+                    branch_to(picked, branch_slot)
+                    select_campaign(branch_slot)
+                    st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
+        else:
+            st.caption("ยังไม่มีเทิร์นให้ย้อน")
+
+    # สรุปเนื้อเรื่องที่ model เห็นแทนประวัติเก่า
+    with st.expander("📜 Campaign Summary", expanded=False):
+        summary, summary_upto = summary_store.for_history(st.session_state.chat_history)
+        if summary:
+            st.caption(f"ครอบคลุม {summary_upto} ข้อความแรก")
+            st.write(summary)
+        else:
+            st.caption("ยังไม่มีสรุป (จะเริ่มสรุปเมื่อประวัติยาวพอ)")
+
+    # ค้นเหตุการณ์ใน log ตามวันในเกม (รวม log เก่าที่อยู่ใน archive)
+    with st.expander("🗓️ World Log", expanded=False):
+        log_day = st.text_input("วันที่ (YYYY-MM-DD)", value=str(db['world'].get('current_time', ''))[:10], key="log_day")
+        try:
+            entries = log_archive.query(log_day, log=db.get('log'), log_base=db.get('log_base', 0))
+        except ValueError:
+            st.caption("รูปแบบวันที่ไม่ถูกต้อง")
+        else:
+            for entry in entries:
+                st.caption(f"{entry['time'][11:16]} · {entry['text']}")
+            if not entries:
+                st.caption("ไม่มีเหตุการณ์ในวันนั้น")
+            st.caption(f"log ใน DB {len(db.get('log') or [])} รายการ · archive {db.get('log_base', 0)} รายการ")
+
+    # เวลา / token / ขนาด payload ต่อขั้นของเทิร์นล่าสุดๆ ของ session นี้
+    with st.expander("📈 Metrics", expanded=False):
+        metrics_panel()
+
     st.divider()
     # 6. SYSTEM CONTROLS
     if st.button("🗑️ Reset Story", type="primary", use_container_width=True):
 
         try:
-            # ก็อปปี้ไฟล์ db_backup.json มาทับ db.json
-            shutil.copy('db_backup.json', 'db.json')
+            # เอา db_backup.json มาทับ DB ปัจจุบัน (ผ่าน store จะได้ใช้ได้ทั้ง json และ sqlite)
+            with open('db_backup.json', 'r', encoding='utf-8') as f:
+                world_store.save(json.load(f))
+            # เริ่มแคมเปญใหม่: version log เริ่มนับจาก backup (ถ้าแค่อยากย้อนเทิร์น ใช้ Rewind แทน)
+            version_log.clear()
+            version_log.ensure_base(world_store.get(), 0)
             print("[System]: Database restored from backup.")
         except FileNotFoundError:
             st.error("ไม่พบไฟล์ db_backup.json! กรุณาสร้างไฟล์ backup ไว้ก่อนครับ")
 
         st.session_state.chat_history = []
-        save_json(DIALOG_FILE, [])
+        st.session_state.previous_story = []
+        dialog_store.clear()
+        summary_store.clear()
+        log_archive.clear()
         st.rerun()
 
 # --- MAIN CHAT ---
 st.header("🌊 One Piece AI RPG: Persistent World")
 
 # Render History
-for message in st.session_state.chat_history:
+# แสดงเฉพาะข้อความล่าสุดตามหน้าต่าง ที่เก่ากว่านั้นกด "โหลดเก่ากว่า" เพิ่มทีละหน้า
+if "history_window" not in st.session_state:
+    st.session_state.history_window = HISTORY_PAGE_SIZE
+
+history = st.session_state.chat_history
+window_start = max(0, len(history) - st.session_state.history_window)
+if window_start > 0:
+    if st.button(f"⬆️ โหลดข้อความเก่ากว่า ({window_start} ข้อความที่ซ่อนอยู่)", key="btn_load_older"):
+        st.session_state.history_window += HISTORY_PAGE_SIZE
+        st.rerun()
+
+for idx in range(window_start, len(history)):
+    message = history[idx]
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
         # แสดง System Log เฉพาะฝั่ง Assistant (AI)
         if message["role"] == "assistant":
             with st.expander("🔍 System Log (Debug & Cross-check)"):
+                # โหลด debug จาก side store เฉพาะตอนกดดูเท่านั้น
+                if not st.toggle("โหลด Debug", key=f"dbg_{message.get('id', idx)}"):
+                    continue
+                debug = debug_store.get(message.get("debug_ref"))
+
                 # สร้าง Tab 3 อันเพื่อแยกข้อมูลให้ดูง่าย
                 tab_json, tab_compare = st.tabs(["💾 JSON Data", "🆚 GPT vs Gemini"])
 
                 # Tab 1: ข้อมูล JSON ที่เอาไปอัปเดต DB
                 with tab_json:
                     # ใช้ .get กัน Error กรณีข้อความเก่าไม่มี key นี้
-                    st.code(message.get("debug_json", "{}"), language="json")
+                    st.code(debug.get("debug_json", "{}"), language="json")
+                    # ผลการ apply: key ไหนถูกเขียน key ไหนถูกปฏิเสธเพราะอะไร
+                    if debug.get("changes"):
+                        st.json(debug["changes"], expanded=False)
+                    # สิ่งที่ parser ต้องซ่อมก่อนอ่าน JSON ได้ (comment, comma เกิน, ถูกตัดจบ ...)
+                    if debug.get("repairs"):
+                        st.caption("🔧 " + ", ".join(debug["repairs"]))
 
                 # Tab 2: เปรียบเทียบ Raw Response
                 with tab_compare:
@@ -443,250 +869,95 @@ for message in st.session_state.chat_history:
                         st.markdown("### 🤖 GPT-4o (Draft)")
                         st.caption("ร่างแรกก่อนตรวจ")
                         # ใช้ text_area หรือ code เพื่อให้ scroll ได้ถ้าข้อความยาว
-                        st.code(message.get("gpt_raw", "No Data"), language="markdown")
+                        st.code(debug.get("gpt_raw", "No Data"), language="markdown")
 
                     with c2:
                         st.markdown("### 👨‍🏫 Gemini (Final)")
                         st.caption("ผ่านการ Cross-check แล้ว")
-                        st.code(message.get("gemini_raw", "No Data"), language="markdown")
+                        st.code(debug.get("gemini_raw", "No Data"), language="markdown")
+
+TURN_STAGE_LABELS = {
+    "": "รอคิว...",
+    "context": "เตรียมข้อมูลโลก...",
+    "gemini": "Gemini กำลังแต่งเนื้อเรื่อง...",
+    "gpt": "GPT กำลังตรวจและคำนวณผล...",
+    "repair": "กำลังซ่อม JSON ที่อ่านไม่ได้...",
+    "summary": "กำลังสรุปเนื้อเรื่องเก่า...",
+}
+
+
+@st.fragment(run_every=0.5)
+def render_turn_progress(job):
+    # poll สถานะเทิร์นที่กำลังรันอยู่ใน worker (rerun แค่ส่วนนี้ ไม่ใช่ทั้งหน้า)
+    snap = job.snapshot()
+    if job.active:
+        with st.chat_message("assistant"):
+            st.caption(f"⏳ {TURN_STAGE_LABELS.get(snap['stage'], snap['stage'])} ({snap['elapsed']:.0f}s)")
+            if snap["partial"]:
+                st.markdown(snap["partial"] + "▌")
+            if st.button("⏹️ Stop generating", key=f"stop_{job.id}"):
+                job.cancel()
+        return
+
+    # เทิร์นจบแล้ว เอาผลเข้า session แล้ว rerun ทั้งหน้าให้ sidebar/ประวัติอัปเดต
+    st.session_state.consumed_jobs.add(job.id)
+    if job.status == "done":
+        st.session_state.chat_history.append(job.result["message"])
+        st.session_state.prompt_stats = job.result["prompt_stats"]
+    else:
+        # เทิร์นไม่ได้ commit ข้อความ user ก็ไม่ได้ถูกบันทึก เอาออกจากหน้าจอด้วย
+        history = st.session_state.chat_history
+        saved_ids = {m.get("id") for m in dialog_store.load()}
+        if history and history[-1].get("role") == "user" and history[-1].get("id") not in saved_ids:
+            history.pop()
+        if job.status == "cancelled":
+            st.session_state.turn_notice = "⏹️ หยุดการสร้างเนื้อเรื่องแล้ว (ไม่ได้บันทึกเทิร์นนี้)"
+        else:
+            st.session_state.turn_notice = f"Error: {job.error} (ไม่ได้บันทึกเทิร์นนี้ ลองส่งใหม่ได้)"
+    st.rerun()
+
+
+current_job = turn_executor.latest(session_id)
+if current_job is not None and current_job.id not in st.session_state.consumed_jobs:
+    render_turn_progress(current_job)
+
+if st.session_state.get("turn_notice"):
+    st.error(st.session_state.pop("turn_notice"))
 
 # Handle Input
-if prompt := st.chat_input("สั่งการกัปตัน..."):
+if prompt := st.chat_input("สั่งการกัปตัน...", disabled=turn_busy):
 
     # === CHECK CLEAR COMMAND ===
     if prompt.strip() in ["เคลียร์เนื้อเรื่อง", "ล้างเนื้อเรื่อง", "reset story", "clear"]:
         st.session_state.chat_history = []
-        save_json(DIALOG_FILE, [])
+        st.session_state.previous_story = []
+        st.session_state.history_window = HISTORY_PAGE_SIZE
+        dialog_store.clear()
+        summary_store.clear()
         st.success("ล้างประวัติเรียบร้อยแล้ว!")
         st.rerun()
 
     # 1. User Message
-    with st.chat_message("user"):
-        st.markdown(prompt)
-
-    # บันทึก User ลง RAM และ ลงไฟล์ทันที
-    st.session_state.chat_history.append({"role": "user", "content": prompt})
-    save_json(DIALOG_FILE, st.session_state.chat_history)
-
-    # Prepare Data
-    curr_loc_name = p['current_location']
-    loc_data = db['locations'].get(curr_loc_name, {})
-
-    context = f"""
-    Previous story:{previous_story}
-    
-    [CONTEXT DATA]
-        Player: {json.dumps(p, ensure_ascii=False)}
-        World Status: {json.dumps(db['world'], ensure_ascii=False)}
-        Current Location Info: {json.dumps(loc_data, ensure_ascii=False)}
-        Settings: {json.dumps(db['settings'], ensure_ascii=False)}
-        Characters:  {json.dumps(db['characters'], ensure_ascii=False)}
-    """
-    with st.spinner("Calculating..."):
-        gemini_story = ask_gemini_story(
-            prompt= prompt,
-            context= context
-         )
-    if len(previous_story) == 3:
-        previous_story.clear()
-    previous_story.append(gemini_story)
-
-    story = f"Story: {gemini_story}"
-    outout_format = f"""
-    [STRICT OUTPUT FORMAT]
-        You must follow this layout exactly:
-        1. **Final story after verify imd improve.
-        2. **[Result]:** (Summary: Success/Failure, HP loss, Location change status, etc)   
-        3. **Choices:**
-            1. [Choice A]
-            2. [Choice B]
-            3. [Choice C]        
-        4. **JSON Block:** strictly at the end.
-           - **PURE JSON ONLY:** Do NOT include comments (e.g., // or /* */) inside the JSON block.
-           - **NO TRAILING COMMAS:** Ensure the last item in a list/object does not have a comma.
-           Format: 
-           ```json 
-           {{ 
-             "time_passed": {{ "days": 0, "hours": 0, "minutes": 0 }},
-             "log_entry": "Summary of what happened",
-             "player": {{...}}, 
-             "world": {{...}},
-             "characters": {{...}},
-             "locations": {{...}},
-             "unique_items": {{...}}
-           }} 
-           ```
-    """
-    context_data = f"""
-    [CONTEXT DATA]
-    Player: {json.dumps(p, ensure_ascii=False)}
-    World Status: {json.dumps(db['world'], ensure_ascii=False)}
-    Current Location Info: {json.dumps(loc_data, ensure_ascii=False)}
-    Settings: {json.dumps(db['settings'], ensure_ascii=False)}
-    Characters:  {json.dumps(db['characters'], ensure_ascii=False)}
-    """
-    raw_template = prompt_data.get("system_prompt", "")
-
-    system_prompt = raw_template + "\n" + story + "\n" + outout_format + "\n" + context_data
-
-    messages_payload = [{"role": "system", "content": system_prompt}]
-    # ส่งประวัติ 6 ข้อความล่าสุดให้ AI อ่าน (ไม่ส่งทั้งหมดเพื่อประหยัด Token)
-    for msg in st.session_state.chat_history[-6:]:
-        if msg["role"] != "system":
-            messages_payload.append({"role": msg["role"], "content": msg["content"]})
-
-    with st.spinner("Calculating..."):
-        try:
-            response = client.chat.completions.create(
-                model="gpt-5.2-pro",
-                messages=messages_payload,
-                temperature=0.5,
-            )
-            gpt_content = response.choices[0].message.content
-
-            # Extract JSON
-            json_match = re.search(r"```json(.*?)```", gpt_content, re.DOTALL)
-
-            story_text = gpt_content
-            json_str = ""
-
-            if json_match:
-                story_text = gpt_content.replace(json_match.group(0), "").strip()
-                print(story_text)  # แสดงเนื้อเรื่อง
-
-                # ดึง JSON string ออกมาแปลงเป็น Dict
-                json_str = json_match.group(1).strip()
-
+    # แสดงบนหน้าจอทันที แต่ลงไฟล์พร้อมคำตอบตอนเทิร์น commit (เทิร์นล้ม = ไม่มีอะไรถูกบันทึก)
+    st.session_state.chat_history.append({"id": DialogStore.new_id(), "role": "user", "content": prompt})
+
+    # ส่งเทิร์นไปทำใน worker thread แล้ว rerun ทันที ให้ UI กลับมาใช้งานได้ระหว่างรอ LLM
+    # ผูกค่าไว้กับ default args ตอนนี้เลย worker จะได้ไม่ไปอ่านตัวแปรของ rerun ถัดไป
+    def run_turn(job, prompt=prompt, turn_history=list(st.session_state.chat_history),
+                 layout=st.session_state.prompt_layout, previous_story=st.session_state.previous_story,
+                 pipeline=turn_pipeline):
+        result = pipeline.run(job, prompt, turn_history, prompt_data, previous_story, layout)
+        if result.get("fold_summary"):
+            # fold summary เรียก Gemini อีกรอบ ให้ไปทำเบื้องหลังหลังเทิร์นนี้ส่งผลแล้ว (ล้มก็ลองใหม่เทิร์นหน้า)
+            def fold(fold_job, folded=turn_history + [result["message"]]):
                 try:
-                    data = json.loads(json_str)
-
-                    # 1. จัดการเวลา (Time) - เช็คที่ชั้นนอกสุดได้เลย
-                    t = data.get('time_passed', {})
-                    if t:
-                        # สมมติว่ามีฟังก์ชัน add_time อยู่แล้ว
-                        add_time(db, t.get('days', 0), t.get('hours', 0), t.get('minutes', 0))
-
-                    # 2. จัดการ Log
-                    new_log = data.get('log_entry')
-                    if new_log:
-                        # ตัดข้อความถ้ามันยาวเกินไป กัน database บวม
-                        db.setdefault('log', []).append(new_log[:150])
-
-                    # 3. อัปเดต Player (ไม่ต้องเข้า 'updates' แล้ว ดึงจาก root เลย)
-                    if 'player' in data:
-                        p_up = data['player']
-
-                        # Inventory (List)
-                        if 'inventory' in p_up: db['player']['inventory'] = p_up['inventory']
-
-                        # Location (String)
-                        if 'current_location' in p_up:
-                            db['player']['current_location'] = p_up['current_location']
-
-                        # Crew (List)
-                        if 'crew' in p_up: db['player']['crew'] = p_up['crew']
-
-                        # Abilities (List)
-                        if 'traits' in p_up and 'abilities' in p_up['traits']:
-                            if 'traits' not in db['player']: db['player']['traits'] = {}
-                            db['player']['traits']['abilities'] = p_up['traits']['abilities']
-
-                        # Stats (Dict)
-                        if 'stats' in p_up: db['player']['stats'].update(p_up['stats'])
-
-                        # Reputation (Dict)
-                        if 'reputation' in p_up:
-                            if 'reputation' not in db['player']: db['player']['reputation'] = {}
-                            db['player']['reputation'].update(p_up['reputation'])
-
-                        # Vehicle (Dict)
-                        if 'vehicle' in p_up:
-                            if 'vehicle' not in db['player']: db['player']['vehicle'] = {}
-                            if 'status' in p_up['vehicle']:
-                                if 'status' not in db['player']['vehicle']: db['player']['vehicle']['status'] = {}
-                                db['player']['vehicle']['status'].update(p_up['vehicle']['status'])
-
-                        # Devil Fruit (Dict)
-                        if 'devil_fruit' in p_up:
-                            if 'devil_fruit' not in db['player']: db['player']['devil_fruit'] = {}
-                            db['player']['devil_fruit'].update(p_up['devil_fruit'])
-
-                        # Haki (Dict)
-                        if 'haki' in p_up:
-                            if 'haki' not in db['player']: db['player']['haki'] = {}
-                            db['player']['haki'].update(p_up['haki'])
-
-                    # 4. อัปเดต World / Timeline
-                    if 'world' in data:
-                        w_up = data['world']
-                        if 'timeline' in w_up: db['world']['timeline'] = w_up['timeline']
-                        # เผื่อ AI ส่งแก้ Events
-                        if 'events' in w_up: db['world']['events'] = w_up['events']
-
-                    # 5. อัปเดต Characters (NPCs)
-                    if 'characters' in data:
-                        if 'characters' not in db: db['characters'] = {}
-                        for name, cdata in data['characters'].items():
-                            if name not in db['characters']:
-                                # เจอตัวละครใหม่: สร้างใหม่เลย
-                                db['characters'][name] = cdata
-                            else:
-                                # ตัวละครเก่า: ดึงออบเจกต์มาพักไว้ในตัวแปร target_char ก่อน (สำคัญ!)
-                                target_char = db['characters'][name]
-
-                                # จากนั้นค่อยอัปเดตค่าต่างๆ ผ่านตัวแปร target_char
-                                if 'status' in cdata: target_char['status'] = cdata['status']
-                                if 'location' in cdata: target_char['location'] = cdata['location']
-                                # Stats
-                                if 'stats' in cdata:
-                                    # กันเหนียวเผื่อใน DB เก่ายังไม่มี field stats
-                                    if 'stats' not in target_char: target_char['stats'] = {}
-                                    target_char['stats'].update(cdata['stats'])
-                                # Reputation
-                                if 'reputation' in cdata:
-                                    if 'reputation' not in target_char: target_char['reputation'] = {}
-                                    target_char['reputation'].update(cdata['reputation'])
-                                # >>> ส่วน Friendship (ทำงานได้แล้วเพราะมี target_char แล้ว) <<<
-                                if 'friendship' in cdata:
-                                    target_char['friendship'] = cdata['friendship']
-
-                    # 6. รองรับ New Discoveries (ตามกฎข้อ 4 ใน Prompt)
-                    # ถ้าเจอเกาะใหม่ ให้เพิ่มเข้า Location DB
-                    if 'locations' in data:
-                        if 'locations' not in db: db['locations'] = {}
-                        db['locations'].update(data['locations'])
-
-                    # ถ้าเจอไอเทมระดับโลกชิ้นใหม่
-                    if 'unique_items' in data:
-                        if 'unique_items' not in db: db['unique_items'] = {}
-                        db['unique_items'].update(data['unique_items'])
-
-                    # Save ลงไฟล์
-                    save_json(DB_FILE, db)
-                    # print("[System]: Database Updated successfully.")
-
-                except json.JSONDecodeError:
-                    print(f"[System Error]: AI ส่ง JSON ผิดรูปแบบ Parsing Failed.")
+                    pipeline.fold_summary(fold_job, folded)
                 except Exception as e:
-                    print(f"[System Error]: Update Failed ({e})")
-
-            # 2. Assistant Message (Save to File)
-            ai_msg = {"role": "assistant", "content": story_text}
-            if json_str: ai_msg["debug_json"] = json_str
-
-            # st.session_state.chat_history.append(ai_msg)
-            st.session_state.chat_history.append({
-                "role": "assistant",
-                "content": story_text,
-                "debug_json": json_str,
-                "gpt_raw": gpt_content,
-                "gemini_raw": gemini_story
-            })
-
-
-            save_json(DIALOG_FILE, st.session_state.chat_history)  # <--- บันทึกถาวรตรงนี้
+                    print(f"[Summary Error]: {e}")
+                    raise
 
-            st.rerun()
+            turn_executor.submit(job.session_id, fold, timeout=TURN_TIMEOUT, background=True)
+        return result
 
-        except Exception as e:
-            st.error(f"Error: {e}")
\ No newline at end of file
+    turn_executor.submit(session_id, run_turn, timeout=TURN_TIMEOUT)
+    st.rerun()
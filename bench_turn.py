@@ -0,0 +1,474 @@
+"""End-to-end turn benchmark with stub LLM providers.
+
+Drives TurnPipeline.run exactly like the app does (context build, Gemini
+story, streamed GPT reply, JSON extraction, delta merge, DB / version log /
+dialog writes, summary fold) against local stubs with configurable latency
+and output size, on synthetic worlds and campaigns.
+
+    python bench_turn.py --characters 10,1000,10000 --history 10,1000,10000 --turns 50
+    python bench_turn.py --backend sqlite --llm-latency-ms 50 --tracemalloc --json bench.json
+    python bench_turn.py --replay 2000 --characters 10,10000   # delta_engine apply / replay only
+
+Reports per-stage latency percentiles (ms), bytes written per turn, the
+final on-disk size and memory use for every (characters, campaign length)
+pair. Stages nest: ``gpt`` covers the stream, so it includes the ``merge``,
+``db_save`` and ``version_log`` work done when the state block closes;
+``extract`` is the reply parsing inside that stream (minus the state-block
+callback) plus the JSON repair call, if one was needed. ``summary`` is
+the background fold run after the turn and is not part of ``total``.
+"""
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import turn_pipeline
+from debug_store import DebugStore
+from delta_engine import replay_changes
+from dialog_store import DialogStore
+from game_state import TIME_FMT
+from memory_index import MemoryIndex
+from metrics import Metrics
+from prompt_builder import PromptLayout
+from router import ModelRouter
+from scheduler import TimelineCache
+from sqlite_store import SqliteWorldStore
+from state_store import WorldStore
+from story_summary import SummaryStore
+from turn_pipeline import TurnPipeline
+from turn_worker import TurnJob
+from version_log import VersionLog
+from world_log import LogArchive, log_record
+
+THAI_WORDS = ["คลื่น", "ทะเล", "ดาบ", "โจรสลัด", "ทหารเรือ", "เกาะ", "พายุ", "สมบัติ", "ลูกเรือ", "กัปตัน",
+              "ค่าหัว", "ผลปีศาจ", "ฮาคิ", "เรือ", "หมอก", "ปืนใหญ่", "แผนที่", "เมือง", "ป่า", "ภูเขาไฟ"]
+FACTIONS = [f"Faction {i}" for i in range(20)]
+ACTIONS = ["สำรวจ {loc}", "คุยกับ {npc}", "สู้กับโจรสลัดแถวนี้", "ล่องเรือไป {loc}", "พักผ่อนที่ท่าเรือ", "ถาม {npc} เรื่องสมบัติ"]
+STAGES = ["context", "memory", "gemini", "gpt", "extract", "merge", "db_save", "version_log", "dialog_append",
+          "summary", "total"]
+
+
+def thai_text(rng, chars):
+    words = []
+    size = 0
+    while size < chars:
+        word = rng.choice(THAI_WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+# ================= SYNTHETIC DATA =================
+def make_world(n_characters, seed=0, template_path='db_backup.json'):
+    rng = random.Random(seed)
+    db = {}
+    if os.path.exists(template_path):
+        with open(template_path, 'r', encoding='utf-8') as f:
+            db = json.load(f)
+    db = copy.deepcopy(db)
+    db.setdefault('world', {})['current_time'] = "1524-01-01 00:00:00"
+    db.setdefault('settings', {}).setdefault('action_costs', {
+        "chat": {"minutes": 15}, "fight_skirmish": {"minutes": 45}, "explore": {"hours": 3}, "rest": {"hours": 8}
+    })
+
+    n_locations = max(5, n_characters // 20)
+    names = [f"Island {i}" for i in range(n_locations)]
+    db['locations'] = {}
+    for i, name in enumerate(names):
+        links = {names[(i + 1) % n_locations]: None, names[rng.randrange(n_locations)]: None}
+        links.pop(name, None)
+        db['locations'][name] = {
+            "region": f"Sea {i % 4}", "owner_npc": f"NPC {rng.randrange(max(1, n_characters)):05d}",
+            "danger_lvl": rng.randrange(100), "status": "Calm",
+            "connections": {t: {"travel_days": rng.randint(1, 5), "req_item": "None", "day_req_for_lock": 1} for t in links},
+        }
+
+    db['characters'] = {}
+    for i in range(n_characters):
+        db['characters'][f"NPC {i:05d}"] = {
+            "status": "Active", "current_location": rng.choice(names), "faction": rng.choice(FACTIONS),
+            "friendship": rng.randint(-100, 100),
+            "traits": {"race": "Human", "abilities": [thai_text(rng, 20)], "description": thai_text(rng, 120)},
+            "stats": {"hp": rng.randint(10, 5000), "strength": rng.randint(1, 500), "speed": rng.randint(1, 500)},
+            "reputation": {"Marines": 0, "Pirates": 0},
+        }
+
+    db['world']['timeline'] = [{
+        "id": f"EVT_{i:04d}", "name": f"Event {i}", "status": "Pending",
+        "start_time": f"1524-{1 + i % 12:02d}-{1 + i % 28:02d} 00:00:00",
+        "deadline_time": f"1525-{1 + i % 12:02d}-{1 + i % 28:02d} 00:00:00",
+        "description": thai_text(rng, 60), "consequence_if_missed": thai_text(rng, 40),
+    } for i in range(max(5, n_characters // 50))]
+    player = db.setdefault('player', {"name": "Bench", "stats": {}})
+    player['current_location'] = names[0]
+    db['log'] = []
+    return db
+
+
+def make_campaign(n_turns, db, seed=0):
+    """Dialog of ``n_turns`` finished turns (user + assistant message each); their log entries go into ``db``."""
+    rng = random.Random(seed + 1)
+    messages = []
+    start = datetime.strptime(db['world']['current_time'], TIME_FMT)
+    for i in range(n_turns):
+        messages.append({"id": f"u{i:06d}", "role": "user", "content": next_action(rng, db)})
+        messages.append({"id": f"a{i:06d}", "role": "assistant", "content": thai_text(rng, 800)})
+        at = (start - timedelta(hours=n_turns - i)).strftime(TIME_FMT)
+        db.setdefault('log', []).append(log_record(at, thai_text(rng, 120)))
+    return messages
+
+
+def next_action(rng, db):
+    return rng.choice(ACTIONS).format(loc=rng.choice(list(db['locations'])), npc=rng.choice(list(db['characters']) or ["ใคร"]))
+
+
+def make_delta(rng, db):
+    """A state block like the ones GPT returns: time, log, player stats and one NPC."""
+    npc = rng.choice(list(db['characters'])) if db['characters'] else None
+    delta = {
+        "time_passed": {"days": 0, "hours": rng.randint(0, 6), "minutes": rng.choice([0, 15, 30])},
+        "log_entry": thai_text(rng, 60),
+        "player": {"stats": {"hp": rng.randint(100, 600), "stamina": rng.randint(10, 120)}},
+    }
+    if npc:
+        delta["characters"] = {npc: {"current_location": rng.choice(list(db['locations'])),
+                                     "friendship": rng.randint(-100, 100)}}
+    return delta
+
+
+# ================= STUB PROVIDERS =================
+class StubStoryModel:
+    """Stands in for a Gemini GenerativeModel: fixed latency, ``chars`` of Thai text."""
+
+    def __init__(self, latency, chars, rng):
+        self.latency = latency
+        self.chars = chars
+        self.rng = rng
+
+    def generate_content(self, contents, **kwargs):
+        time.sleep(self.latency)
+        return SimpleNamespace(text=thai_text(self.rng, self.chars))
+
+
+class StubChatClient:
+    """Stands in for openai.OpenAI: ``chat.completions.create`` streams a story plus a state JSON block."""
+
+    def __init__(self, latency, chars, db, rng, chunk_chars=24):
+        self.latency = latency
+        self.chars = chars
+        self.db = db
+        self.rng = rng
+        self.chunk_chars = chunk_chars
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def reply(self):
+        rng = self.rng
+        delta = make_delta(rng, self.db)
+        return (f"{thai_text(rng, self.chars)}\n\n**[Result]:** Success\n**Choices:**\n1. A\n2. B\n3. C\n\n"
+                f"```json\n{json.dumps(delta, ensure_ascii=False, indent=2)}\n```")
+
+    def create(self, stream=False, **params):
+        text = self.reply()
+        usage = SimpleNamespace(prompt_tokens=len(json.dumps(params.get("messages"), ensure_ascii=False)) // 4,
+                                completion_tokens=len(text) // 4,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=0))
+        if not stream:
+            time.sleep(self.latency)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+        return self._stream(text, usage)
+
+    def _stream(self, text, usage):
+        time.sleep(self.latency)
+        for i in range(0, len(text), self.chunk_chars):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + self.chunk_chars]))],
+                                  usage=None)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+
+# ================= MEASUREMENT =================
+class StageClock:
+    """Accumulates wall time per stage for the current turn."""
+
+    def __init__(self):
+        self.turn = {}
+
+    def add(self, stage, seconds):
+        self.turn[stage] = self.turn.get(stage, 0.0) + seconds
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+
+class BenchJob(TurnJob):
+    """TurnJob that turns the pipeline's stage reports into timings."""
+
+    REPORTED = {"gemini", "gpt", "summary"}
+
+    def __init__(self, clock):
+        super().__init__("bench", None, timeout=3600)
+        self.clock = clock
+        self.started_at = time.time()
+        self.status = "running"
+        self._stage_start = None
+
+    def report(self, stage=None, partial=None):
+        if stage is not None:
+            self.close_stage()
+            self._stage_start = (stage, time.perf_counter())
+        super().report(stage=stage, partial=partial)
+
+    def close_stage(self):
+        if self._stage_start is not None:
+            stage, start = self._stage_start
+            if stage in self.REPORTED:
+                self.clock.add(stage, time.perf_counter() - start)
+            self._stage_start = None
+
+
+def io_written():
+    # wchar = byte ที่ process สั่งเขียนทั้งหมด (Linux) ถ้าไม่มีค่อยไปนับขนาดไฟล์แทน
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def dir_size(path):
+    total = 0
+    for dirpath, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def max_rss_kb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# ================= RUN =================
+# ตัวจริงของ function ที่ถูกหุ้มจับเวลา (คืนค่าเดิมหลังจบแต่ละ case)
+build_context_data = turn_pipeline.build_context_data
+render_state = turn_pipeline.render_state
+apply_delta = turn_pipeline.apply_delta
+
+
+def run_case(n_characters, n_history, n_turns, args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='bench_turn_')
+    try:
+        db = make_world(n_characters, args.seed)
+        history = make_campaign(n_history, db, args.seed)
+        db_path = os.path.join(workdir, 'db.json')
+        if args.backend == "sqlite":
+            world_store = SqliteWorldStore(os.path.join(workdir, 'world.sqlite'))
+        else:
+            world_store = WorldStore(db_path)
+        world_store.save(db)
+        dialog_store = DialogStore(os.path.join(workdir, 'dialog.json'))
+        dialog_store.replace(history)
+        version_log = VersionLog(os.path.join(workdir, 'history'))
+        version_log.ensure_base(world_store.get(), len(history))
+
+        clock = StageClock()
+        # จับเวลาแต่ละขั้นโดยหุ้ม function / method ที่ pipeline เรียก (ไม่แก้ตัว pipeline)
+        turn_pipeline.build_context_data = clock.wrap("context", build_context_data)
+        turn_pipeline.render_state = clock.wrap("context", render_state)
+        turn_pipeline.apply_delta = clock.wrap("merge", apply_delta)
+        world_store.save = clock.wrap("db_save", world_store.save)
+        version_log.record = clock.wrap("version_log", version_log.record)
+        dialog_store.append_many = clock.wrap("dialog_append", dialog_store.append_many)
+        memory_index = MemoryIndex()
+        memory_index.sync = clock.wrap("memory", memory_index.sync)
+        memory_index.search = clock.wrap("memory", memory_index.search)
+
+        story = StubStoryModel(args.llm_latency_ms / 1000, args.story_chars, rng)
+        pipeline = TurnPipeline(
+            story_model=lambda instruction: story,
+            gpt_client=StubChatClient(args.llm_latency_ms / 1000, args.reply_chars, db, rng),
+            dialog_store=dialog_store,
+            debug_store=DebugStore(os.path.join(workdir, 'debug_store')),
+            world_store=world_store,
+            stream=not args.no_stream,
+            version_log=version_log,
+            summary_store=SummaryStore(os.path.join(workdir, 'summary.json')),
+            memory_index=memory_index,
+            mechanics=not args.no_mechanics,
+            router=ModelRouter() if args.router else None,
+            log_archive=None if args.no_log_archive else LogArchive(os.path.join(workdir, 'log_archive')),
+            timeline_cache=TimelineCache(),
+            metrics=Metrics(),
+        )
+        pipeline.character_index.get = clock.wrap("context", pipeline.character_index.get)
+        prompt_data = {"system_prompt": "Role: Game Master.\n" * 50, "story_prompt": "Write the story.\n{context}\n{previous_story}"}
+        layout = PromptLayout()
+        previous_story = []
+        timings = {stage: [] for stage in STAGES}
+        written_before = io_written()
+        size_before = dir_size(workdir)
+        if args.tracemalloc:
+            tracemalloc.start()
+
+        for _ in range(n_turns):
+            clock.turn = {}
+            prompt = next_action(rng, db)
+            # เหมือน app: ข้อความ user ลงไฟล์พร้อมคำตอบตอน commit
+            history.append({"id": DialogStore.new_id(), "role": "user", "content": prompt})
+            job = BenchJob(clock)
+            start = time.perf_counter()
+            # log ของ pipeline ไม่ต้องพิมพ์ออกมาระหว่างวัด
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = pipeline.run(job, prompt, list(history), prompt_data, previous_story, layout)
+            job.close_stage()
+            clock.add("total", time.perf_counter() - start)
+            # เวลา parse กระจายอยู่ใน stream ของ gpt อ่านจาก trace ของเทิร์น (หัก callback merge/save ไว้แล้ว)
+            for span in pipeline.metrics.recent(kind="turn")[-1].spans:
+                if span["name"] in ("extract", "json_repair"):
+                    clock.add("extract", span["ms"] / 1000)
+            history.append(result["message"])
+            if result["fold_summary"]:
+                # เหมือน app: fold เป็น job เบื้องหลังหลังเทิร์นส่งผลแล้ว ไม่นับรวมใน total
+                fold_job = BenchJob(clock)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    pipeline.fold_summary(fold_job, list(history))
+                fold_job.close_stage()
+            for stage in STAGES:
+                timings[stage].append(clock.turn.get(stage, 0.0))
+
+        traced_peak = None
+        if args.tracemalloc:
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        written_after = io_written()
+        size_after = dir_size(workdir)
+        return {
+            "characters": n_characters,
+            "history_turns": n_history,
+            "turns": n_turns,
+            "backend": args.backend,
+            "stages_ms": {
+                stage: {p: round(percentile(values, p) * 1000, 3) for p in (50, 95, 99)} | {"max": round(max(values) * 1000, 3)}
+                for stage, values in timings.items() if any(values)
+            },
+            "bytes_written_per_turn": (written_after - written_before) // n_turns if written_before is not None
+            else (size_after - size_before) // n_turns,
+            "disk_bytes": size_after,
+            "max_rss_kb": max_rss_kb(),
+            "tracemalloc_peak_bytes": traced_peak,
+        }
+    finally:
+        turn_pipeline.build_context_data = build_context_data
+        turn_pipeline.render_state = render_state
+        turn_pipeline.apply_delta = apply_delta
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_replay(n_characters, n_deltas, args):
+    """Throughput of delta_engine alone: apply ``n_deltas`` GPT-style deltas, then replay their ``applied`` lists."""
+    rng = random.Random(args.seed)
+    base = make_world(n_characters, args.seed)
+    deltas = [make_delta(rng, base) for _ in range(n_deltas)]
+    db = copy.deepcopy(base)
+    started = time.perf_counter()
+    applied = [apply_delta(db, delta).applied for delta in deltas]
+    apply_seconds = time.perf_counter() - started
+    replayed = copy.deepcopy(base)
+    started = time.perf_counter()
+    for changes in applied:
+        replay_changes(replayed, changes)
+    replay_seconds = time.perf_counter() - started
+    if replayed != db:
+        raise AssertionError("replay did not reproduce the applied state")
+    return {
+        "characters": n_characters, "deltas": n_deltas,
+        "apply_per_s": round(n_deltas / apply_seconds), "replay_per_s": round(n_deltas / replay_seconds),
+    }
+
+
+def print_report(result):
+    print(f"\n== {result['characters']} characters · {result['history_turns']} past turns · "
+          f"{result['turns']} measured turns · {result['backend']} ==")
+    print(f"{'stage':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, pct in result["stages_ms"].items():
+        print(f"{stage:<14}{pct[50]:>10.2f}{pct[95]:>10.2f}{pct[99]:>10.2f}{pct['max']:>10.2f}")
+    print(f"bytes written/turn: {result['bytes_written_per_turn']:,}   on disk: {result['disk_bytes']:,}"
+          + (f"   max RSS: {result['max_rss_kb']:,} KB" if result['max_rss_kb'] is not None else "")
+          + (f"   tracemalloc peak: {result['tracemalloc_peak_bytes']:,} B" if result['tracemalloc_peak_bytes'] else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--characters", default="10,1000,10000", help="comma-separated world sizes")
+    parser.add_argument("--history", default="10,1000,10000", help="comma-separated campaign lengths (turns already played)")
+    parser.add_argument("--turns", type=int, default=50, help="turns to run and measure per case")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="stub latency per LLM call")
+    parser.add_argument("--story-chars", type=int, default=1500, help="Gemini stub story length")
+    parser.add_argument("--reply-chars", type=int, default=1500, help="GPT stub story length (before the JSON block)")
+    parser.add_argument("--no-stream", action="store_true", help="non-streaming GPT reply")
+    parser.add_argument("--no-mechanics", action="store_true", help="disable the local mechanics engine")
+    parser.add_argument("--router", action="store_true", help="route turns through router.ModelRouter")
+    parser.add_argument("--no-log-archive", action="store_true", help="keep the whole log in the world DB")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report Python allocation peak (slower)")
+    parser.add_argument("--replay", type=int, default=0,
+                        help="only benchmark delta_engine: apply and replay this many deltas per world size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write all results to this file")
+    args = parser.parse_args()
+
+    results = []
+    if args.replay:
+        for n_characters in (int(x) for x in args.characters.split(',')):
+            result = run_replay(n_characters, args.replay, args)
+            print(f"{n_characters} characters · {args.replay} deltas: apply {result['apply_per_s']:,}/s   "
+                  f"replay {result['replay_per_s']:,}/s")
+            results.append(result)
+    else:
+        for n_characters in (int(x) for x in args.characters.split(',')):
+            for n_history in (int(x) for x in args.history.split(',')):
+                result = run_case(n_characters, n_history, args.turns, args)
+                print_report(result)
+                results.append(result)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
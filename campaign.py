@@ -0,0 +1,67 @@
+import os
+import re
+import shutil
+import tempfile
+
+from dialog_store import atomic_write_json
+
+CAMPAIGNS_DIR = 'campaigns'
+DEFAULT_CAMPAIGN = 'default'
+_SLOT_RE = re.compile(r'^[A-Za-z0-9_-]{1,40}$')
+
+
+def campaign_dir(slot):
+    # แคมเปญ default ใช้ไฟล์ที่ root เหมือนเดิม ของเก่าจะได้ไม่ต้องย้าย
+    if slot == DEFAULT_CAMPAIGN:
+        return ''
+    if not _SLOT_RE.match(slot or ''):
+        raise ValueError("ชื่อแคมเปญใช้ได้แค่ A-Z a-z 0-9 _ - (ไม่เกิน 40 ตัว)")
+    return os.path.join(CAMPAIGNS_DIR, slot)
+
+
+def campaign_paths(slot, files):
+    """Map each name in ``files`` (e.g. ``{"db": "db.json"}``) to its path inside the campaign slot."""
+    root = campaign_dir(slot)
+    return {key: os.path.join(root, name) for key, name in files.items()}
+
+
+def list_campaigns():
+    slots = [DEFAULT_CAMPAIGN]
+    if os.path.isdir(CAMPAIGNS_DIR):
+        slots += sorted(
+            name for name in os.listdir(CAMPAIGNS_DIR)
+            if _SLOT_RE.match(name) and name != DEFAULT_CAMPAIGN and os.path.isdir(os.path.join(CAMPAIGNS_DIR, name))
+        )
+    return slots
+
+
+def create_campaign(slot, files, db, messages=(), populate=None):
+    """Create a new slot seeded with ``db`` (and optionally a dialog). Returns its paths.
+
+    ``populate(paths)`` may write more files (version history, summary, ...);
+    it gets the paths inside the not-yet-visible slot. Raises ValueError if
+    the slot exists, including one created concurrently by another session.
+    """
+    root = campaign_dir(slot)
+    if slot == DEFAULT_CAMPAIGN or os.path.exists(root):
+        raise ValueError(f"มีแคมเปญ {slot} อยู่แล้ว")
+    # สร้างในโฟลเดอร์ชั่วคราวก่อน (ชื่อไม่ซ้ำกันแม้สร้างชื่อเดียวกันพร้อมกัน) เขียนครบทุกไฟล์แล้วค่อย rename
+    # คนอื่นจะไม่เห็นแคมเปญที่ยังสร้างไม่เสร็จ
+    os.makedirs(CAMPAIGNS_DIR, exist_ok=True)
+    tmp_root = tempfile.mkdtemp(prefix=f"{slot}.", suffix='.tmp', dir=CAMPAIGNS_DIR)
+    try:
+        atomic_write_json(os.path.join(tmp_root, files["db"]), db)
+        atomic_write_json(os.path.join(tmp_root, files["dialog"]), list(messages))
+        if populate is not None:
+            populate({key: os.path.join(tmp_root, name) for key, name in files.items()})
+        try:
+            os.replace(tmp_root, root)
+        except OSError:
+            # อีก session สร้างชื่อนี้ไปก่อนระหว่างที่เราเขียนอยู่ (rename ทับโฟลเดอร์ที่มีไฟล์แล้วไม่ได้)
+            if os.path.exists(root):
+                raise ValueError(f"มีแคมเปญ {slot} อยู่แล้ว") from None
+            raise
+    except BaseException:
+        shutil.rmtree(tmp_root, ignore_errors=True)
+        raise
+    return campaign_paths(slot, files)
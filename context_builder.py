@@ -0,0 +1,185 @@
+import json
+import re
+import threading
+
+from scheduler import relevant_events
+
+DEFAULT_TOKEN_BUDGET = 4000
+
+
+def estimate_tokens(text):
+    # ประมาณคร่าวๆ จากจำนวน byte (ไทย 3 byte/ตัว ≈ 0.75 token) ไม่ต้องพึ่ง tokenizer จริง
+    return len(text.encode('utf-8')) // 4 + 1
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _aliases(name):
+    # "Mosu (โมสุ)" -> ["Mosu (โมสุ)", "Mosu", "โมสุ"]
+    names = {name.strip()}
+    names.update(part.strip() for part in re.split(r'[()（）/]', name) if part.strip())
+    return [n for n in names if len(n) >= 2]
+
+
+def _location_data(db, location):
+    # current_location จาก LLM อาจเป็น null / ไม่ใช่ string
+    if not isinstance(location, str):
+        return {}
+    loc_data = (db.get('locations') or {}).get(location)
+    return loc_data if isinstance(loc_data, dict) else {}
+
+
+class CharacterIndex:
+    """Lookup tables over db['characters'] by location, faction and name aliases.
+
+    The alias regex only depends on the set of names; it is taken over from
+    ``previous`` (the index of an earlier version of the world) when no NPC
+    was added or removed, since compiling it is most of the build cost.
+    """
+
+    def __init__(self, characters, previous=None):
+        self.characters = characters or {}
+        self.by_location = {}
+        self.by_faction = {}
+        self._names = frozenset(self.characters)
+        reuse = previous is not None and previous._names == self._names
+        alias_map = previous._alias_map if reuse else {}
+        for name, cdata in self.characters.items():
+            if not isinstance(cdata, dict):
+                cdata = {}
+            # ข้อมูลเก่าบางตัวใช้ key 'location' แทน 'current_location'
+            loc = cdata.get('current_location') or cdata.get('location')
+            if isinstance(loc, str) and loc:
+                self.by_location.setdefault(loc.lower(), []).append(name)
+            faction = cdata.get('faction')
+            if isinstance(faction, str) and faction:
+                self.by_faction.setdefault(faction.lower(), []).append(name)
+            if not reuse:
+                for alias in _aliases(name):
+                    alias_map.setdefault(alias.lower(), name)
+        self._alias_map = alias_map
+        if reuse:
+            self._alias_re = previous._alias_re
+        elif alias_map:
+            pattern = '|'.join(re.escape(a) for a in sorted(alias_map, key=len, reverse=True))
+            self._alias_re = re.compile(pattern, re.IGNORECASE)
+        else:
+            self._alias_re = None
+
+    def at_location(self, location):
+        return list(self.by_location.get(location.lower(), [])) if isinstance(location, str) else []
+
+    def in_faction(self, faction):
+        return list(self.by_faction.get(faction.lower(), [])) if isinstance(faction, str) else []
+
+    def mentioned_in(self, text):
+        if not text or self._alias_re is None:
+            return []
+        found = []
+        for match in self._alias_re.finditer(text):
+            name = self._alias_map[match.group(0).lower()]
+            if name not in found:
+                found.append(name)
+        return found
+
+
+class CharacterIndexCache:
+    """The last CharacterIndex of one campaign, reused while the world is at the same store token.
+
+    After a save (new token) the location / faction maps are rebuilt, but
+    the alias regex is carried over unless NPCs were added or removed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._token = None
+        self._index = None
+
+    def get(self, characters, token):
+        with self._lock:
+            if token is not None and token == self._token:
+                return self._index
+            previous = self._index
+        index = CharacterIndex(characters, previous)
+        with self._lock:
+            self._token, self._index = token, index
+        return index
+
+
+def select_characters(db, prompt, recent_texts=(), token_budget=DEFAULT_TOKEN_BUDGET, index=None):
+    """Pick the NPCs relevant to this turn and fit them into ``token_budget``.
+
+    Priority: named in the player's input > at the player's location (or the
+    location owner) > named in recent messages > same faction as an already
+    selected NPC. Returns ``(selected_characters, other_names)`` where
+    ``other_names`` lists the remaining NPCs by name only, as far as the
+    budget allows. ``index`` is a CharacterIndex over ``db['characters']``
+    (e.g. from CharacterIndexCache); built here when not given.
+    """
+    characters = db.get('characters', {}) or {}
+    if index is None:
+        index = CharacterIndex(characters)
+    player = db.get('player', {})
+    location = player.get('current_location', '')
+    loc_data = _location_data(db, location)
+
+    ranked = []
+    seen = set()
+
+    def push(names):
+        for name in names:
+            if name in characters and name not in seen:
+                seen.add(name)
+                ranked.append(name)
+
+    push(index.mentioned_in(prompt))
+    push(index.at_location(location))
+    push([loc_data.get('owner_npc')] if loc_data.get('owner_npc') else [])
+    for text in reversed(list(recent_texts)):
+        push(index.mentioned_in(text))
+    for name in list(ranked):
+        cdata = characters.get(name)
+        if isinstance(cdata, dict):
+            push(index.in_faction(cdata.get('faction')))
+
+    selected = {}
+    used = 0
+    for name in ranked:
+        cost = estimate_tokens(_dumps({name: characters[name]}))
+        if used + cost > token_budget:
+            continue
+        selected[name] = characters[name]
+        used += cost
+
+    # ชื่อที่เหลือใส่เท่าที่งบ token ยังพอ
+    omitted = []
+    for name in characters:
+        if name in selected:
+            continue
+        cost = estimate_tokens(_dumps(name))
+        if used + cost > token_budget:
+            break
+        omitted.append(name)
+        used += cost
+    return selected, omitted
+
+
+def build_context_data(db, prompt, recent_texts=(), token_budget=DEFAULT_TOKEN_BUDGET, index=None):
+    """Slice of the world sent to the models for one turn."""
+    player = db.get('player', {})
+    selected, omitted = select_characters(db, prompt, recent_texts, token_budget, index)
+    # timeline ส่งเฉพาะ event ที่กำลังดำเนินอยู่ / ใกล้เริ่ม scheduler จัดการที่เหลือเอง
+    world = {k: v for k, v in db.get('world', {}).items() if k != 'timeline'}
+    if 'timeline' in db.get('world', {}):
+        world['timeline'] = relevant_events(db)
+    return {
+        "player": player,
+        "world": world,
+        "location": _location_data(db, player.get('current_location')),
+        "settings": db.get('settings', {}),
+        "characters": selected,
+        # ชื่อ NPC ที่ไม่ได้ส่งรายละเอียด ให้โมเดลรู้ว่ามีอยู่แล้วใน DB จะได้ไม่สร้างซ้ำ
+        "other_characters": omitted,
+    }
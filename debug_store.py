@@ -0,0 +1,50 @@
+import hashlib
+import json
+import os
+import zlib
+
+DEBUG_FIELDS = ("debug_json", "gpt_raw", "gemini_raw")
+
+
+class DebugStore:
+    """Compressed, content-addressed storage for bulky per-message debug payloads.
+
+    Chat messages only keep a ``debug_ref`` (the sha256 of the payload), so the
+    dialog history stays proportional to the story text. Identical payloads are
+    stored once.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def _path(self, ref):
+        return os.path.join(self.root_dir, ref[:2], ref + '.json.z')
+
+    def put(self, payload):
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        ref = hashlib.sha256(raw).hexdigest()
+        path = self._path(ref)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(raw, 6))
+            os.replace(tmp_path, path)
+        return ref
+
+    def get(self, ref):
+        if not ref:
+            return {}
+        try:
+            with open(self._path(ref), 'rb') as f:
+                return json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except (OSError, ValueError, zlib.error):
+            return {}
+
+    def detach(self, message):
+        """Move debug fields out of ``message`` into the store. Returns True if anything moved."""
+        payload = {k: message.pop(k) for k in DEBUG_FIELDS if k in message}
+        if not payload:
+            return False
+        message['debug_ref'] = self.put(payload)
+        return True
@@ -0,0 +1,270 @@
+from datetime import datetime, timedelta
+
+from game_state import TIME_FMT
+
+NUMBER = (int, float)
+
+# ================= RULES =================
+# ตารางเดียวกำหนดว่า key ไหนใน JSON block ของ GPT แก้ DB ยังไง
+# path ใน delta, op, ชนิดข้อมูลที่รับ, option (target = path ใน DB ถ้าไม่ตรงกับ delta)
+RULES = [
+    ("time_passed",                  "time",       dict, {"target": "world.current_time"}),
+    # TurnPipeline ใส่เวลาในเกมให้ก่อน apply เป็น {"time", "text"} (world_log.log_record)
+    ("log_entry",                    "log",        (str, dict), {"target": "log", "max_len": 150}),
+
+    ("player.inventory",             "replace",    list, {}),
+    ("player.current_location",      "replace",    str,  {}),
+    ("player.crew",                  "replace",    list, {}),
+    ("player.traits.abilities",      "replace",    list, {}),
+    ("player.stats",                 "merge",      dict, {}),
+    ("player.reputation",            "merge",      dict, {}),
+    ("player.vehicle.status",        "merge",      dict, {}),
+    ("player.devil_fruit",           "merge",      dict, {}),
+    ("player.haki",                  "deep_merge", dict, {}),
+
+    # prompt เห็นแค่ event ที่เกี่ยวข้อง ส่งกลับมาเท่าไหร่ก็แก้ตาม id ห้ามทับทั้ง list
+    ("world.timeline",               "merge_by_id", list, {"key": "id"}),
+    ("world.events",                 "replace",    list, {}),
+
+    # ตัวละครใหม่ใส่ทั้งก้อน ตัวเก่าอัปเดตเฉพาะ field ด้านล่าง
+    ("characters.*",                 "insert",     dict, {}),
+    ("characters.*.status",          "replace",    str,  {}),
+    ("characters.*.location",        "replace",    str,  {}),
+    ("characters.*.current_location", "replace",   str,  {}),
+    ("characters.*.stats",           "merge",      dict, {}),
+    ("characters.*.reputation",      "merge",      dict, {}),
+    ("characters.*.friendship",      "replace",    NUMBER, {}),
+
+    ("locations",                    "merge",      dict, {}),
+    ("unique_items",                 "merge",      dict, {}),
+]
+
+
+# ================= OPS =================
+# แต่ละ op เป็นฟังก์ชัน pure: รับค่าเดิม + ค่าใหม่ คืนค่าที่จะเขียนลง DB (ไม่แก้ของเดิม)
+def op_replace(current, value, **_):
+    return value
+
+
+def op_merge(current, value, **_):
+    merged = dict(current) if isinstance(current, dict) else {}
+    merged.update(value)
+    return merged
+
+
+def op_deep_merge(current, value, **_):
+    merged = dict(current) if isinstance(current, dict) else {}
+    for key, val in value.items():
+        if isinstance(val, dict) and isinstance(merged.get(key), dict):
+            merged[key] = op_deep_merge(merged[key], val)
+        else:
+            merged[key] = val
+    return merged
+
+
+def op_merge_by_id(current, value, key="id", **_):
+    items = [dict(item) if isinstance(item, dict) else item for item in current] if isinstance(current, list) else []
+    index = {item.get(key): i for i, item in enumerate(items) if isinstance(item, dict) and item.get(key) is not None}
+    for item in value:
+        if isinstance(item, dict) and item.get(key) in index:
+            items[index[item[key]]].update(item)
+        else:
+            items.append(item)
+    return items
+
+
+def op_append(current, value, max_len=None, limit=None, **_):
+    items = list(current) if isinstance(current, list) else []
+    items.append(value[:max_len] if max_len and isinstance(value, str) else value)
+    if limit is not None and len(items) > limit:
+        items = items[-limit:]
+    return items
+
+
+def op_log(current, value, max_len=None, **_):
+    if isinstance(value, dict):
+        if not isinstance(value.get("text"), str) or not isinstance(value.get("time"), (str, type(None))):
+            raise TypeError("log_entry needs a text (and time) string")
+        value = {"time": value["time"], "text": value["text"][:max_len] if max_len else value["text"]}
+    return op_append(current, value, max_len=max_len)
+
+
+def op_drop_head(current, value, **_):
+    # ตัด entry เก่าที่ย้ายไป archive แล้ว (world_log.roll_log) ไม่อยู่ใน RULES GPT สั่งไม่ได้
+    return list(current)[value:] if isinstance(current, list) else []
+
+
+def op_time(current, value, **_):
+    for unit in ("days", "hours", "minutes"):
+        if not isinstance(value.get(unit, 0), NUMBER):
+            raise TypeError(f"time_passed.{unit} must be a number")
+    curr = datetime.strptime(current, TIME_FMT)
+    new_time = curr + timedelta(
+        days=value.get('days', 0), hours=value.get('hours', 0), minutes=value.get('minutes', 0)
+    )
+    return new_time.strftime(TIME_FMT)
+
+
+def op_insert(current, value, **_):
+    return value
+
+
+OPS = {
+    "replace": op_replace,
+    "merge": op_merge,
+    "deep_merge": op_deep_merge,
+    "merge_by_id": op_merge_by_id,
+    "append": op_append,
+    "log": op_log,
+    "drop_head": op_drop_head,
+    "time": op_time,
+    "insert": op_insert,
+}
+
+
+def _compile(rules):
+    # แปลงตารางเป็น trie ตาม path จะได้เดิน delta ครั้งเดียว
+    root = {"children": {}, "rule": None}
+    for path, op, kind, options in rules:
+        if op not in OPS:
+            raise ValueError(f"unknown op {op!r} for {path}")
+        node = root
+        for part in path.split('.'):
+            node = node["children"].setdefault(part, {"children": {}, "rule": None})
+        node["rule"] = {"path": path, "op": op, "type": kind, "options": dict(options)}
+    return root
+
+
+RULE_TREE = _compile(RULES)
+
+
+class ChangeSet:
+    """Result of one apply: what was written and what was rejected (with a reason)."""
+
+    def __init__(self):
+        self.applied = []
+        self.rejected = []
+
+    def __bool__(self):
+        return bool(self.applied)
+
+    def as_dict(self):
+        return {"applied": self.applied, "rejected": self.rejected}
+
+
+def _lookup(db, parts):
+    node = db
+    for part in parts:
+        if not isinstance(node, dict) or part not in node:
+            return None
+        node = node[part]
+    return node
+
+
+def _plan(tree, delta, path, changes, plan, db):
+    for key, value in delta.items():
+        node = tree["children"].get(key) or tree["children"].get("*")
+        key_path = path + [key]
+        dotted = ".".join(key_path)
+        if node is None:
+            changes.rejected.append({"path": dotted, "reason": "unknown key"})
+            continue
+        rule = node["rule"]
+        if rule is not None and not isinstance(value, rule["type"]):
+            changes.rejected.append({"path": dotted, "reason": f"expected {_type_name(rule['type'])}"})
+            continue
+        if rule is not None and rule["op"] == "insert":
+            # insert ใช้กับของที่ยังไม่มีใน DB เท่านั้น (เขียนทั้งก้อน) ถ้ามีแล้วให้ไล่ตามกฎย่อยแทน
+            target_parts = rule["options"]["target"].split('.') if "target" in rule["options"] else key_path
+            if _lookup(db, target_parts) is None:
+                plan.append((rule, key_path, value))
+            elif node["children"]:
+                _plan(node, value, key_path, changes, plan, db)
+            continue
+        if rule is not None:
+            plan.append((rule, key_path, value))
+        elif isinstance(value, dict) and node["children"]:
+            _plan(node, value, key_path, changes, plan, db)
+        else:
+            changes.rejected.append({"path": dotted, "reason": "no rule for this value"})
+
+
+def _type_name(kind):
+    if isinstance(kind, tuple):
+        return "/".join(k.__name__ for k in kind)
+    return kind.__name__
+
+
+def apply_delta(db, delta, tree=RULE_TREE):
+    """Apply a GPT state delta to ``db`` in place and return a ChangeSet.
+
+    Every key is matched against RULES and type-checked before anything is
+    written. Keys without a rule or with the wrong type are rejected and
+    reported; the rest are applied all-or-nothing (rolled back on error).
+    """
+    changes = ChangeSet()
+    if not isinstance(delta, dict):
+        changes.rejected.append({"path": "", "reason": "delta must be an object"})
+        return changes
+
+    plan = []
+    _plan(tree, delta, [], changes, plan, db)
+
+    # คำนวณค่าใหม่ทั้งหมดก่อน ถ้าอันไหนพังก็ตัดทิ้งอันนั้น ยังไม่มีอะไรถูกเขียนลง DB
+    writes = []
+    for rule, key_path, value in plan:
+        target_parts = rule["options"]["target"].split('.') if "target" in rule["options"] else key_path
+        dotted = ".".join(key_path)
+        parent = db
+        for part in target_parts[:-1]:
+            parent = parent.get(part) if isinstance(parent, dict) else parent
+            if parent is None:
+                break
+        if parent is not None and not isinstance(parent, dict):
+            changes.rejected.append({"path": dotted, "reason": "parent in DB is not an object"})
+            continue
+        current = parent.get(target_parts[-1]) if parent is not None else None
+        options = {k: v for k, v in rule["options"].items() if k != "target"}
+        try:
+            new_value = OPS[rule["op"]](current, value, **options)
+        except (TypeError, ValueError, AttributeError) as e:
+            changes.rejected.append({"path": dotted, "reason": str(e)})
+            continue
+        writes.append((target_parts, new_value, rule["op"], dotted, value, options))
+
+    undo = []
+    try:
+        for target_parts, new_value, op, dotted, value, options in writes:
+            node = db
+            for part in target_parts[:-1]:
+                if part not in node:
+                    node[part] = {}
+                    undo.append((node, part, False, None))
+                node = node[part]
+            last = target_parts[-1]
+            undo.append((node, last, last in node, node.get(last)))
+            node[last] = new_value
+            # เก็บ input ของ op ไว้ด้วย เอาไป replay ซ้ำได้ (เช่น rewind / history)
+            changes.applied.append({
+                "path": dotted, "op": op, "target": ".".join(target_parts), "value": value, "options": options
+            })
+    except Exception:
+        for container, key, existed, old in reversed(undo):
+            if existed:
+                container[key] = old
+            else:
+                container.pop(key, None)
+        raise
+    return changes
+
+
+def replay_changes(db, applied):
+    """Re-apply the ``applied`` list of a ChangeSet (e.g. from the version log) to ``db`` in place."""
+    for change in applied:
+        target_parts = change["target"].split('.')
+        node = db
+        for part in target_parts[:-1]:
+            node = node.setdefault(part, {})
+        last = target_parts[-1]
+        node[last] = OPS[change["op"]](node.get(last), change["value"], **change.get("options", {}))
+    return db
@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+import uuid
+
+from file_lock import FileLock
+
+
+def atomic_write_json(filepath, data, indent=2):
+    # เขียนลงไฟล์ชั่วคราวก่อนแล้วค่อย rename ทับ กันไฟล์พังกลางทาง
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
+
+class DialogStore:
+    """Chat history stored as a JSON snapshot plus an append-only JSON Lines journal.
+
+    Each turn appends one line to the journal (O(1) per message). Once the
+    journal grows past ``compact_every`` records it is folded back into the
+    snapshot, which keeps the familiar dialog.json format for export/upload.
+    Writes hold a FileLock so several sessions/processes can share one dialog.
+    """
+
+    def __init__(self, snapshot_path, journal_path=None, compact_every=50):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or os.path.splitext(snapshot_path)[0] + '.jsonl'
+        self.compact_every = compact_every
+        self._journal_count = None
+        self._cache = None
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(snapshot_path)
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex[:12]
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return []
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, list) else []
+        except (OSError, ValueError):
+            return []
+
+    def _read_journal(self):
+        if not os.path.exists(self.journal_path):
+            return []
+        records = []
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # บรรทัดที่เขียนไม่จบตอนโปรแกรมล่ม ข้ามไปได้เลย ประวัติก่อนหน้ายังอยู่ครบ
+                    continue
+        return records
+
+    def _stamp(self):
+        stamp = []
+        for path in (self.snapshot_path, self.journal_path):
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def load(self):
+        with self._lock:
+            return self._load()
+
+    def _load(self):
+        # ไฟล์ไม่เปลี่ยนตั้งแต่ครั้งก่อน ใช้ของที่ parse ไว้แล้วได้เลย
+        stamp = self._stamp()
+        if self._cache is not None and self._cache[0] == stamp:
+            return list(self._cache[1])
+
+        messages = self._read_snapshot()
+        seen = {m.get('id') for m in messages if isinstance(m, dict) and m.get('id')}
+        journal = self._read_journal()
+        for record in journal:
+            # ถ้าล่มระหว่าง compact ข้อความอาจอยู่ทั้งใน snapshot และ journal กันซ้ำด้วย id
+            if record.get('id') and record['id'] in seen:
+                continue
+            messages.append(record)
+        self._journal_count = len(journal)
+        self._cache = (stamp, messages)
+        return list(messages)
+
+    def append(self, message):
+        with self._lock, self._file_lock:
+            return self._append(message)
+
+    def append_many(self, messages):
+        """Append messages in one journal write (one fsync); ids already in the dialog are skipped.
+
+        Used to commit a turn (user + assistant message) as a unit, and safe
+        to call again with the same messages.
+        """
+        with self._lock, self._file_lock:
+            known = {m.get('id') for m in self._load() if isinstance(m, dict)}
+            new = [m for m in messages if not m.get('id') or m['id'] not in known]
+            if new:
+                self._write(new)
+            return messages
+
+    def _append(self, message):
+        self._write([message])
+        return message
+
+    def _write(self, messages):
+        for message in messages:
+            message.setdefault('id', self.new_id())
+        cache_valid = self._cache is not None and self._cache[0] == self._stamp()
+        if not cache_valid:
+            # มีคนอื่นเขียนไฟล์ไปแล้ว นับ journal ใหม่
+            self._journal_count = None
+        lines = "".join(json.dumps(m, ensure_ascii=False, separators=(',', ':')) + '\n' for m in messages)
+        with open(self.journal_path, 'a+b') as f:
+            # ถ้าบรรทัดก่อนหน้าค้างครึ่งๆ กลางๆ ให้ขึ้นบรรทัดใหม่ก่อน จะได้ไม่ต่อกันจนอ่านไม่ออก
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+            f.write(lines.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        if cache_valid:
+            # ต่อท้าย cache ไปด้วย rerun ถัดไปจะได้ไม่ต้อง parse ทั้งไฟล์ใหม่
+            self._cache[1].extend(messages)
+            self._cache = (self._stamp(), self._cache[1])
+
+        if self._journal_count is None:
+            self._journal_count = len(self._read_journal())
+        else:
+            self._journal_count += len(messages)
+        if self._journal_count >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        with self._lock, self._file_lock:
+            self.replace(self._load())
+
+    def replace(self, messages):
+        with self._lock, self._file_lock:
+            self._replace(messages)
+
+    def _replace(self, messages):
+        # snapshot ใหม่ต้องลงดิสก์ให้เรียบร้อยก่อน แล้วค่อยล้าง journal
+        atomic_write_json(self.snapshot_path, messages)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal_count = 0
+        self._cache = (self._stamp(), list(messages))
+
+    def clear(self):
+        self.replace([])
+
+    def export_bytes(self):
+        return json.dumps(self.load(), ensure_ascii=False, indent=2).encode('utf-8')
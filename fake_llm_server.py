@@ -0,0 +1,143 @@
+"""Local fake of the OpenAI chat and Gemini generateContent endpoints, with injectable faults.
+
+Point the app at it to try retries / timeouts / the circuit breaker
+without touching the real APIs (any API key works):
+
+    python fake_llm_server.py --port 8765 --fail-rate 0.3 --latency-ms 200
+
+    # .streamlit/secrets.toml
+    OPENAI_BASE_URL = "http://127.0.0.1:8765/v1"
+    GEMINI_BASE_URL = "http://127.0.0.1:8765"
+
+Faults per request: ``--fail-rate`` answers with ``--fail-status``,
+``--hang-rate`` sleeps ``--hang-s`` before answering (client timeout),
+``--drop-rate`` closes the connection without a response.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = ("คลื่นซัดเข้าฝั่ง ลูกเรือมองหน้ากันเงียบๆ\n\n**[Result]:** Success\n**Choices:**\n1. ออกเรือ\n2. พัก\n3. สำรวจ\n\n"
+         "```json\n{\"time_passed\": {\"days\": 0, \"hours\": 1, \"minutes\": 0}, \"log_entry\": \"fake turn\"}\n```")
+STORY = "ร่างเนื้อเรื่องจาก fake server: ท้องฟ้าเริ่มมืดครึ้ม"
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+    stats = {"requests": 0, "failed": 0, "hung": 0, "dropped": 0}
+    lock = threading.Lock()
+
+    def log_message(self, fmt, *args):
+        if not self.config.quiet:
+            super().log_message(fmt, *args)
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _send_json(self, status, body):
+        raw = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _fault(self):
+        cfg = self.config
+        roll = random.random()
+        if roll < cfg.drop_rate:
+            self._count("dropped")
+            self.close_connection = True
+            return True
+        roll -= cfg.drop_rate
+        if roll < cfg.hang_rate:
+            self._count("hung")
+            time.sleep(cfg.hang_s)
+        elif roll < cfg.hang_rate + cfg.fail_rate:
+            self._count("failed")
+            self._send_json(cfg.fail_status, {"error": {"message": "injected failure", "code": cfg.fail_status}})
+            return True
+        time.sleep(cfg.latency_ms / 1000)
+        return False
+
+    def do_GET(self):
+        if self.path.rstrip('/') == "/stats":
+            return self._send_json(200, self.stats)
+        self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        self._count("requests")
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if self._fault():
+            return
+        if self.path.endswith("/chat/completions"):
+            return self._chat(body)
+        if re.search(r"/models/[^/:]+:generateContent", self.path):
+            return self._send_json(200, {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": STORY}]}, "finishReason": "STOP"}],
+                "usageMetadata": {"promptTokenCount": 100, "candidatesTokenCount": 20, "totalTokenCount": 120},
+            })
+        self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _chat(self, body):
+        model = body.get("model", "fake")
+        usage = {"prompt_tokens": 100, "completion_tokens": len(REPLY) // 4, "total_tokens": 100 + len(REPLY) // 4}
+        if not body.get("stream"):
+            return self._send_json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(payload):
+            data = f"data: {payload}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        for i in range(0, len(REPLY), 16):
+            send(json.dumps(dict(base, choices=[{"index": 0, "delta": {"content": REPLY[i:i + 16]}, "finish_reason": None}]),
+                            ensure_ascii=False))
+            time.sleep(self.config.chunk_ms / 1000)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send(json.dumps(dict(base, choices=[], usage=usage)))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="delay before each answer")
+    parser.add_argument("--chunk-ms", type=float, default=5.0, help="delay between stream chunks")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with --fail-status")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="share of requests that stall for --hang-s")
+    parser.add_argument("--hang-s", type=float, default=60.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of connections closed without a reply")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    FakeLLMHandler.config = args
+    server = ThreadingHTTPServer((args.host, args.port), FakeLLMHandler)
+    print(f"fake LLM server on http://{args.host}:{args.port} (stats: GET /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
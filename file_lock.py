@@ -0,0 +1,61 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: ใช้ได้แค่ล็อกภายใน process
+    fcntl = None
+
+_path_states = {}
+_path_states_guard = threading.Lock()
+
+
+class VersionConflict(Exception):
+    """Raised when a write was based on a version that someone else already replaced."""
+
+
+class _PathState:
+    def __init__(self):
+        self.rlock = threading.RLock()
+        self.depth = 0
+        self.fd = None
+
+
+def _state_for(path):
+    with _path_states_guard:
+        state = _path_states.get(path)
+        if state is None:
+            state = _path_states[path] = _PathState()
+        return state
+
+
+class FileLock:
+    """Exclusive lock on ``<path>.lock``: serializes writers across threads and processes.
+
+    Re-entrant within a thread (also across FileLock objects for the same
+    path), so a store can take it again in a nested call.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path) + '.lock'
+        self._state = _state_for(self.path)
+
+    def __enter__(self):
+        state = self._state
+        state.rlock.acquire()
+        # ถือ rlock อยู่แล้ว depth/fd จึงแก้ได้โดยไม่ชนกับ thread อื่น
+        if state.depth == 0 and fcntl is not None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            state.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(state.fd, fcntl.LOCK_EX)
+        state.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        state = self._state
+        state.depth -= 1
+        if state.depth == 0 and state.fd is not None:
+            fcntl.flock(state.fd, fcntl.LOCK_UN)
+            os.close(state.fd)
+            state.fd = None
+        state.rlock.release()
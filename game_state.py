@@ -0,0 +1,9 @@
+from datetime import datetime, timedelta
+
+TIME_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def add_time(db, days=0, hours=0, minutes=0):
+    curr = datetime.strptime(db['world']['current_time'], TIME_FMT)
+    new_time = curr + timedelta(days=days, hours=hours, minutes=minutes)
+    db['world']['current_time'] = new_time.strftime(TIME_FMT)
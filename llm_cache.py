@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from providers import Counted, retries_of
+
+MODES = ("off", "cache", "record", "replay")
+REPLAY_CHUNK_CHARS = 64
+
+
+class ReplayMiss(LookupError):
+    """Replay mode found no recorded response for this request."""
+
+
+def content_hash(value):
+    raw = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _usage_dict(usage):
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0),
+        "completion_tokens": getattr(usage, "completion_tokens", 0),
+        "cached_tokens": getattr(details, "cached_tokens", 0) if details is not None else 0,
+    }
+
+
+def _usage_obj(usage):
+    if usage is None:
+        return None
+    return SimpleNamespace(
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=usage.get("cached_tokens", 0)),
+    )
+
+
+def _chunk(content=None, usage=None):
+    choices = [] if content is None else [SimpleNamespace(delta=SimpleNamespace(content=content))]
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class ResponseCache:
+    """Content-addressed, size-bounded LRU cache of LLM responses on disk.
+
+    Keys are sha256 of (model, prompt hash, state hash). Entries are zlib
+    JSON files laid out like DebugStore; the least recently used ones are
+    deleted once the directory grows past ``max_bytes``. ``mode``:
+
+    - ``off``: always call the provider.
+    - ``cache``: serve hits, call and store on a miss.
+    - ``record``: always call the provider and store (overwrites).
+    - ``replay``: serve hits only; a miss raises ReplayMiss (offline / CI).
+
+    Hits go back through the caller's normal path: story calls get an object
+    with ``.text``, chat calls get a stream of chunk objects (or a response)
+    shaped like the OpenAI SDK's.
+    """
+
+    def __init__(self, root_dir, max_bytes=256 * 1024 * 1024, mode="off"):
+        if mode not in MODES:
+            raise ValueError(f"unknown cache mode {mode!r} (use one of {', '.join(MODES)})")
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = None          # key -> size เรียงจากใช้ล่าสุดเก่าสุดไปใหม่สุด
+        self._total = 0
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    # ---------- storage ----------
+    def _path(self, key):
+        return os.path.join(self.root_dir, key[:2], key + '.json.z')
+
+    def _load_index(self):
+        if self._index is not None:
+            return self._index
+        entries = []
+        for dirpath, _dirs, files in os.walk(self.root_dir):
+            for name in files:
+                if name.endswith('.json.z'):
+                    st = os.stat(os.path.join(dirpath, name))
+                    entries.append((st.st_mtime, name[:-len('.json.z')], st.st_size))
+        entries.sort()
+        self._index = OrderedDict((key, size) for _mtime, key, size in entries)
+        self._total = sum(self._index.values())
+        return self._index
+
+    def key(self, model, prompt, state_hash=""):
+        return content_hash({"model": model, "prompt": content_hash(prompt), "state": state_hash})
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except (OSError, ValueError, zlib.error):
+            return None
+        with self._lock:
+            index = self._load_index()
+            if key in index:
+                index.move_to_end(key)
+        try:
+            os.utime(path)  # mtime = ใช้ล่าสุด (LRU ข้าม restart)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        raw = zlib.compress(json.dumps(entry, ensure_ascii=False).encode('utf-8'), 6)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(raw)
+        os.replace(path + '.tmp', path)
+        with self._lock:
+            index = self._load_index()
+            self._total += len(raw) - index.pop(key, 0)
+            index[key] = len(raw)
+            while self._total > self.max_bytes and len(index) > 1:
+                old_key, size = index.popitem(last=False)
+                self._total -= size
+                try:
+                    os.remove(self._path(old_key))
+                except OSError:
+                    pass
+
+    def _lookup(self, key):
+        if self.mode in ("cache", "replay"):
+            entry = self.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+        self.misses += 1
+        if self.mode == "replay":
+            raise ReplayMiss(f"no recorded response for {key[:12]}")
+        return None
+
+    # ---------- call wrappers ----------
+    def story(self, model, model_name, instruction, contents, state_hash="", **kwargs):
+        """``model.generate_content(contents, **kwargs)`` through the cache; returns an object with ``.text``."""
+        if not self.enabled:
+            return model.generate_content(contents, **kwargs)
+        key = self.key(model_name, {"instruction": instruction, "contents": contents}, state_hash)
+        entry = self._lookup(key)
+        if entry is None:
+            response = model.generate_content(contents, **kwargs)
+            entry = {"kind": "story", "model": model_name, "text": response.text, "at": time.time()}
+            self.put(key, entry)
+            return SimpleNamespace(text=entry["text"], provider_retries=retries_of(response))
+        return SimpleNamespace(text=entry["text"])
+
+    def chat(self, create, state_hash="", **params):
+        """``create(**params)`` (chat.completions.create) through the cache.
+
+        Streaming misses are passed through chunk by chunk and stored once
+        the stream has been read to the end; a stream closed early (stop
+        button) is not stored.
+        """
+        if not self.enabled:
+            return create(**params)
+        prompt = {k: v for k, v in params.items() if k not in ("timeout", "stream", "stream_options")}
+        key = self.key(params.get("model", ""), prompt, state_hash)
+        entry = self._lookup(key)
+        stream = params.get("stream", False)
+        if entry is not None:
+            return self._replay_stream(entry) if stream else self._replay_response(entry)
+        response = create(**params)
+        if stream:
+            return Counted(self._record_stream(key, params.get("model", ""), response), retries_of(response))
+        self.put(key, {
+            "kind": "chat", "model": params.get("model", ""), "text": response.choices[0].message.content or "",
+            "usage": _usage_dict(getattr(response, "usage", None)), "at": time.time()
+        })
+        return response
+
+    def _replay_stream(self, entry):
+        text = entry.get("text", "")
+        for i in range(0, len(text), REPLAY_CHUNK_CHARS):
+            yield _chunk(text[i:i + REPLAY_CHUNK_CHARS])
+        yield _chunk(usage=_usage_obj(entry.get("usage")))
+
+    @staticmethod
+    def _replay_response(entry):
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=entry.get("text", "")))],
+            usage=_usage_obj(entry.get("usage")),
+        )
+
+    def _record_stream(self, key, model, response):
+        parts = []
+        usage = None
+        try:
+            for chunk in response:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if chunk.choices:
+                    parts.append(chunk.choices[0].delta.content or "")
+                yield chunk
+            self.put(key, {"kind": "chat", "model": model, "text": "".join(parts),
+                           "usage": _usage_dict(usage), "at": time.time()})
+        finally:
+            close = getattr(response, "close", None)
+            if close is not None:
+                close()
@@ -0,0 +1,272 @@
+import heapq
+import json
+import re
+import threading
+
+from context_builder import _aliases
+from game_state import add_time
+from scheduler import advance_timeline, render_transitions, timeline_changes
+
+# คำที่ใช้เดาว่าผู้เล่นกำลังทำอะไร เรียงตามลำดับความสำคัญ (อันแรกที่เจอชนะ)
+ACTION_KEYWORDS = [
+    ("fight_boss",     ["บอส", "boss", "หัวหน้า", "จักรพรรดิ", "yonko", "admiral", "พลเรือเอก"]),
+    ("fight_skirmish", ["สู้", "ต่อย", "ฟัน", "โจมตี", "ยิง", "fight", "attack", "battle", "punch", "slash"]),
+    ("rest",           ["พัก", "นอน", "rest", "sleep", "camp"]),
+    ("explore",        ["สำรวจ", "ค้นหา", "เดินดู", "explore", "search", "investigate"]),
+    ("travel_local",   ["เดินไป", "ไปที่", "ไปยัง", "เดินทาง", "walk", "go to", "head to"]),
+    ("chat",           ["คุย", "พูด", "ถาม", "บอก", "ทักทาย", "talk", "ask", "say", "chat"]),
+]
+
+# ชื่อสถานที่นับเป็นจุดหมายเมื่อมีคำพวกนี้อยู่ข้างหน้า (ห่างไม่เกิน TRAVEL_WINDOW ตัวอักษร) ไม่ใช่แค่ถูกพูดถึง
+TRAVEL_WORDS = ["ไป", "เดินทาง", "ล่องเรือ", "ออกเรือ", "แล่นเรือ", "sail", "travel", "go", "head", "set sail for"]
+TRAVEL_WINDOW = 16
+# คำปฏิเสธก่อน keyword (ไม่เกิน NEGATION_WINDOW ตัวอักษร) = ไม่แน่ใจ ปล่อยให้ LLM ตัดสินเวลาเอง
+NEGATION_WORDS = ["ไม่", "อย่า", "not", "never", "don't", "dont", "won't", "no"]
+NEGATION_WINDOW = 24
+# คำไทยที่มี keyword ซ่อนอยู่ข้างใน (แน่นอน มี "นอน") ลบออกก่อนจับคำ
+IGNORED_PHRASES = ["แน่นอน", "ไปรษณีย์", "พักพวก"]
+TIME_UNITS = ("days", "hours", "minutes")
+FAST_TRAVEL_CREW = ("kuma",)
+NO_REQUIREMENT = ("", "none", "-")
+
+
+def _word_pattern(word):
+    # ภาษาไทยไม่เว้นวรรคระหว่างคำ จับแบบ substring ส่วนภาษาอังกฤษต้องเป็นคำเต็ม (ask ไม่ใช่ mask)
+    if not word.isascii():
+        return re.escape(word)
+    suffix = "" if " " in word else "(?:s|es|ing|ed)?"
+    return rf"\b{re.escape(word)}{suffix}\b"
+
+
+def _compile_words(words):
+    return re.compile("|".join(_word_pattern(w) for w in sorted(words, key=len, reverse=True)))
+
+
+_ACTION_RES = [(action, _compile_words(words)) for action, words in ACTION_KEYWORDS]
+_TRAVEL_RE = _compile_words(TRAVEL_WORDS)
+_NEGATION_RE = _compile_words(NEGATION_WORDS)
+
+
+def _normalize(prompt):
+    text = prompt.lower()
+    for phrase in IGNORED_PHRASES:
+        text = text.replace(phrase, " " * len(phrase))
+    return text
+
+
+def _negated(text, start):
+    return _NEGATION_RE.search(text, max(0, start - NEGATION_WINDOW), start) is not None
+
+
+def classify_action(prompt, action_costs):
+    """Return the ``action_costs`` key that matches the player's input, or None.
+
+    None also when unsure: a matched keyword is negated ("don't rest") or
+    the input matches more than one action; the LLM decides the time then.
+    """
+    text = _normalize(prompt)
+    matched = []
+    for action, pattern in _ACTION_RES:
+        if action not in action_costs:
+            continue
+        hits = list(pattern.finditer(text))
+        if not hits:
+            continue
+        if any(_negated(text, m.start()) for m in hits):
+            return None
+        matched.append(action)
+    if "fight_boss" in matched and "fight_skirmish" in matched:
+        # "สู้กับบอส" เป็นการต่อสู้อันเดียว ไม่ใช่สอง action
+        matched.remove("fight_skirmish")
+    return matched[0] if len(matched) == 1 else None
+
+
+def travel_target(graph, prompt, here=None):
+    """The location the player is heading to: a known name right after a (non-negated) travel verb."""
+    text = _normalize(prompt)
+    for name, start in graph.mentions(text):
+        if name == here:
+            continue
+        window = max(0, start - TRAVEL_WINDOW)
+        verbs = list(_TRAVEL_RE.finditer(text, window, start))
+        if verbs and not _negated(text, verbs[-1].start()):
+            return name
+    return None
+
+
+class TravelGraph:
+    """All-pairs travel times over ``locations[*].connections`` (Dijkstra from every node, once)."""
+
+    def __init__(self, locations):
+        self.edges = {}
+        for name, loc in (locations or {}).items():
+            if not isinstance(loc, dict):
+                continue
+            for target, link in (loc.get('connections') or {}).items():
+                link = link if isinstance(link, dict) else {}
+                days = link.get('travel_days', 1)
+                days = days if isinstance(days, (int, float)) and days >= 0 else 1
+                self.edges.setdefault(name, {})[target] = (days, link)
+                self.edges.setdefault(target, {})
+        self.names = {}
+        for name in self.edges:
+            for alias in _aliases(name):
+                self.names.setdefault(alias.lower(), name)
+        self.table = {source: self._dijkstra(source) for source in self.edges}
+
+    def _dijkstra(self, source):
+        dist = {source: 0}
+        prev = {}
+        heap = [(0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist.get(node, float('inf')):
+                continue
+            for target, (days, _link) in self.edges[node].items():
+                nd = d + days
+                if nd < dist.get(target, float('inf')):
+                    dist[target] = nd
+                    prev[target] = node
+                    heapq.heappush(heap, (nd, target))
+        return dist, prev
+
+    def mentions(self, text):
+        """``[(name, position)]`` of the locations mentioned in ``text``, in order (longest alias wins)."""
+        lowered = text.lower()
+        found = []
+        for alias in sorted(self.names, key=len, reverse=True):
+            pattern = rf"\b{re.escape(alias)}\b" if alias.isascii() else re.escape(alias)
+            for m in re.finditer(pattern, lowered):
+                found.append((self.names[alias], m.start()))
+                lowered = lowered[:m.start()] + " " * len(alias) + lowered[m.end():]
+        found.sort(key=lambda item: item[1])
+        return found
+
+    def find(self, text):
+        """Location names mentioned in ``text`` (longest alias first)."""
+        return list(dict.fromkeys(name for name, _ in self.mentions(text)))
+
+    def route(self, source, target):
+        """``{"days", "path", "legs"}`` of the shortest route, or None if unreachable."""
+        if source not in self.table or target not in self.edges:
+            return None
+        dist, prev = self.table[source]
+        if target not in dist:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(prev[path[-1]])
+        path.reverse()
+        legs = [{"from": a, "to": b, **self.edges[a][b][1]} for a, b in zip(path, path[1:])]
+        return {"days": dist[target], "path": path, "legs": legs}
+
+
+_graph_cache = {}
+_graph_lock = threading.Lock()
+
+
+def travel_graph(locations):
+    """TravelGraph for these locations, cached by the content of their connections."""
+    key = json.dumps({n: l.get('connections') for n, l in (locations or {}).items() if isinstance(l, dict)},
+                     sort_keys=True, ensure_ascii=False)
+    with _graph_lock:
+        graph = _graph_cache.get(key)
+        if graph is None:
+            if len(_graph_cache) >= 8:
+                _graph_cache.pop(next(iter(_graph_cache)))
+            graph = _graph_cache[key] = TravelGraph(locations)
+        return graph
+
+
+def _has_requirement(requirement, player):
+    if str(requirement).strip().lower() in NO_REQUIREMENT:
+        return True
+    owned = [str(item).lower() for item in player.get('inventory', [])]
+    vehicle = player.get('vehicle') or {}
+    owned += [str(vehicle.get('name', '')).lower(), str(vehicle.get('type', '')).lower()]
+    # "Marine Ship or Stealth" -> มีอย่างใดอย่างหนึ่งก็พอ
+    options = [o.strip().lower() for o in re.split(r'\bor\b|/|หรือ', str(requirement)) if o.strip()]
+    return any(option in item for option in options for item in owned if item)
+
+
+def resolve_turn(db, prompt):
+    """Work out what the engine can decide for this input without the LLM.
+
+    Returns ``{"action", "time_passed", "travel"}``; ``time_passed`` is None
+    when the action is not recognized (the LLM decides as before).
+    """
+    player = db.get('player') or {}
+    action_costs = (db.get('settings') or {}).get('action_costs') or {}
+    facts = {"action": None, "time_passed": None, "travel": None}
+
+    graph = travel_graph(db.get('locations'))
+    here = player.get('current_location')
+    target = travel_target(graph, prompt, here)
+    # ที่อยู่ปัจจุบันไม่อยู่ในแผนที่ทะเล (เช่นจุดย่อยบนเกาะ) ให้ถือเป็นการเดินทางระยะใกล้แทน
+    if target is not None and here in graph.edges:
+        route = graph.route(here, target)
+        fast = any(key in str(member).lower() for member in player.get('crew', []) for key in FAST_TRAVEL_CREW)
+        travel = {"from": here, "to": target, "reachable": route is not None, "fast_travel": fast}
+        if route is not None:
+            travel.update(days=route["days"], path=route["path"], missing_items=[
+                leg["req_item"] for leg in route["legs"]
+                if "req_item" in leg and not _has_requirement(leg["req_item"], player)
+            ], log_pose_days=[leg.get("day_req_for_lock") for leg in route["legs"]])
+        facts["travel"] = travel
+        facts["action"] = "travel"
+        if fast and "travel_local" in action_costs:
+            facts["time_passed"] = dict(action_costs["travel_local"])
+        elif route is not None and not travel["missing_items"]:
+            facts["time_passed"] = {"days": route["days"]}
+    else:
+        action = classify_action(prompt, action_costs)
+        if action is not None:
+            facts["action"] = action
+            facts["time_passed"] = dict(action_costs[action])
+
+    if facts["time_passed"] is not None:
+        facts["time_passed"] = {k: v for k, v in facts["time_passed"].items()
+                                if k in TIME_UNITS and isinstance(v, (int, float))}
+    return facts
+
+
+def apply_facts(db, facts, scheduler=None):
+    """Advance the world clock by the engine's ``time_passed`` and run the timeline scheduler (in place).
+
+    Returns the writes in the delta engine's ``applied`` format (so the
+    version log can replay them); empty when the engine left time alone.
+    The scheduler's transitions are stored in ``facts["events"]``;
+    ``scheduler`` is passed on to ``advance_timeline``.
+    """
+    spent = facts.get("time_passed")
+    if not spent:
+        return []
+    add_time(db, **spent)
+    facts["events"] = advance_timeline(db, scheduler)
+    return [{"path": "time_passed", "op": "time", "target": "world.current_time", "value": dict(spent), "options": {}}] \
+        + timeline_changes(db, facts["events"])
+
+
+def render_facts(facts):
+    """Prompt section with the engine results; the models narrate these instead of recomputing them."""
+    lines = []
+    if facts.get("time_passed"):
+        spent = ", ".join(f"{v} {k}" for k, v in facts["time_passed"].items())
+        lines.append(f"- Action: {facts['action']} -> time passed: {spent} "
+                     f"(already applied to current_time, do not add time_passed again).")
+    travel = facts.get("travel")
+    if travel:
+        if travel.get("fast_travel"):
+            lines.append(f"- Travel {travel['from']} -> {travel['to']}: Fast Travel available (Kuma in crew).")
+        elif not travel["reachable"]:
+            lines.append(f"- Travel {travel['from']} -> {travel['to']}: NO ROUTE in the known sea charts. "
+                         f"The attempt must fail.")
+        else:
+            lines.append(f"- Travel route: {' -> '.join(travel['path'])} ({travel['days']} days). "
+                         f"Log Pose lock days per leg: {travel['log_pose_days']}.")
+            if travel["missing_items"]:
+                lines.append(f"- Missing required items: {', '.join(map(str, travel['missing_items']))}. "
+                             f"The voyage must fail or be blocked.")
+    text = "[ENGINE FACTS] (computed by the game engine, do not recalculate)\n" + "\n".join(lines) if lines else ""
+    events = render_transitions(facts.get("events"))
+    return "\n".join(seg for seg in (text, events) if seg)
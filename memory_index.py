@@ -0,0 +1,232 @@
+import heapq
+import math
+import re
+import threading
+
+from context_builder import estimate_tokens
+from world_log import entry_text
+
+MEMORY_TOP_K = 4
+MEMORY_TOKEN_BUDGET = 500
+PASSAGE_CHARS = 600
+
+# ไทยไม่มีเว้นวรรคระหว่างคำ ใช้ bigram ของตัวอักษรแทนการตัดคำ (ไม่ต้องใช้ dictionary / network)
+_TOKEN_RE = re.compile(r'[\u0E00-\u0E7F]+|[a-z0-9]+')
+_THAI_MARKS_RE = re.compile(r'[\u0E31\u0E34-\u0E3A\u0E47-\u0E4E]')
+_STOPWORDS = frozenset("the a an and or of to in on at is are was were be it for with as by from that this".split())
+
+
+def tokenize(text):
+    """Latin/digit words plus character bigrams of Thai runs (vowel and tone marks dropped)."""
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if run[0] >= '\u0E00':
+            # สระบน/ล่างกับวรรณยุกต์สะกดไม่ตรงกันบ่อย ตัดทิ้งก่อนแล้วค่อยทำ bigram
+            run = _THAI_MARKS_RE.sub('', run)
+            if len(run) == 1:
+                tokens.append(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        elif len(run) > 1 and run not in _STOPWORDS:
+            tokens.append(run)
+    return tokens
+
+
+def split_passages(text, size=PASSAGE_CHARS):
+    """Split on blank lines, packing paragraphs into passages of about ``size`` characters."""
+    passages, current = [], ""
+    for para in re.split(r'\n\s*\n', text):
+        para = para.strip()
+        if not para:
+            continue
+        while len(para) > size:
+            if current:
+                passages.append(current)
+                current = ""
+            passages.append(para[:size])
+            para = para[size:]
+        if current and len(current) + len(para) + 2 > size:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n\n{para}" if current else para
+    if current:
+        passages.append(current)
+    return passages
+
+
+class MemoryIndex:
+    """In-memory BM25 inverted index over dialog passages and db['log'] entries.
+
+    ``sync`` only indexes what was appended since the last call (dialog
+    messages by position/id, log entries by sequence number) and rebuilds
+    that source only when it was rewritten (rewind, upload, clear). Log
+    entries rolled out to the archive (world_log.py) are dropped. ``search``
+    walks the postings of the query's most selective terms only and stops
+    admitting new passages once the top ``k`` is settled, so its cost does
+    not grow with the number of common bigrams.
+    """
+
+    def __init__(self, k1=1.2, b=0.75, max_query_terms=12, max_df=0.5):
+        self.k1 = k1
+        self.b = b
+        self.max_query_terms = max_query_terms
+        self.max_df = max_df
+        self._lock = threading.Lock()
+        self._docs = {}         # doc_id -> {"text", "source", "pos", "len"}
+        self._lens = {}         # doc_id -> จำนวน token (แยกไว้ให้ loop ตอน search อ่านเร็ว)
+        self._postings = {}     # term -> {doc_id: tf}
+        self._total_len = 0
+        self._dialog_ids = []   # id ของข้อความ dialog ที่ index แล้ว ตามลำดับ
+        self._dialog_docs = {}  # ตำแหน่งข้อความ dialog -> doc_id ของ passage (ไว้ตัดช่วงข้อความล่าสุดตอน search)
+        self._log = []          # log entry ที่ index แล้ว ตามลำดับ
+        self._log_base = 0      # ลำดับ (seq) ของ self._log[0]
+
+    # ---------- build ----------
+    def _add(self, doc_id, text, source, pos):
+        terms = tokenize(text)
+        if not terms:
+            return
+        tf = {}
+        for term in terms:
+            tf[term] = tf.get(term, 0) + 1
+        for term, count in tf.items():
+            self._postings.setdefault(term, {})[doc_id] = count
+        self._docs[doc_id] = {"text": text, "source": source, "pos": pos, "len": len(terms)}
+        if source == "dialog":
+            self._dialog_docs.setdefault(pos, []).append(doc_id)
+        self._lens[doc_id] = len(terms)
+        self._total_len += len(terms)
+
+    def _drop_source(self, source):
+        self._drop({d for d, doc in self._docs.items() if doc["source"] == source})
+
+    def _drop(self, dropped):
+        if not dropped:
+            return
+        for term in list(self._postings):
+            postings = self._postings[term]
+            for doc_id in dropped.intersection(postings):
+                del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+        for doc_id in dropped:
+            self._total_len -= self._docs.pop(doc_id)["len"]
+            del self._lens[doc_id]
+
+    def sync(self, history, log=None, log_base=0):
+        """Index new dialog messages and log entries; re-index a source that was rewritten.
+
+        ``log_base`` is ``db['log_base']``, the sequence number of ``log[0]``.
+        """
+        with self._lock:
+            ids = [m.get("id") or f"#{i}" for i, m in enumerate(history)]
+            known = len(self._dialog_ids)
+            if known > len(ids) or ids[:known] != self._dialog_ids:
+                self._drop_source("dialog")
+                self._dialog_ids = []
+                self._dialog_docs = {}
+                known = 0
+            for pos in range(known, len(history)):
+                content = str(history[pos].get("content", ""))
+                for i, passage in enumerate(split_passages(content)):
+                    self._add(f"d:{ids[pos]}:{i}", passage, "dialog", pos)
+            self._dialog_ids = ids
+
+            log = log or []
+            shift = log_base - self._log_base
+            if 0 < shift <= len(self._log) and log[:len(self._log) - shift] == self._log[shift:]:
+                # หัว log ถูกย้ายไป archive ทิ้งเฉพาะ entry ที่ออกไป ที่เหลือ seq เดิม
+                self._drop({f"l:{self._log_base + i}" for i in range(shift)}.intersection(self._docs))
+                self._log = self._log[shift:]
+                self._log_base = log_base
+            known = len(self._log)
+            if log_base != self._log_base or known > len(log) or log[:known] != self._log:
+                self._drop_source("log")
+                self._log = []
+                self._log_base = log_base
+                known = 0
+            for pos in range(known, len(log)):
+                self._add(f"l:{log_base + pos}", entry_text(log[pos]), "log", log_base + pos)
+            self._log = list(log)
+
+    # ---------- query ----------
+    def search(self, query, k=MEMORY_TOP_K, skip_dialog_from=None):
+        """Top-``k`` passages as ``[{text, source, pos, score}]``.
+
+        Dialog passages at position ``skip_dialog_from`` or later (the recent
+        window that is already in the prompt) are left out. Terms found in
+        more than ``max_df`` of the passages are ignored when rarer ones
+        match, and once the current top ``k`` cannot be overtaken by a
+        passage that has not been seen yet, the remaining (commoner) terms
+        only rescore the candidates that can still make it (max-score
+        pruning).
+        """
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs:
+                return []
+            avg_len = self._total_len / n_docs
+            terms = []
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if postings:
+                    df = len(postings)
+                    terms.append((math.log(1 + (n_docs - df + 0.5) / (df + 0.5)), postings))
+            # term ที่เจอเกินครึ่งของ passage ทิ้งได้ถ้ายังมี term อื่นเหลือ (index เล็ก ๆ ทุก term อาจเป็นแบบนี้)
+            rare = [t for t in terms if len(t[1]) <= self.max_df * n_docs]
+            terms = rare or terms
+            # ใช้เฉพาะ term ที่หายากที่สุด (idf สูง) bigram ที่เจอทุกเอกสารแทบไม่มีผลกับอันดับ
+            terms.sort(key=lambda t: t[0], reverse=True)
+            terms = terms[:self.max_query_terms]
+            skip = ()
+            if skip_dialog_from is not None:
+                skip = [d for pos, ids in self._dialog_docs.items() if pos >= skip_dialog_from for d in ids]
+            k1 = self.k1
+            lens = self._lens
+            base, slope = k1 * (1 - self.b), k1 * self.b / avg_len
+            # คะแนนสูงสุดที่ term หนึ่งให้ได้คือ idf * (k1 + 1) (tf / (tf + K) < 1)
+            remaining = sum(idf for idf, _ in terms) * (k1 + 1)
+            scores = {}
+            admitting = True
+            for idf, postings in terms:
+                weight = idf * (k1 + 1)
+                remaining -= weight
+                if admitting and len(scores) >= k:
+                    threshold = heapq.nlargest(k, scores.values())[-1]
+                    if threshold >= weight + remaining:
+                        admitting = False
+                if admitting:
+                    for doc_id, tf in postings.items():
+                        scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf / (tf + base + slope * lens[doc_id])
+                    for doc_id in skip:
+                        scores.pop(doc_id, None)
+                    continue
+                # passage ใหม่ติด top k ไม่ได้แล้ว เหลือแค่ปรับคะแนน candidate ที่ยังมีลุ้น
+                cutoff = threshold - weight - remaining
+                scores = {d: s for d, s in scores.items() if s >= cutoff}
+                for doc_id in scores:
+                    tf = postings.get(doc_id)
+                    if tf:
+                        scores[doc_id] += weight * tf / (tf + base + slope * lens[doc_id])
+                threshold = heapq.nlargest(k, scores.values())[-1]
+            docs = self._docs
+            hits = []
+            for doc_id, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1]):
+                doc = docs[doc_id]
+                hits.append({"text": doc["text"], "source": doc["source"], "pos": doc["pos"], "score": round(score, 3)})
+            return hits
+
+
+def render_memories(hits, token_budget=MEMORY_TOKEN_BUDGET):
+    """Prompt section for retrieved passages (dialog then log, oldest first), within ``token_budget``."""
+    lines, used = [], 0
+    for hit in hits:
+        line = f"- ({'log' if hit['source'] == 'log' else 'turn'} {hit['pos']}) {hit['text']}"
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            continue
+        lines.append((hit["source"], hit["pos"], line))
+        used += cost
+    if not lines:
+        return ""
+    lines.sort()
+    return "[RELEVANT PAST EVENTS]\n" + "\n".join(line for _, _, line in lines)
@@ -0,0 +1,203 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+TRACE_CAPACITY = 200
+# ราคา USD ต่อ 1M token: {model: [input, output]} (ตั้งใน secrets MODEL_PRICES ไม่ตั้งก็ไม่คิดเงิน)
+MODEL_PRICES = {}
+# ค่าตัวเลขใน span ที่รวมเป็นยอดต่อเทิร์น
+TOTAL_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens", "bytes_in", "bytes_out", "retries")
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def record_usage(span, usage):
+    """Copy token counts from an OpenAI ``usage`` or a Gemini ``usage_metadata`` object into ``span``."""
+    if usage is None:
+        return
+    if hasattr(usage, "prompt_token_count"):
+        span["prompt_tokens"] = getattr(usage, "prompt_token_count", 0) or 0
+        span["completion_tokens"] = getattr(usage, "candidates_token_count", 0) or 0
+        span["cached_tokens"] = getattr(usage, "cached_content_token_count", 0) or 0
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    span["prompt_tokens"] = getattr(usage, "prompt_tokens", 0) or 0
+    span["completion_tokens"] = getattr(usage, "completion_tokens", 0) or 0
+    span["cached_tokens"] = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+
+
+class TurnTrace:
+    """Timed spans of one turn (context, gemini, gpt, extract, merge, saves, ...).
+
+    A span is a dict: ``name``, ``start`` / ``ms`` relative to the turn, plus
+    whatever the caller fills in (tokens, bytes, retries, model). Spans may
+    nest or come from other threads; they are only collected, never linked.
+    ``kind`` is ``"turn"`` for a player turn or ``"background"`` for work
+    queued after one (summary fold), which stays out of the turn latencies.
+    """
+
+    def __init__(self, label="", session_id="", prices=None, kind="turn"):
+        self.label = label
+        self.session_id = session_id
+        self.kind = kind
+        self.prices = prices or {}
+        self.started_at = time.time()
+        self.status = "running"
+        self.ms = None
+        self.spans = []
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def begin(self, name, **attrs):
+        return {"name": name, "start": time.perf_counter() - self._t0, **attrs}
+
+    def mark(self, span, key):
+        """Store the time since ``span`` began (ms) under ``key``, once (e.g. time to first chunk)."""
+        if key not in span:
+            span[key] = round((time.perf_counter() - self._t0 - span["start"]) * 1000, 3)
+
+    def end(self, span):
+        if "ms" in span:
+            return span
+        span["ms"] = round((time.perf_counter() - self._t0 - span["start"]) * 1000, 3)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name, **attrs):
+        record = self.begin(name, **attrs)
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            self.end(record)
+
+    def add(self, name, seconds, **attrs):
+        """Record time that was accumulated elsewhere (e.g. parsing spread across stream chunks)."""
+        span = {"name": name, "start": time.perf_counter() - self._t0 - seconds, **attrs}
+        span["ms"] = round(seconds * 1000, 3)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def finish(self, status="done"):
+        self.status = status
+        self.ms = round((time.perf_counter() - self._t0) * 1000, 3)
+
+    def cost(self, span):
+        price = self.prices.get(span.get("model"))
+        if not price:
+            return 0.0
+        return (span.get("prompt_tokens", 0) * price[0] + span.get("completion_tokens", 0) * price[1]) / 1_000_000
+
+    def totals(self):
+        with self._lock:
+            spans = list(self.spans)
+        totals = {field: sum(s.get(field, 0) for s in spans) for field in TOTAL_FIELDS}
+        totals["cost"] = round(sum(self.cost(s) for s in spans), 6)
+        return totals
+
+    def as_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {"label": self.label, "session_id": self.session_id, "kind": self.kind, "started_at": self.started_at,
+                "status": self.status, "ms": self.ms, "totals": self.totals(),
+                "spans": sorted(spans, key=lambda s: s["start"])}
+
+
+class Metrics:
+    """Bounded ring buffer of turn traces (plus spans recorded outside a turn) for the metrics panel.
+
+    Shared by every session in the process. ``export_trace`` writes the
+    buffer in Chrome trace-event format (open in chrome://tracing or Perfetto).
+    Spans recorded outside a turn have no session and are only exported
+    with the whole buffer.
+    """
+
+    def __init__(self, capacity=TRACE_CAPACITY, prices=None):
+        self.prices = dict(MODEL_PRICES, **(prices or {}))
+        self.turns = deque(maxlen=capacity)
+        self.events = TurnTrace("(outside turns)", prices=self.prices)
+        self._events_cap = capacity
+        self._lock = threading.Lock()
+
+    def start_turn(self, label="", session_id="", kind="turn"):
+        trace = TurnTrace(label, session_id, self.prices, kind)
+        with self._lock:
+            self.turns.append(trace)
+        return trace
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Span that is not part of a turn (e.g. ``save_json`` from the UI)."""
+        with self.events.span(name, **attrs) as record:
+            yield record
+        with self.events._lock:
+            del self.events.spans[:-self._events_cap]
+
+    def recent(self, session_id=None, kind=None):
+        with self._lock:
+            turns = list(self.turns)
+        return [t for t in turns if (session_id is None or t.session_id == session_id)
+                and (kind is None or t.kind == kind)]
+
+    def summary(self, session_id=None):
+        """p50/p95 per span name over the finished turns in the buffer, plus token and cost totals.
+
+        Latencies cover player turns only; the totals also count background
+        traces (their tokens are spent all the same).
+        """
+        finished = [t for t in self.recent(session_id) if t.ms is not None]
+        turns = [t for t in finished if t.kind == "turn"]
+        by_name = {}
+        for trace in turns:
+            per_turn = {}
+            for span in trace.as_dict()["spans"]:
+                per_turn[span["name"]] = per_turn.get(span["name"], 0.0) + span["ms"]
+            for name, ms in per_turn.items():
+                by_name.setdefault(name, []).append(ms)
+        totals = {field: 0 for field in TOTAL_FIELDS}
+        totals["cost"] = 0.0
+        for trace in finished:
+            for field, value in trace.totals().items():
+                totals[field] += value
+        rows = [{"span": name, "n": len(values), "p50_ms": round(_percentile(values, 50), 1),
+                 "p95_ms": round(_percentile(values, 95), 1), "max_ms": round(max(values), 1)}
+                for name, values in by_name.items()]
+        rows.sort(key=lambda row: row["p95_ms"], reverse=True)
+        totals_ms = [t.ms for t in turns]
+        return {"turns": len(turns), "p50_ms": round(_percentile(totals_ms, 50), 1),
+                "p95_ms": round(_percentile(totals_ms, 95), 1), "spans": rows, "totals": totals}
+
+    def export_trace(self, session_id=None):
+        """Chrome trace-event JSON (bytes) of the buffer, or of ``session_id``'s traces: one row (tid) per turn."""
+        events = []
+        traces = self.recent(session_id)
+        if session_id is None:
+            traces.append(self.events)
+        for tid, trace in enumerate(traces, 1):
+            data = trace.as_dict()
+            base = data["started_at"] * 1_000_000
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+                           "args": {"name": f"{data['label'][:40]} [{data['status']}]"}})
+            if data["ms"] is not None:
+                events.append({"name": data["kind"], "cat": data["kind"], "ph": "X", "pid": 1, "tid": tid, "ts": base,
+                               "dur": data["ms"] * 1000,
+                               "args": {"totals": data["totals"], "session": data["session_id"]}})
+            for span in data["spans"]:
+                events.append({
+                    "name": span["name"], "cat": "span", "ph": "X", "pid": 1, "tid": tid,
+                    "ts": base + span["start"] * 1_000_000, "dur": span["ms"] * 1000,
+                    "args": {k: v for k, v in span.items() if k not in ("name", "start", "ms")},
+                })
+        return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, ensure_ascii=False).encode('utf-8')
@@ -0,0 +1,100 @@
+import json
+import os
+import string
+
+from context_builder import estimate_tokens
+
+OUTPUT_FORMAT = """
+    [STRICT OUTPUT FORMAT]
+        You must follow this layout exactly:
+        1. **Final story after verify imd improve.
+        2. **[Result]:** (Summary: Success/Failure, HP loss, Location change status, etc)
+        3. **Choices:**
+            1. [Choice A]
+            2. [Choice B]
+            3. [Choice C]
+        4. **JSON Block:** strictly at the end.
+           - **PURE JSON ONLY:** Do NOT include comments (e.g., // or /* */) inside the JSON block.
+           - **NO TRAILING COMMAS:** Ensure the last item in a list/object does not have a comma.
+           Format:
+           ```json
+           {
+             "time_passed": { "days": 0, "hours": 0, "minutes": 0 },
+             "log_entry": "Summary of what happened",
+             "player": {...},
+             "world": {...},
+             "characters": {...},
+             "locations": {...},
+             "unique_items": {...}
+           }
+           ```
+"""
+
+# ซ่อม JSON block ที่ parse ไม่ได้ด้วย model เล็ก (ถูกกว่าให้ตัวใหญ่เขียนทั้งเทิร์นใหม่)
+JSON_REPAIR_INSTRUCTION = (
+    "The user message is a JSON object that fails to parse (it may be cut off, commented or malformed). "
+    "Return the same object as valid JSON only: keep every key and value that is readable, drop what is not, "
+    "add nothing new. No prose, no code fence."
+)
+
+
+def static_prefix(template):
+    """Literal text of a str.format template up to its first placeholder."""
+    parts = []
+    for literal, field, _spec, _conv in string.Formatter().parse(template):
+        parts.append(literal)
+        if field is not None:
+            break
+    return "".join(parts)
+
+
+def render_state(ctx):
+    """Serialize the per-turn world snapshot once; both models receive this same string."""
+    def dumps(data):
+        return json.dumps(data, ensure_ascii=False)
+
+    return f"""
+    [CONTEXT DATA]
+    Player: {dumps(ctx['player'])}
+    World Status: {dumps(ctx['world'])}
+    Current Location Info: {dumps(ctx['location'])}
+    Settings: {dumps(ctx['settings'])}
+    Characters:  {dumps(ctx['characters'])}
+    Other Known Characters (names only): {dumps(ctx['other_characters'])}
+    """
+
+
+class PromptLayout:
+    """Assembles prompts as static prefix + dynamic suffix and tracks prefix reuse.
+
+    Segments are joined in the order given, so callers pass the static ones
+    (system rules, output format) first and per-turn data last. That keeps the
+    leading bytes identical between turns, which is what provider-side prefix
+    caching keys on. ``build`` also reports how much of the prompt matches the
+    previous prompt of the same name.
+    """
+
+    def __init__(self):
+        self._last = {}
+
+    def build(self, name, segments):
+        text = "\n".join(seg for seg in segments if seg)
+        previous = self._last.get(name, b"")
+        current = text.encode('utf-8')
+        shared = len(os.path.commonprefix([previous, current]))
+        # อย่าตัดกลางตัวอักษร UTF-8 (byte ต่อเนื่องขึ้นต้นด้วย 10xxxxxx)
+        while 0 < shared < len(current) and (current[shared] & 0xC0) == 0x80:
+            shared -= 1
+        self._last[name] = current
+
+        reused_text = current[:shared].decode('utf-8', errors='ignore')
+        new_text = current[shared:].decode('utf-8', errors='ignore')
+        stats = {
+            "prompt": name,
+            "total_bytes": len(current),
+            "reused_bytes": shared,
+            "new_bytes": len(current) - shared,
+            "reused_tokens": estimate_tokens(reused_text) if shared else 0,
+            "new_tokens": estimate_tokens(new_text) if shared < len(current) else 0,
+        }
+        return text, stats
@@ -0,0 +1,259 @@
+import random
+import threading
+import time
+
+# ชื่อ exception ของ openai / google-api-core / httpx ที่ลองใหม่แล้วมีโอกาสผ่าน (เทียบด้วยชื่อ ไม่ต้อง import SDK)
+RETRYABLE_NAMES = {
+    "APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError",
+    "DeadlineExceeded", "ServiceUnavailable", "ResourceExhausted", "TooManyRequests",
+    "TimeoutException", "ConnectError", "ReadError", "RemoteProtocolError",
+}
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+DEFAULT_TIMEOUT = 120.0
+POOL_CONNECTIONS = 20
+
+_pool_lock = threading.Lock()
+_http_pool = None
+
+
+class ProviderError(Exception):
+    """A provider call failed after its retries (or was refused by the circuit breaker)."""
+
+
+class CircuitOpen(ProviderError):
+    pass
+
+
+def is_retryable(exc):
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    if isinstance(status, int) and status in RETRYABLE_STATUS:
+        return True
+    return any(cls.__name__ in RETRYABLE_NAMES for cls in type(exc).__mro__)
+
+
+def http_pool(timeout=DEFAULT_TIMEOUT, max_connections=POOL_CONNECTIONS):
+    """One httpx.Client (keep-alive connection pool) per process, shared by every OpenAI client."""
+    global _http_pool
+    with _pool_lock:
+        if _http_pool is None:
+            import httpx
+            _http_pool = httpx.Client(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            )
+        return _http_pool
+
+
+class CircuitBreaker:
+    """Stops calling a provider after ``failures`` consecutive failures, for ``reset_after`` seconds.
+
+    After the pause one trial call is let through (half-open); it closes
+    the circuit on success or opens it again on failure.
+    """
+
+    def __init__(self, failures=5, reset_after=30.0):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._count = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.reset_after else "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_after or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._count = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self._trial or self._count >= self.failures:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+    def answered(self):
+        """The provider replied with an error on our side (bad request, auth).
+
+        That proves it is up, so a half-open trial closes the circuit, but it
+        says nothing about the failures counted so far: outside a trial the
+        count is left alone.
+        """
+        with self._lock:
+            if self._trial:
+                self._count = 0
+                self._opened_at = None
+                self._trial = False
+
+
+class Counted:
+    """A provider result plus ``provider_retries``; every other attribute (and iteration) is the result's."""
+
+    def __init__(self, result, retries):
+        self.result = result
+        self.provider_retries = retries
+
+    def __getattr__(self, name):
+        if name == "result":
+            # ยังไม่ได้ตั้ง result (เช่นตอน copy) อย่าวนหา self.result ไม่รู้จบ
+            raise AttributeError(name)
+        return getattr(self.result, name)
+
+    def __iter__(self):
+        return iter(self.result)
+
+
+class Provider:
+    """Runs provider calls with a timeout, jittered exponential backoff and a circuit breaker.
+
+    Only opening the call is retried (for a stream: until the SDK returns
+    the stream object); once chunks are flowing a failure goes to the caller,
+    which may already have shown part of the reply. The retries a call took
+    come back with it (``call_counted``, or ``provider_retries`` on the
+    exception), not through shared state: hedged calls run on other threads.
+    """
+
+    def __init__(self, name, retries=2, backoff=0.5, max_backoff=8.0, timeout=DEFAULT_TIMEOUT, breaker=None):
+        self.name = name
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.calls = 0
+        self.retried = 0
+        self.failed = 0
+
+    def delay(self, attempt):
+        # full jitter: สุ่ม 0..(base * 2^attempt) กัน client หลายตัวยิงกลับมาพร้อมกัน
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, fn, *args, deadline=None, **kwargs):
+        """``fn(*args, **kwargs)`` with retries. ``deadline`` (time.monotonic) caps the total wait."""
+        return self.call_counted(fn, *args, deadline=deadline, **kwargs)[0]
+
+    def call_counted(self, fn, *args, deadline=None, **kwargs):
+        """Like ``call`` but returns ``(result, retries made)``."""
+        self.calls += 1
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                self.failed += 1
+                raise CircuitOpen(f"{self.name}: circuit open after repeated failures")
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.failure()
+                else:
+                    # error ฝั่งเรา (400 / key ผิด) แปลว่า provider ยังตอบอยู่ ไม่นับว่าล่ม แต่ก็ไม่ล้างยอดที่ล้มมาก่อน
+                    # (ถ้าเป็น trial call ตอน half-open ต้องปล่อย trial คืนด้วย ไม่งั้น breaker ค้าง)
+                    self.breaker.answered()
+                wait = self.delay(attempt)
+                out_of_time = deadline is not None and time.monotonic() + wait >= deadline
+                if not retryable or attempt == self.retries or out_of_time:
+                    self.failed += 1
+                    try:
+                        e.provider_retries = attempt
+                    except AttributeError:
+                        pass
+                    raise
+                print(f"[Provider]: {self.name} failed ({type(e).__name__}: {e}), retry in {wait:.1f}s")
+                self.retried += 1
+                time.sleep(wait)
+                continue
+            self.breaker.success()
+            return result, attempt
+
+    def remaining(self, deadline):
+        left = self.timeout
+        if deadline is not None:
+            left = min(left, max(0.0, deadline - time.monotonic()))
+        return left
+
+
+def _timeout(requested, default):
+    # timeout 0 = งบเวลาของเทิร์นหมดแล้ว ไม่ใช่ "ไม่ได้กำหนด" ห้ามกลายเป็น default
+    if requested is None:
+        return default
+    if requested <= 0:
+        raise TimeoutError("no time left for this call")
+    return requested
+
+
+class ChatProvider(Provider):
+    """Drop-in for an OpenAI client in TurnPipeline: ``chat.completions.create(**params)`` goes through ``call``."""
+
+    def __init__(self, client, name="openai", **kwargs):
+        super().__init__(name, **kwargs)
+        self.client = client
+
+    @property
+    def chat(self):
+        return self
+
+    @property
+    def completions(self):
+        return self
+
+    def create(self, **params):
+        timeout = _timeout(params.get("timeout"), self.timeout)
+        deadline = time.monotonic() + timeout
+        params = dict(params, timeout=timeout)
+
+        def attempt():
+            params["timeout"] = self.remaining(deadline)
+            return self.client.chat.completions.create(**params)
+        return Counted(*self.call_counted(attempt, deadline=deadline))
+
+
+class StoryProvider(Provider):
+    """Drop-in for TurnPipeline's ``story_model(instruction)``; ``generate_content`` goes through ``call``."""
+
+    def __init__(self, model_factory, name="gemini", **kwargs):
+        super().__init__(name, **kwargs)
+        # model_factory(system_instruction) -> GenerativeModel (เช่น ModelPool.get)
+        self.model_factory = model_factory
+
+    def __call__(self, instruction):
+        return _StoryModel(self, self.model_factory(instruction))
+
+
+class _StoryModel:
+    def __init__(self, provider, model):
+        self.provider = provider
+        self.model = model
+
+    def generate_content(self, contents, **kwargs):
+        provider = self.provider
+        options = dict(kwargs.pop("request_options", None) or {})
+        deadline = time.monotonic() + _timeout(options.get("timeout"), provider.timeout)
+
+        def attempt():
+            options["timeout"] = provider.remaining(deadline)
+            return self.model.generate_content(contents, request_options=options, **kwargs)
+        return Counted(*provider.call_counted(attempt, deadline=deadline))
+
+
+def retries_of(outcome):
+    """Retries behind a provider response or exception (0 for anything that did not go through a Provider)."""
+    return getattr(outcome, "provider_retries", 0)
@@ -0,0 +1,390 @@
+import json
+import re
+
+FENCE = "```"
+# แท็กหลัง ``` ที่ถือว่าเป็น block state (ว่าง = ดูจากเนื้อหาว่าขึ้นต้นด้วย { ไหม)
+JSON_TAGS = ("json", "json5", "jsonc", "javascript", "js", "")
+MAX_TAG_CHARS = 20
+PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+_RESULT_RE = re.compile(r'^\W*\[?\s*(?:Result|ผลลัพธ์)\s*\]?\s*\W*:\W*\s*(.*)$', re.IGNORECASE)
+_CHOICES_RE = re.compile(r'^\W*(?:Choices|ทางเลือก)\s*\W*:?\W*\s*$', re.IGNORECASE)
+_CHOICE_ITEM_RE = re.compile(r'^\s*(?:\d+[.)]|[-*•])\s*(.+?)\s*$')
+_PARTIAL_NUMBER_RE = re.compile(r'[-+.eE]+$')
+_BARE_WORD_RE = re.compile(r'[A-Za-z_]+$')
+_WORD_RE = re.compile(r'[A-Za-z_]+')
+# ตัวเลขทั้งก้อน (รวม exponent และตัวที่ถูกตัดจบกลาง เช่น "1.5e") ไม่ให้ e ไปเข้า branch คำ
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d*)?(?:[eE][-+]?\d*)?')
+# ค่าที่ไม่มีเครื่องหมายคำพูด (เช่น ภาษาไทย) เก็บทั้งก้อนจนถึงตัวคั่นถัดไป
+_BARE_RUN_RE = re.compile(r'[^\s,:{}\[\]"/]+')
+
+
+def _partial_suffix(text, marker):
+    # ความยาวท้าย text ที่อาจเป็นต้นของ marker (เช่น "``" ที่ยังรอ "`" มาต่อ)
+    for k in range(min(len(marker) - 1, len(text)), 0, -1):
+        if text.endswith(marker[:k]):
+            return k
+    return 0
+
+
+def _close_truncated(text, stack, key_start, repairs):
+    """Cut a dangling key / colon / partial literal / comma off the end of ``text`` and close its brackets."""
+    while True:
+        text = text.rstrip()
+        if text.endswith(","):
+            text = text[:-1]
+        elif text.endswith(":") and key_start is not None:
+            # "key": ที่ยังไม่มีค่า ตัดทั้ง key ทิ้ง
+            text, key_start = text[:key_start], None
+        elif _BARE_WORD_RE.search(text) and not text.endswith(("true", "false", "null")):
+            text = _BARE_WORD_RE.sub("", text)
+        elif text and text[-1] in "-+.eE" and _PARTIAL_NUMBER_RE.search(text):
+            text = _PARTIAL_NUMBER_RE.sub("", text)
+        else:
+            break
+        repairs.append("dropped_dangling")
+    return text + "".join(reversed(stack))
+
+
+def repair_json(text):
+    """Parse ``text`` as a JSON object, repairing what LLMs typically get wrong, in one linear scan.
+
+    Handles ``//`` and ``/* */`` comments, trailing commas, Python literals,
+    raw newlines inside strings, text around the object and output cut off
+    mid-way (open strings / keys / brackets are closed). Returns
+    ``(data, repairs)``; ``data`` is None if it still does not parse.
+    """
+    repairs = []
+    start = text.find("{")
+    if start < 0:
+        return None, ["no_object"]
+    if text[:start].strip():
+        repairs.append("leading_text")
+    try:
+        data, end = json.JSONDecoder(strict=False).raw_decode(text, start)
+        if text[end:].strip():
+            repairs.append("trailing_text")
+        return (data, repairs) if isinstance(data, dict) else (None, repairs)
+    except json.JSONDecodeError:
+        pass
+
+    out = []
+    size = 0
+    stack = []
+    key_start = None     # ตำแหน่ง (ใน output) ของ key ล่าสุดที่ยังไม่ได้ค่า ไว้ตัดทิ้งถ้าถูกตัดจบกลางคู่
+    prev = ""            # ตัวอักษรสำคัญตัวล่าสุดนอก string
+    in_string = False
+    i, n = start, len(text)
+    while i < n:
+        c = text[i]
+        if in_string:
+            step = 1
+            if c == "\\" and i + 1 < n:
+                c = text[i:i + 2]
+                step = 2
+            elif c == '"':
+                in_string = False
+                prev = '"'
+            elif c == "\n":
+                c = "\\n"
+                repairs.append("newline_in_string")
+            out.append(c)
+            size += len(c)
+            i += step
+            continue
+        if c == "/" and text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end < 0 else end
+            repairs.append("comment")
+            continue
+        if c == "/" and text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            repairs.append("comment")
+            continue
+        if c.isdigit() or c == "-":
+            m = _NUMBER_RE.match(text, i)
+            if m:
+                c = m.group(0)
+                out.append(c)
+                size += len(c)
+                prev = c[-1]
+                i += len(c)
+                continue
+        if c.isalpha():
+            m = _WORD_RE.match(text, i)
+            word = m.group(0) if m else ""
+            if word in PY_LITERALS:
+                c = PY_LITERALS[word]
+                repairs.append("python_literal")
+            elif word in ("true", "false", "null"):
+                c = word
+            else:
+                word = _BARE_RUN_RE.match(text, i).group(0)
+                if i + len(word) == n and any(lit.startswith(word) for lit in (*PY_LITERALS, "true", "false", "null")):
+                    # literal ที่ถูกตัดจบกลางคำ ปล่อยให้ _close_truncated ตัดทิ้ง
+                    c = word
+                else:
+                    # ข้อความไม่มี "" (ไม่ใช่ literal ของ JSON) ใส่ "" ให้ แทนที่จะพังทั้ง block
+                    c = json.dumps(word, ensure_ascii=False)
+                    repairs.append("unquoted_value")
+            out.append(c)
+            size += len(c)
+            prev = c[-1]
+            i += len(word)
+            continue
+        if c == '"':
+            in_string = True
+            if stack and stack[-1] == "}" and prev in "{,":
+                key_start = size
+            out.append(c)
+            size += 1
+            i += 1
+            continue
+        if c in "{[":
+            stack.append("}" if c == "{" else "]")
+            key_start = None
+        elif c in "}]":
+            if prev == ",":
+                # ลบ , ที่ค้างก่อนปิด
+                j = len(out) - 1
+                while out[j].isspace():
+                    j -= 1
+                size -= len(out.pop(j))
+                repairs.append("trailing_comma")
+            if stack:
+                stack.pop()
+            out.append(c)
+            size += 1
+            i += 1
+            prev = c
+            if not stack:
+                if text[i:].strip():
+                    repairs.append("trailing_text")
+                break
+            continue
+        elif c == ",":
+            key_start = None
+        out.append(c)
+        size += len(c)
+        if not c.isspace():
+            prev = c
+        i += 1
+
+    result = "".join(out)
+    if in_string:
+        result += '"'
+        repairs.append("truncated")
+        if key_start is not None and prev in "{,":
+            # ถูกตัดจบกลางชื่อ key
+            result, key_start = result[:key_start], None
+    if stack:
+        if "truncated" not in repairs:
+            repairs.append("truncated")
+        result = _close_truncated(result, stack, key_start, repairs)
+    try:
+        data = json.loads(result, strict=False)
+    except json.JSONDecodeError:
+        return None, list(dict.fromkeys(repairs))
+    if not isinstance(data, dict):
+        return None, list(dict.fromkeys(repairs))
+    # เรียงตามที่เจอครั้งแรก ไม่ซ้ำ
+    return data, list(dict.fromkeys(repairs))
+
+
+def split_sections(story):
+    """``{"story", "result", "choices"}`` from the story part of a reply (layout from OUTPUT_FORMAT)."""
+    lines = story.split("\n")
+    narrative, result, choices = [], [], []
+    section = "story"
+    for line in lines:
+        m = _RESULT_RE.match(line) if section != "choices" else None
+        if m:
+            section = "result"
+            if m.group(1).strip():
+                result.append(m.group(1).strip())
+            continue
+        if _CHOICES_RE.match(line):
+            section = "choices"
+            continue
+        if section == "story":
+            narrative.append(line)
+        elif section == "result":
+            if line.strip():
+                result.append(line.strip())
+        else:
+            m = _CHOICE_ITEM_RE.match(line)
+            if m:
+                choices.append(m.group(1).strip("*[] "))
+            elif line.strip() and choices:
+                choices[-1] += " " + line.strip()
+    return {"story": "\n".join(narrative).strip(), "result": " ".join(result), "choices": choices}
+
+
+class StreamingReplyParser:
+    """Splits a streamed GPT reply into story text and the JSON state block, in one pass.
+
+    Feed chunks as they arrive: ``feed`` returns the story text that is safe to
+    show (never a piece of a fence or of the state JSON), and ``on_json`` is
+    called with the parsed dict as soon as the state block closes, before the
+    rest of the stream ends.
+
+    The state block is the first fenced block tagged json (or untagged and
+    starting with ``{``); later JSON blocks are kept out of the story. A block
+    that is not valid JSON is repaired (see ``repair_json``); a reply cut off
+    inside the block is repaired on ``finish``, and a reply with no fence at
+    all is searched for a trailing JSON object. ``repairs`` lists what was fixed.
+    """
+
+    def __init__(self, on_json=None):
+        self.on_json = on_json
+        self.story = ""
+        self.json_text = ""
+        self.data = None
+        self.error = None
+        self.repairs = []
+        self._raw = []
+        self._state = "story"    # story / tag / json / code / extra
+        self._pending = ""
+        self._block = ""
+        self._tag = ""
+
+    @property
+    def raw(self):
+        return "".join(self._raw)
+
+    @property
+    def json_closed(self):
+        return self.data is not None or self.error is not None
+
+    @property
+    def sections(self):
+        return split_sections(self.story)
+
+    def feed(self, chunk):
+        if not chunk:
+            return ""
+        self._raw.append(chunk)
+        self._pending += chunk
+        shown = []
+        while self._pending:
+            if self._state in ("story", "code"):
+                idx = self._pending.find(FENCE)
+                if idx < 0:
+                    keep = _partial_suffix(self._pending, FENCE)
+                    shown.append(self._pending[:len(self._pending) - keep])
+                    self._pending = self._pending[len(self._pending) - keep:]
+                    break
+                shown.append(self._pending[:idx])
+                self._pending = self._pending[idx + len(FENCE):]
+                if self._state == "code":
+                    # ปิด code block ธรรมดาในเนื้อเรื่อง
+                    shown.append(FENCE)
+                    self._state = "story"
+                else:
+                    self._state = "tag"
+                continue
+
+            if self._state == "tag":
+                end = self._pending.find("\n")
+                if end < 0 and len(self._pending) < MAX_TAG_CHARS:
+                    break
+                if end < 0:
+                    end = 0
+                self._tag = self._pending[:end].strip().lower()
+                if self._tag in JSON_TAGS:
+                    self._pending = self._pending[end + 1 if end else 0:]
+                    self._block = ""
+                    self._state = "json"
+                else:
+                    shown.append(FENCE)
+                    self._state = "code"
+                continue
+
+            # json: เก็บจนเจอ ``` ปิด
+            idx = self._pending.find(FENCE)
+            if idx < 0:
+                keep = _partial_suffix(self._pending, FENCE)
+                self._block += self._pending[:len(self._pending) - keep]
+                self._pending = self._pending[len(self._pending) - keep:]
+                break
+            self._block += self._pending[:idx]
+            self._pending = self._pending[idx + len(FENCE):]
+            shown.append(self._close_block())
+            self._state = "story"
+
+        text = "".join(shown)
+        self.story += text
+        return text
+
+    def _close_block(self):
+        """Handle a finished fenced block; returns text to put back into the story (non-JSON untagged blocks)."""
+        block = self._block
+        self._block = ""
+        if not self._tag and not block.lstrip().startswith("{"):
+            return FENCE + "\n" + block + FENCE
+        if self.json_closed:
+            self.repairs.append("extra_json_block")
+            return ""
+        self._parse(block)
+        return ""
+
+    def finish(self):
+        """Flush buffered text at end of stream. A truncated JSON block is repaired and parsed."""
+        shown = ""
+        if self._state == "json":
+            self._block += self._pending
+            shown = self._close_block()
+        elif self._state == "tag":
+            shown = FENCE + self._pending
+        else:
+            shown = self._pending
+        self._pending = ""
+        self._state = "story"
+        self.story += shown
+        if not self.json_closed:
+            self._find_unfenced()
+        return shown
+
+    def _find_unfenced(self):
+        # ไม่มี fence เลย: ลองหา object JSON ที่ขึ้นบรรทัดใหม่ตัวสุดท้ายท้ายเนื้อเรื่อง
+        idx = self.story.rfind("\n{")
+        idx = idx + 1 if idx >= 0 else (0 if self.story.lstrip().startswith("{") else -1)
+        if idx < 0:
+            return
+        data, repairs = repair_json(self.story[idx:])
+        if data is None:
+            return
+        self.repairs.append("unfenced_json")
+        self.json_text = self.story[idx:].strip()
+        self.story = self.story[:idx]
+        self._accept(data, repairs)
+
+    def _parse(self, block):
+        self.json_text = block.strip()
+        data, repairs = repair_json(self.json_text)
+        if data is None:
+            self.repairs.extend(repairs)
+            self.error = ValueError(f"unparseable JSON block ({', '.join(repairs) or 'invalid'})")
+            return
+        self._accept(data, repairs)
+
+    def accept(self, data, repair="external_repair"):
+        """Use ``data`` as the state block after it was fixed outside the parser (e.g. by a model)."""
+        self.error = None
+        self._accept(data, [repair])
+
+    def _accept(self, data, repairs):
+        self.repairs.extend(repairs)
+        self.data = data
+        if self.on_json is not None:
+            self.on_json(self.data)
+
+
+def extract_reply(text):
+    """One-shot version of StreamingReplyParser: ``{"story", "result", "choices", "data", "json_text", "repairs", "error"}``."""
+    parser = StreamingReplyParser()
+    parser.feed(text)
+    parser.finish()
+    return dict(parser.sections, data=parser.data, json_text=parser.json_text,
+                repairs=parser.repairs, error=str(parser.error) if parser.error else None)
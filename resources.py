@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# โมดูลนี้ถูก import ครั้งเดียวต่อ process (Streamlit rerun แค่ app.py) ของที่เก็บไว้ที่นี่จึงอยู่ข้าม rerun
+_lock = threading.Lock()
+_openai_clients = {}
+_gemini_configured = {}
+
+
+def get_openai_client(api_key, base_url=None, http_client=None):
+    """One OpenAI client per (API key, base URL) per process; the SDK is imported on first use.
+
+    Retries are left to providers.ChatProvider (the SDK's own are turned
+    off so the two don't multiply); ``http_client`` is a shared httpx pool.
+    """
+    with _lock:
+        client = _openai_clients.get((api_key, base_url))
+        if client is None:
+            import openai
+            client = openai.OpenAI(api_key=api_key, base_url=base_url or None, http_client=http_client, max_retries=0)
+            _openai_clients[(api_key, base_url)] = client
+        return client
+
+
+def get_genai(api_key, base_url=None):
+    """google.generativeai configured once per process (optionally against another endpoint)."""
+    with _lock:
+        genai = _gemini_configured.get((api_key, base_url))
+        if genai is None:
+            import google.generativeai as genai
+            # endpoint อื่น (proxy / fake server ตอนทดสอบ) ใช้ REST แทน gRPC
+            options = {"transport": "rest", "client_options": {"api_endpoint": base_url}} if base_url else {}
+            genai.configure(api_key=api_key, **options)
+            _gemini_configured.clear()
+            _gemini_configured[(api_key, base_url)] = genai
+        return genai
+
+
+class ModelPool:
+    """LRU pool of GenerativeModel objects keyed by (model name, system instruction)."""
+
+    def __init__(self, factory, max_size=16):
+        # factory(model_name, system_instruction) -> model
+        self.factory = factory
+        self.max_size = max_size
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model_name, system_instruction):
+        key = (model_name, hashlib.sha256(system_instruction.encode('utf-8')).hexdigest())
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+        model = self.factory(model_name, system_instruction)
+        with self._lock:
+            self._models[key] = model
+            while len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+        return model
+
+
+class JsonFileCache:
+    """Parsed JSON files kept in memory and re-read only when the file's mtime changes."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def load(self, filepath, default_value):
+        try:
+            stamp = os.stat(filepath).st_mtime_ns
+        except OSError:
+            return default_value
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is not None and entry[0] == stamp:
+                return entry[1]
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return default_value
+        with self._lock:
+            self._entries[filepath] = (stamp, data)
+        return data
+
+    def invalidate(self, filepath=None):
+        with self._lock:
+            if filepath is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(filepath, None)
+
+
+json_cache = JsonFileCache()
@@ -0,0 +1,190 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from mechanics import classify_action
+
+FULL = "full"
+FAST = "fast"
+FALLBACK = "fallback"
+
+# action ที่ไม่ต้องใช้ร่าง Gemini + ตัวตรวจตัวใหญ่ (ไม่มีการต่อสู้ / เดินทาง / ของใหม่)
+FAST_ACTIONS = ("chat", "rest")
+FAST_PROMPT_CHARS = 200
+# งบเวลา (วินาที) ต่อเทิร์นของแต่ละ profile
+PROFILE_BUDGETS = {FAST: 45.0, FULL: 240.0}
+# ไม่มีร่างจาก Gemini ให้ GPT เขียนเรื่องเองจาก state
+DIRECT_STORY_NOTE = ("Story: (no draft this turn) Write the story yourself from the state above: "
+                     "short, in Thai, with NPC dialogue, following every rule.")
+POLL_SECONDS = 0.25
+
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+
+class ModelRouter:
+    """Picks a pipeline profile per turn from the locally classified action.
+
+    - ``fast``: no Gemini draft; ``fast_model`` writes story + state JSON in one call.
+    - ``full``: Gemini draft -> ``full_model`` verify (the original two-stage turn).
+    - ``fallback``: used at run time when a stage fails or runs out of budget:
+      a failed draft is dropped and the GPT stage goes on without it, and a
+      failed / slow GPT call is retried (or hedged) on ``fallback_model``.
+
+    Each profile has a latency budget; provider timeouts are clamped to what
+    is left of it (and of the job's own timeout).
+    """
+
+    def __init__(self, full_model="gpt-5.2-pro", fast_model="gpt-5-mini", fallback_model="gpt-5-mini",
+                 fast_actions=FAST_ACTIONS, fast_prompt_chars=FAST_PROMPT_CHARS, budgets=None, hedge_after=None):
+        self.full_model = full_model
+        self.fast_model = fast_model
+        self.fallback_model = fallback_model
+        self.fast_actions = tuple(fast_actions)
+        self.fast_prompt_chars = fast_prompt_chars
+        self.budgets = dict(PROFILE_BUDGETS, **(budgets or {}))
+        # วินาทีที่รอ chunk แรกก่อนยิง request สำรองไปที่ fallback_model (None = ไม่ hedge)
+        self.hedge_after = hedge_after
+
+    def route(self, prompt, db, facts=None):
+        """``{"profile", "action", "story", "model", "fallback", "budget", "hedge_after"}`` for this input."""
+        facts = facts or {}
+        action = facts.get("action")
+        if action is None:
+            action = classify_action(prompt, (db.get('settings') or {}).get('action_costs') or {})
+        fast = (action in self.fast_actions and not facts.get("travel")
+                and len(prompt.strip()) <= self.fast_prompt_chars)
+        profile = FAST if fast else FULL
+        model = self.fast_model if fast else self.full_model
+        return {
+            "profile": profile,
+            "action": action,
+            "story": not fast,
+            "model": model,
+            "fallback": self.fallback_model if self.fallback_model != model else None,
+            "budget": self.budgets.get(profile),
+            "hedge_after": self.hedge_after,
+        }
+
+
+class Budget:
+    """Seconds left for this turn: the smaller of the job's timeout and the profile budget."""
+
+    def __init__(self, job, seconds=None):
+        self.job = job
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+
+    def remaining(self):
+        left = self.job.remaining()
+        if self.deadline is not None:
+            own = max(0.0, self.deadline - time.monotonic())
+            left = own if left is None else min(left, own)
+        return left
+
+    def timeout(self, stage):
+        """``remaining()`` as a provider timeout; raises TimeoutError once the budget is spent.
+
+        A spent budget is ``0.0``, never "no timeout", so callers must not
+        fall back to the provider's default for it.
+        """
+        left = self.remaining()
+        if left is not None and left <= 0:
+            raise TimeoutError(f"{stage}: turn budget spent")
+        return left
+
+
+class _Prefetched:
+    """A stream whose first chunk was already read (to see which request answered first)."""
+
+    def __init__(self, response, iterator, first):
+        self.response = response
+        self._iterator = iterator
+        self._first = first
+
+    def __iter__(self):
+        if self._first is not None:
+            first, self._first = self._first, None
+            yield first
+        yield from self._iterator
+
+    @property
+    def provider_retries(self):
+        return getattr(self.response, "provider_retries", 0)
+
+    def close(self):
+        close = getattr(self.response, "close", None)
+        if close is not None:
+            close()
+
+
+def _open(create, params):
+    # เรียก provider แล้วรอจน chunk แรกมา (stream) หรือได้คำตอบทั้งก้อน
+    response = create(**params)
+    if not params.get("stream"):
+        return response
+    iterator = iter(response)
+    return _Prefetched(response, iterator, next(iterator, None))
+
+
+def _discard(future):
+    # request ที่แพ้ ปิด stream ทิ้งเมื่อมันตอบกลับมา
+    def close(done):
+        if done.exception() is None:
+            close_fn = getattr(done.result(), "close", None)
+            if close_fn is not None:
+                close_fn()
+    future.add_done_callback(close)
+
+
+def open_reply(create, params, fallback_model=None, hedge_after=None, check=None, timeout=None):
+    """Call ``create(**params)`` with hedging / fallback; returns ``(response, model_used)``.
+
+    With ``hedge_after`` and a ``fallback_model``: if the primary has not
+    produced its first chunk after ``hedge_after`` seconds, the same request
+    goes to ``fallback_model`` too and whichever answers first wins (the
+    other stream is closed). Without hedging, a primary that raises is
+    retried once on ``fallback_model``. ``check`` is polled while waiting
+    (stop button / job timeout).
+    """
+    if fallback_model is None:
+        return _open(create, params), params.get("model")
+    backup_params = dict(params, model=fallback_model)
+    if hedge_after is None:
+        try:
+            return _open(create, params), params.get("model")
+        except Exception as e:
+            if check is not None:
+                check()
+            print(f"[Router]: {params.get('model')} failed ({e}), falling back to {fallback_model}")
+            return _open(create, backup_params), fallback_model
+
+    started = time.monotonic()
+    futures = {_hedge_pool.submit(_open, create, params): params.get("model")}
+    backup_sent = False
+    errors = []
+    while futures:
+        poll = POLL_SECONDS if backup_sent else max(0.0, min(POLL_SECONDS, started + hedge_after - time.monotonic()))
+        done, _ = wait(list(futures), timeout=poll, return_when=FIRST_COMPLETED)
+        for future in done:
+            model = futures.pop(future)
+            if future.exception() is None:
+                for loser in futures:
+                    _discard(loser)
+                return future.result(), model
+            errors.append(future.exception())
+        if check is not None:
+            try:
+                check()
+            except Exception:
+                for loser in futures:
+                    _discard(loser)
+                raise
+        slow = time.monotonic() - started >= hedge_after
+        if not backup_sent and (slow or errors):
+            # primary ช้าเกินหรือล้มแล้ว ยิง request เดียวกันไปที่ fallback_model
+            backup_sent = True
+            print(f"[Router]: hedging {params.get('model')} with {fallback_model}")
+            futures[_hedge_pool.submit(_open, create, backup_params)] = fallback_model
+        if timeout is not None and time.monotonic() - started > timeout:
+            for loser in futures:
+                _discard(loser)
+            raise TimeoutError(f"no reply within {timeout:.0f}s")
+    raise errors[-1]
@@ -0,0 +1,173 @@
+import copy
+import heapq
+import threading
+from datetime import datetime, timedelta
+
+from game_state import TIME_FMT
+from world_log import log_record
+
+ACTIVE = "Active"
+MISSED = "Missed"
+# สถานะที่ scheduler ไม่ยุ่งแล้ว (GPT ปิด event เองได้ เช่น Completed)
+TERMINAL = {"completed", "done", "resolved", "failed", "missed", "expired", "cancelled"}
+
+UPCOMING_DAYS = 7
+PROMPT_EVENT_LIMIT = 8
+
+
+def _is_terminal(event):
+    return str(event.get('status', '')).lower() in TERMINAL
+
+
+class EventScheduler:
+    """Two min-heaps over the timeline: pending events by ``start_time``, active ones by ``deadline_time``.
+
+    Building the heaps scans the whole timeline once (O(n)); after that
+    ``advance(now)`` pops only the events whose time has come, O(log n)
+    each. Kept between turns by ``TimelineCache``, so a turn that moves the
+    clock only pays for the events that actually start or expire.
+    """
+
+    def __init__(self, timeline):
+        self.rebuild(timeline)
+
+    def rebuild(self, timeline):
+        self.timeline = timeline
+        self._starts = []
+        self._deadlines = []
+        for idx, event in enumerate(timeline):
+            if not isinstance(event, dict) or _is_terminal(event):
+                continue
+            if event.get('status') == ACTIVE or not event.get('start_time'):
+                if event.get('deadline_time'):
+                    self._deadlines.append((event['deadline_time'], idx))
+            else:
+                self._starts.append((event['start_time'], idx))
+        heapq.heapify(self._starts)
+        heapq.heapify(self._deadlines)
+
+    def advance(self, now):
+        """Move every event whose start/deadline is ``<= now`` forward. Returns the transitions."""
+        # เวลาใน DB เป็น TIME_FMT ความยาวคงที่ เทียบ string ตรงๆ ได้เลยไม่ต้อง parse
+        transitions = []
+        while self._starts and self._starts[0][0] <= now:
+            _, idx = heapq.heappop(self._starts)
+            event = self.timeline[idx]
+            transitions.append({"id": event.get('id'), "name": event.get('name'), "from": event.get('status'), "to": ACTIVE})
+            event['status'] = ACTIVE
+            if event.get('deadline_time'):
+                heapq.heappush(self._deadlines, (event['deadline_time'], idx))
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, idx = heapq.heappop(self._deadlines)
+            event = self.timeline[idx]
+            transitions.append({
+                "id": event.get('id'), "name": event.get('name'), "from": event.get('status'), "to": MISSED,
+                "consequence": event.get('consequence_if_missed'), "time": event.get('deadline_time')
+            })
+            event['status'] = MISSED
+        return transitions
+
+
+class TimelineCache:
+    """One campaign's EventScheduler, kept between turns (process-level, like MemoryIndex).
+
+    ``keep(scheduler, token)`` after a save records the store token of the
+    world the heaps describe; ``take(timeline, token)`` hands them over for
+    the next turn's snapshot only if the store is still at that token. Any
+    other write (another session, rewind, upload) changes the token and
+    the heaps are rebuilt once. ``take`` removes the scheduler, so two
+    turns never share heaps.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self._token = None
+
+    def take(self, timeline, token):
+        with self._lock:
+            scheduler, self._scheduler = self._scheduler, None
+            same = scheduler is not None and token is not None and token == self._token
+        if same and len(scheduler.timeline) == len(timeline):
+            # snapshot ใหม่ของโลกเดิมที่เราบันทึกเอง เนื้อหาตรงกัน แค่เป็น list คนละตัว
+            scheduler.timeline = timeline
+            return scheduler
+        return EventScheduler(timeline)
+
+    def keep(self, scheduler, token):
+        with self._lock:
+            self._scheduler, self._token = scheduler, token
+
+
+def advance_timeline(db, scheduler=None):
+    """Advance ``db['world']['timeline']`` to the world's current_time (in place).
+
+    Events whose deadline passed are marked Missed and their consequence is
+    written to ``db['log']``, stamped with the deadline. ``scheduler`` is
+    reused when it was built over this very timeline list; a timeline that
+    was replaced (e.g. by a GPT delta, ops never edit in place) is re-scanned.
+    """
+    world = db.get('world') or {}
+    timeline = world.get('timeline')
+    now = world.get('current_time')
+    if not isinstance(timeline, list) or not now:
+        return []
+    if scheduler is None:
+        scheduler = EventScheduler(timeline)
+    elif scheduler.timeline is not timeline:
+        scheduler.rebuild(timeline)
+    transitions = scheduler.advance(now)
+    for item in transitions:
+        if item["to"] == MISSED and item.get("consequence"):
+            item["log"] = log_record(item.get("time") or now, f"[Timeline] {item['name']}: {item['consequence']}")
+            db.setdefault('log', []).append(item["log"])
+    return transitions
+
+
+def timeline_changes(db, transitions):
+    """Express the scheduler's writes in the delta engine's ``applied`` format (for the version log)."""
+    if not transitions:
+        return []
+    changes = [{
+        "path": "world.timeline", "op": "replace", "target": "world.timeline",
+        "value": copy.deepcopy(db['world']['timeline']), "options": {}
+    }]
+    for item in transitions:
+        if item.get("log"):
+            changes.append({"path": "log_entry", "op": "append", "target": "log", "value": item["log"], "options": {}})
+    return changes
+
+
+def relevant_events(db, upcoming_days=UPCOMING_DAYS, limit=PROMPT_EVENT_LIMIT):
+    """Active events plus those starting within ``upcoming_days``, soonest deadline first."""
+    world = db.get('world') or {}
+    timeline = world.get('timeline')
+    now = world.get('current_time')
+    if not isinstance(timeline, list):
+        return []
+    horizon = None
+    if now:
+        try:
+            horizon = (datetime.strptime(now, TIME_FMT) + timedelta(days=upcoming_days)).strftime(TIME_FMT)
+        except ValueError:
+            horizon = None
+    picked = []
+    for event in timeline:
+        if not isinstance(event, dict) or _is_terminal(event):
+            continue
+        if event.get('status') == ACTIVE or (horizon and (event.get('start_time') or '') <= horizon):
+            picked.append(event)
+    picked.sort(key=lambda e: e.get('deadline_time') or '9999')
+    return picked[:limit]
+
+
+def render_transitions(transitions):
+    if not transitions:
+        return ""
+    lines = []
+    for item in transitions:
+        if item["to"] == ACTIVE:
+            lines.append(f"- Event started: {item['name']} ({item['id']})")
+        else:
+            lines.append(f"- Deadline passed: {item['name']} ({item['id']}) -> {item.get('consequence') or 'missed'}")
+    return "[WORLD EVENTS THIS TURN]\n" + "\n".join(lines)
@@ -0,0 +1,279 @@
+import copy
+import json
+import sqlite3
+import threading
+
+from file_lock import FileLock, VersionConflict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS player (id INTEGER PRIMARY KEY CHECK (id = 1), data TEXT NOT NULL, current_location TEXT);
+CREATE TABLE IF NOT EXISTS characters (
+    name TEXT PRIMARY KEY, data TEXT NOT NULL, location TEXT, faction TEXT, status TEXT, pos INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_characters_location ON characters (location COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_characters_faction ON characters (faction COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS locations (name TEXT PRIMARY KEY, data TEXT NOT NULL, region TEXT, pos INTEGER);
+CREATE INDEX IF NOT EXISTS idx_locations_region ON locations (region);
+CREATE TABLE IF NOT EXISTS timeline (
+    id TEXT PRIMARY KEY, data TEXT NOT NULL, start_time TEXT, deadline_time TEXT, status TEXT, pos INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_timeline_deadline ON timeline (deadline_time);
+CREATE TABLE IF NOT EXISTS unique_items (name TEXT PRIMARY KEY, data TEXT NOT NULL, current_owner TEXT, pos INTEGER);
+CREATE TABLE IF NOT EXISTS log (seq INTEGER PRIMARY KEY, entry TEXT NOT NULL);
+"""
+
+# top-level key ที่แยกเป็นตาราง ที่เหลือเก็บใน meta เป็น JSON ก้อนเดียว
+TABLE_KEYS = ("player", "characters", "locations", "unique_items", "log")
+# ตารางที่ 1 แถว = 1 key ย่อย (path "characters.<name>..." แก้แค่แถวนั้น)
+ROW_TABLES = ("characters", "locations", "unique_items")
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _char_columns(name, data, pos):
+    data = data if isinstance(data, dict) else {}
+    return (name, _dumps(data), data.get('current_location') or data.get('location'),
+            data.get('faction'), data.get('status'), pos)
+
+
+def _dirty(touched):
+    """``{top-level key: None (all of it) or {row names}}`` from dotted DB paths; ``_timeline`` is the timeline table."""
+    dirty = {}
+    for path in touched:
+        top, _, rest = path.partition('.')
+        if top in ROW_TABLES and rest:
+            if dirty.get(top, ()) is not None:
+                dirty.setdefault(top, set()).add(rest.split('.', 1)[0])
+        elif top == "world" and rest.split('.', 1)[0] == "timeline":
+            dirty["_timeline"] = None
+        else:
+            dirty[top] = None
+            if top == "world" and not rest:
+                dirty["_timeline"] = None
+    return dirty
+
+
+def _timeline_rows(timeline):
+    rows = []
+    seen = set()
+    for pos, event in enumerate(timeline or []):
+        event = event if isinstance(event, dict) else {"value": event}
+        event_id = str(event.get('id') or f"#{pos}")
+        if event_id in seen:
+            event_id = f"{event_id}#{pos}"
+        seen.add(event_id)
+        rows.append((event_id, _dumps(event), event.get('start_time'), event.get('deadline_time'),
+                     event.get('status'), pos))
+    return rows
+
+
+class SqliteWorldStore:
+    """db.json kept as SQLite tables (stdlib sqlite3) behind the same get/snapshot/save API as WorldStore.
+
+    ``save`` diffs against the last known state and only touches rows that
+    changed, so a turn that moves one NPC writes one row. With
+    ``touched`` (the dotted DB paths written since ``expected``, e.g. the
+    delta engine's ``applied`` targets) only those rows are even
+    re-encoded; everything else is known to be unchanged.
+    ``save(data, expected=token)`` refuses to overwrite a newer ``_version``
+    and returns the ``_version`` it wrote. The saved dict becomes the
+    store's cached state (see ``get``): the caller must not change it after.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.version = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(path)
+        self._data = None
+        self._rows = None
+        self._stamp = None
+
+    # ---------- read ----------
+    def _db_stamp(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = '_version'").fetchone()
+        return row[0] if row else None
+
+    def is_empty(self):
+        with self._lock:
+            return self._db_stamp() is None
+
+    def get(self):
+        with self._lock:
+            stamp = self._db_stamp()
+            if stamp is None:
+                return None
+            if self._data is not None and stamp == self._stamp:
+                return self._data
+            self._data, self._rows = self._read_all()
+            self._stamp = stamp
+            self.version += 1
+            return self._data
+
+    def snapshot(self):
+        data = self.get()
+        return copy.deepcopy(data) if data is not None else None
+
+    def snapshot_versioned(self):
+        """Return ``(deep copy, token)``; the token is the ``_version`` the copy was read at."""
+        with self._lock:
+            data = self.get()
+            return (copy.deepcopy(data) if data is not None else None), self._stamp
+
+    def _read_all(self):
+        c = self._conn
+        db = {}
+        rows = {"meta": {}, "characters": {}, "locations": {}, "unique_items": {}, "timeline": {}}
+        order = json.loads(c.execute("SELECT value FROM meta WHERE key = '_order'").fetchone()[0])
+        for key, value in c.execute("SELECT key, value FROM meta WHERE key NOT LIKE '\\_%' ESCAPE '\\'"):
+            db[key] = json.loads(value)
+            rows["meta"][key] = value
+        player = c.execute("SELECT data FROM player WHERE id = 1").fetchone()
+        if player:
+            db["player"] = json.loads(player[0])
+            rows["player"] = player[0]
+        for table in ("characters", "locations", "unique_items"):
+            if table in order:
+                db[table] = {}
+                for name, data in c.execute(f"SELECT name, data FROM {table} ORDER BY pos"):
+                    db[table][name] = json.loads(data)
+                    rows[table][name] = data
+        timeline = []
+        for event_id, data in c.execute("SELECT id, data FROM timeline ORDER BY pos"):
+            timeline.append(json.loads(data))
+            rows["timeline"][event_id] = data
+        if isinstance(db.get("world"), dict) and "_timeline" in order:
+            db["world"]["timeline"] = timeline
+        if "log" in order:
+            db["log"] = [json.loads(e) for (e,) in c.execute("SELECT entry FROM log ORDER BY seq")]
+            rows["log"] = len(db["log"])
+        # คืนลำดับ key เดิมของ db.json
+        return {k: db[k] for k in order if k in db}, rows
+
+    # ---------- write ----------
+    def _bump(self):
+        stamp = int(self._db_stamp() or 0) + 1
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('_version', ?)", (str(stamp),))
+        return str(stamp)
+
+    def _sync_table(self, table, new_rows, old_rows):
+        # เขียนเฉพาะแถวที่เปลี่ยน/เพิ่ม และลบแถวที่หายไป
+        for key, values in new_rows.items():
+            if old_rows.get(key) != values[1]:
+                placeholders = ", ".join("?" * len(values))
+                self._conn.execute(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", values)
+        removed = [k for k in old_rows if k not in new_rows]
+        key_col = "id" if table == "timeline" else "name"
+        for key in removed:
+            self._conn.execute(f"DELETE FROM {table} WHERE {key_col} = ?", (key,))
+
+    def save(self, data, expected=None, touched=None):
+        """Write ``data`` (only the rows that differ); ``touched`` narrows the diff, see the class docstring."""
+        with self._file_lock, self._lock:
+            if expected is not None and self._db_stamp() != expected:
+                raise VersionConflict(f"{self.path} changed since it was read")
+            if self._rows is None or self._stamp != self._db_stamp():
+                self._data, self._rows = self._read_all() if self._db_stamp() is not None else ({}, None)
+                # row ที่จำไว้ไม่ใช่ของ version ที่ผู้เรียกอ่าน บอกไม่ได้ว่าอะไรไม่เปลี่ยน
+                touched = None
+            elif expected is None:
+                touched = None
+            dirty = _dirty(touched) if touched is not None else None
+
+            def changed(key, name=None):
+                if dirty is None or key not in dirty:
+                    return dirty is None
+                names = dirty[key]
+                return names is None or name is None or name in names
+
+            old = self._rows or {"meta": {}, "characters": {}, "locations": {}, "unique_items": {},
+                                 "timeline": {}, "player": None, "log": 0}
+            new_rows = {"meta": {}, "characters": {}, "locations": {}, "unique_items": {}, "timeline": {}}
+            order = list(data.keys())
+            if isinstance(data.get("world"), dict) and "timeline" in data["world"]:
+                order.append("_timeline")
+
+            with self._conn:
+                for key, value in data.items():
+                    if key in TABLE_KEYS:
+                        continue
+                    if key in old["meta"] and not changed(key):
+                        new_rows["meta"][key] = old["meta"][key]
+                        continue
+                    if key == "world" and isinstance(value, dict):
+                        value = {k: v for k, v in value.items() if k != "timeline"}
+                    encoded = _dumps(value)
+                    new_rows["meta"][key] = encoded
+                    if old["meta"].get(key) != encoded:
+                        self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, encoded))
+                for key in old["meta"]:
+                    if key not in new_rows["meta"]:
+                        self._conn.execute("DELETE FROM meta WHERE key = ?", (key,))
+
+                if "player" in data:
+                    if old.get("player") is not None and not changed("player"):
+                        new_rows["player"] = old["player"]
+                    else:
+                        encoded = _dumps(data["player"])
+                        if old.get("player") != encoded:
+                            self._conn.execute("INSERT OR REPLACE INTO player VALUES (1, ?, ?)",
+                                               (encoded, data["player"].get('current_location')))
+                        new_rows["player"] = encoded
+
+                columns = {
+                    "characters": _char_columns,
+                    "locations": lambda name, ldata, pos: (
+                        name, _dumps(ldata), ldata.get('region') if isinstance(ldata, dict) else None, pos),
+                    "unique_items": lambda name, idata, pos: (
+                        name, _dumps(idata), idata.get('current_owner') if isinstance(idata, dict) else None, pos),
+                }
+                for table in ROW_TABLES:
+                    rows = {}
+                    for pos, (name, value) in enumerate((data.get(table) or {}).items()):
+                        if name in old[table] and not changed(table, name):
+                            # แถวที่ไม่ได้ถูกแก้ในเทิร์นนี้ ไม่ต้อง encode ใหม่
+                            rows[name] = (name, old[table][name])
+                        else:
+                            rows[name] = columns[table](name, value, pos)
+                    self._sync_table(table, rows, old[table])
+                    new_rows[table] = {k: v[1] for k, v in rows.items()}
+
+                if old["timeline"] and not changed("_timeline"):
+                    new_rows["timeline"] = old["timeline"]
+                else:
+                    timeline = {row[0]: row for row in _timeline_rows((data.get("world") or {}).get("timeline"))}
+                    self._sync_table("timeline", timeline, old["timeline"])
+                    new_rows["timeline"] = {k: v[1] for k, v in timeline.items()}
+
+                # log ส่วนใหญ่แค่ต่อท้าย: ของเดิมตรงทั้งก้อนก็ insert เฉพาะของใหม่ ไม่งั้นเขียนใหม่ทั้งตาราง
+                log = data.get("log") or []
+                old_len = old.get("log", 0)
+                if changed("log") or len(log) != old_len:
+                    prev_log = (self._data or {}).get("log") or []
+                    if len(log) < old_len or prev_log[:old_len] != log[:old_len]:
+                        self._conn.execute("DELETE FROM log")
+                        old_len = 0
+                    self._conn.executemany("INSERT INTO log (seq, entry) VALUES (?, ?)",
+                                           [(i, _dumps(e)) for i, e in enumerate(log[old_len:], start=old_len)])
+                new_rows["log"] = len(log)
+
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('_order', ?)", (_dumps(order),))
+                self._stamp = self._bump()
+
+            self._data = data
+            self._rows = new_rows
+            self.version += 1
+            return self._stamp
+
+    # ---------- db.json import / export ----------
+    def import_json(self, filepath):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            self.save(json.load(f))
+
+    def export_bytes(self):
+        return json.dumps(self.get(), ensure_ascii=False, indent=2).encode('utf-8')
@@ -0,0 +1,82 @@
+import copy
+import json
+import os
+import threading
+
+from dialog_store import atomic_write_json
+from file_lock import FileLock, VersionConflict
+
+
+class WorldStore:
+    """Process-level cache of db.json, revalidated by file mtime/size.
+
+    ``get`` returns the shared parsed dict and must be treated as read-only;
+    code that mutates the world takes a ``snapshot`` and writes it back with
+    ``save``. ``version`` goes up on every reload or save.
+
+    Writers that read-modify-write pass the token from ``snapshot_versioned``
+    as ``save(data, expected=token)``; if the file changed in between the save
+    raises VersionConflict instead of overwriting the other writer. ``save``
+    returns the token of the version it wrote. The saved dict becomes the
+    cached state that ``get`` hands out (it is not copied): the caller must
+    not change it after.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.version = 0
+        self._data = None
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(filepath)
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.filepath)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self):
+        with self._lock:
+            return self._get()
+
+    def _get(self):
+        stamp = self._file_stamp()
+        if self._data is not None and stamp == self._stamp:
+            return self._data
+        if stamp is None:
+            return None
+        try:
+            with open(self.filepath, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._stamp = stamp
+        self.version += 1
+        return self._data
+
+    def snapshot(self):
+        data = self.get()
+        return copy.deepcopy(data) if data is not None else None
+
+    def snapshot_versioned(self):
+        """Return ``(deep copy, token)``; the token identifies the version the copy came from."""
+        with self._lock:
+            data = self._get()
+            return (copy.deepcopy(data) if data is not None else None), self._stamp
+
+    def save(self, data, expected=None, touched=None):
+        # touched (path ที่แก้) ใช้กับ SqliteWorldStore เท่านั้น JSON ต้องเขียนทั้งไฟล์อยู่แล้ว
+        with self._file_lock, self._lock:
+            if expected is not None and self._file_stamp() != expected:
+                raise VersionConflict(f"{self.filepath} changed since it was read")
+            atomic_write_json(self.filepath, data)
+            self._data = data
+            self._stamp = self._file_stamp()
+            self.version += 1
+            return self._stamp
+
+    def export_bytes(self):
+        with open(self.filepath, 'rb') as f:
+            return f.read()
@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import time
+
+from context_builder import estimate_tokens
+from dialog_store import atomic_write_json
+from file_lock import FileLock
+
+SUMMARY_TOKEN_CAP = 600        # ขนาดสูงสุดของสรุปแคมเปญ
+RECENT_MESSAGES = 6            # ข้อความล่าสุดที่ยังส่งให้ model แบบเต็ม
+MESSAGE_TOKEN_CAP = 400        # ตัดข้อความล่าสุดแต่ละอันไม่ให้ยาวเกินนี้
+FOLD_BATCH = 6                 # สะสมข้อความเก่าครบเท่านี้ค่อยสรุปรวมทีเดียว
+
+SUMMARY_INSTRUCTION = """
+    You keep the running summary of a One Piece RPG campaign (Thai language).
+    You receive the current summary and the next turns of the story, oldest first.
+    Rewrite the summary so it also covers the new turns:
+    - Keep facts that matter later: goals, promises, debts, enemies, allies, items, injuries, places visited, open plot threads.
+    - Compress older parts harder than recent ones. Drop flavour text and dialogue.
+    - Plain text only, no headings, no JSON.
+    - Hard limit: {cap} tokens (about {chars} Thai characters).
+"""
+
+
+def clip_tokens(text, max_tokens, keep="head"):
+    """Cut ``text`` to about ``max_tokens`` (same bytes/4 estimate as estimate_tokens), UTF-8 safe."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    raw = text.encode('utf-8')
+    limit = max(0, max_tokens * 4 - 4)
+    if keep == "tail":
+        return "…" + raw[-limit:].decode('utf-8', errors='ignore')
+    return raw[:limit].decode('utf-8', errors='ignore') + "…"
+
+
+def recent_window(history, upto, recent=RECENT_MESSAGES, message_cap=MESSAGE_TOKEN_CAP):
+    """The messages still sent verbatim: the last ``recent`` ones after the summary, each clipped."""
+    start = max(upto, len(history) - recent)
+    return [dict(m, content=clip_tokens(str(m.get("content", "")), message_cap)) for m in history[start:]]
+
+
+def pending_messages(history, upto, recent=RECENT_MESSAGES):
+    """Messages older than the recent window that the summary does not cover yet."""
+    return history[upto:max(upto, len(history) - recent)]
+
+
+def render_summary(summary):
+    return f"[CAMPAIGN SUMMARY (earlier turns)]\n{summary}" if summary else ""
+
+
+def fold_prompt(summary, messages, message_cap=MESSAGE_TOKEN_CAP):
+    lines = ["[CURRENT SUMMARY]", summary or "(ยังไม่มี)", "", "[NEW TURNS]"]
+    for msg in messages:
+        lines.append(f"{msg.get('role', '?')}: {clip_tokens(str(msg.get('content', '')), message_cap)}")
+    return "\n".join(lines)
+
+
+class SummaryStore:
+    """Running campaign summary kept next to the DB (summary.json).
+
+    Every fold is saved as a checkpoint ``{summary, upto, upto_id}`` where
+    ``upto`` is how many dialog messages it covers. ``for_history`` picks the
+    newest checkpoint that still matches the dialog, so rewinds and branches
+    fall back to an older summary instead of one that mentions undone turns.
+    """
+
+    def __init__(self, path, keep_checkpoints=20):
+        self.path = path
+        self.keep_checkpoints = keep_checkpoints
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(path)
+        self._cache = None
+
+    def _load(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return []
+        stamp = (st.st_mtime_ns, st.st_size)
+        if self._cache is not None and self._cache[0] == stamp:
+            return self._cache[1]
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                checkpoints = json.load(f).get("checkpoints", [])
+        except (OSError, ValueError, AttributeError):
+            checkpoints = []
+        self._cache = (stamp, checkpoints)
+        return checkpoints
+
+    def checkpoints(self):
+        with self._lock:
+            return list(self._load())
+
+    def for_history(self, history):
+        """Return ``(summary, upto)`` of the newest checkpoint consistent with ``history``."""
+        for cp in reversed(self.checkpoints()):
+            upto = cp.get("upto", 0)
+            if upto <= len(history) and (upto == 0 or history[upto - 1].get("id") == cp.get("upto_id")):
+                return cp.get("summary", ""), upto
+        return "", 0
+
+    def save(self, summary, upto, history):
+        with self._lock, self._file_lock:
+            # checkpoint ที่ครอบคลุมเกิน upto เป็นของสาขาที่ถูกย้อนทิ้งไปแล้ว
+            checkpoints = [cp for cp in self._load() if cp.get("upto", 0) < upto]
+            checkpoints.append({
+                "summary": summary, "upto": upto, "upto_id": history[upto - 1].get("id") if upto else None,
+                "tokens": estimate_tokens(summary), "at": time.time()
+            })
+            checkpoints = checkpoints[-self.keep_checkpoints:]
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            atomic_write_json(self.path, {"checkpoints": checkpoints})
+            self._cache = None
+
+    def clear(self):
+        with self._lock, self._file_lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._cache = None
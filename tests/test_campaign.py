@@ -0,0 +1,61 @@
+import json
+import os
+
+import pytest
+
+import campaign
+from campaign import create_campaign, list_campaigns
+
+FILES = {"db": "db.json", "dialog": "dialog.json", "summary": "summary.json"}
+
+
+@pytest.fixture(autouse=True)
+def in_tmp(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def test_create_writes_everything_before_the_slot_appears():
+    seen = []
+
+    def populate(paths):
+        # ระหว่างเขียน slot จริงยังต้องไม่มีให้เห็น
+        seen.append(list_campaigns())
+        with open(paths["summary"], 'w', encoding='utf-8') as f:
+            json.dump({"summary": "s"}, f)
+
+    paths = create_campaign("alt", FILES, {"world": {}}, [{"role": "user", "content": "hi"}], populate=populate)
+    assert seen == [["default"]]
+    assert list_campaigns() == ["default", "alt"]
+    with open(paths["summary"], encoding='utf-8') as f:
+        assert json.load(f) == {"summary": "s"}
+    assert os.listdir(campaign.CAMPAIGNS_DIR) == ["alt"]
+
+
+def test_existing_slot_is_refused():
+    create_campaign("alt", FILES, {})
+    with pytest.raises(ValueError):
+        create_campaign("alt", FILES, {})
+    with pytest.raises(ValueError):
+        create_campaign("default", FILES, {})
+
+
+def test_slot_created_concurrently_reports_exists_and_cleans_up():
+    def other_session_wins(paths):
+        first = create_campaign("alt", FILES, {"who": "first"})
+        assert os.path.exists(first["db"])
+
+    with pytest.raises(ValueError):
+        create_campaign("alt", FILES, {"who": "second"}, populate=other_session_wins)
+    with open(os.path.join(campaign.CAMPAIGNS_DIR, "alt", "db.json"), encoding='utf-8') as f:
+        assert json.load(f) == {"who": "first"}
+    assert os.listdir(campaign.CAMPAIGNS_DIR) == ["alt"]
+
+
+def test_failed_populate_leaves_nothing_behind():
+    def broken(paths):
+        raise RuntimeError("disk full")
+
+    with pytest.raises(RuntimeError):
+        create_campaign("alt", FILES, {}, populate=broken)
+    assert os.listdir(campaign.CAMPAIGNS_DIR) == []
+    assert list_campaigns() == ["default"]
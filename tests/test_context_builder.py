@@ -0,0 +1,53 @@
+from context_builder import CharacterIndex, CharacterIndexCache, build_context_data, select_characters
+
+
+def make_db(location="Port"):
+    return {
+        "player": {"current_location": location},
+        "locations": {"Port": {"owner_npc": "Boss"}},
+        "characters": {
+            "Mosu (โมสุ)": {"current_location": "Port", "faction": "Red"},
+            "Boss": {"location": "Port", "faction": "Blue"},
+            "Ally": {"current_location": "Sea", "faction": "Red"},
+            "Ghost": {"current_location": None, "faction": 3},
+            "Weird": {"current_location": ["Port"], "faction": None},
+        },
+    }
+
+
+def test_priority_mention_location_faction():
+    selected, omitted = select_characters(make_db(), "คุยกับ โมสุ")
+    assert list(selected) == ["Mosu (โมสุ)", "Boss", "Ally"]
+    assert omitted == ["Ghost", "Weird"]
+
+
+def test_non_string_locations_are_ignored():
+    index = CharacterIndex(make_db()["characters"])
+    assert index.at_location(None) == [] and index.in_faction(3) == []
+    ctx = build_context_data(make_db(location=None), "hello")
+    assert ctx["location"] == {}
+    ctx = build_context_data(make_db(location=["Port"]), "hello")
+    assert ctx["location"] == {}
+
+
+def test_index_cache_is_reused_per_token():
+    cache = CharacterIndexCache()
+    characters = make_db()["characters"]
+    first = cache.get(characters, "v1")
+    assert cache.get(characters, "v1") is first
+    assert cache.get(characters, "v2") is not first
+    assert cache.get(characters, None) is not cache.get(characters, None)
+
+
+def test_new_version_rebuilds_locations_but_keeps_the_alias_regex():
+    cache = CharacterIndexCache()
+    characters = make_db()["characters"]
+    first = cache.get(characters, "v1")
+    moved = dict(characters, Ally={"current_location": "Port", "faction": "Red"})
+    second = cache.get(moved, "v2")
+    assert second._alias_re is first._alias_re
+    assert "Ally" in second.at_location("port")
+    added = dict(moved, Newbie={"current_location": "Port"})
+    third = cache.get(added, "v3")
+    assert third._alias_re is not first._alias_re
+    assert third.mentioned_in("hi Newbie") == ["Newbie"]
@@ -0,0 +1,171 @@
+import copy
+
+import pytest
+
+from delta_engine import OPS, RULES, apply_delta, replay_changes
+
+
+def make_db():
+    return {
+        "world": {"current_time": "1524-03-21 02:35:00", "timeline": [{"id": "E1", "status": "Pending"}],
+                  "events": ["old"]},
+        "player": {"inventory": ["sword"], "current_location": "Port", "crew": [], "traits": {"abilities": []},
+                   "stats": {"hp": 100, "stamina": 50}, "reputation": {"Marines": 0},
+                   "vehicle": {"status": {"hull": 100}}, "devil_fruit": {"name": "None"},
+                   "haki": {"armament": {"level": 1}, "observation": {"level": 2}}},
+        "characters": {"Old": {"status": "Active", "location": "Port", "current_location": "Port",
+                               "stats": {"hp": 10}, "reputation": {"Marines": 0}, "friendship": 0}},
+        "locations": {"Port": {"status": "Calm"}},
+        "unique_items": {},
+        "log": [],
+    }
+
+
+# ---------- ops ----------
+def test_op_replace_and_insert():
+    assert OPS["replace"]([1], [2]) == [2]
+    assert OPS["insert"](None, {"a": 1}) == {"a": 1}
+
+
+def test_op_merge_does_not_touch_input():
+    current = {"a": 1, "b": 2}
+    assert OPS["merge"](current, {"b": 3}) == {"a": 1, "b": 3}
+    assert current == {"a": 1, "b": 2}
+    assert OPS["merge"](None, {"b": 3}) == {"b": 3}
+
+
+def test_op_deep_merge():
+    current = {"armament": {"level": 1, "color": "black"}}
+    merged = OPS["deep_merge"](current, {"armament": {"level": 2}, "conqueror": {"level": 1}})
+    assert merged == {"armament": {"level": 2, "color": "black"}, "conqueror": {"level": 1}}
+    assert current["armament"]["level"] == 1
+
+
+def test_op_merge_by_id():
+    current = [{"id": "a", "status": "Pending"}, {"id": "b", "status": "Pending"}]
+    merged = OPS["merge_by_id"](current, [{"id": "b", "status": "Active"}, {"id": "c"}])
+    assert merged == [{"id": "a", "status": "Pending"}, {"id": "b", "status": "Active"}, {"id": "c"}]
+    assert current[1]["status"] == "Pending"
+
+
+def test_op_append_limits():
+    assert OPS["append"](["a"], "bcdef", max_len=3) == ["a", "bcd"]
+    assert OPS["append"](["a", "b"], "c", limit=2) == ["b", "c"]
+
+
+def test_op_log():
+    assert OPS["log"]([], {"time": "t", "text": "abcdef"}, max_len=3) == [{"time": "t", "text": "abc"}]
+    assert OPS["log"]([], "plain") == ["plain"]
+    with pytest.raises(TypeError):
+        OPS["log"]([], {"text": 1})
+
+
+def test_op_drop_head():
+    assert OPS["drop_head"]([1, 2, 3], 2) == [3]
+    assert OPS["drop_head"](None, 2) == []
+
+
+def test_op_time():
+    assert OPS["time"]("1524-03-21 23:30:00", {"hours": 1}) == "1524-03-22 00:30:00"
+    with pytest.raises(TypeError):
+        OPS["time"]("1524-03-21 23:30:00", {"hours": "one"})
+
+
+# ---------- rules ----------
+# ค่าตัวอย่างที่ถูกต้องของทุก rule และ path ใน DB ที่ต้องเปลี่ยนตาม
+SAMPLES = {
+    "time_passed": ({"time_passed": {"hours": 2}}, ("world", "current_time"), "1524-03-21 04:35:00"),
+    "log_entry": ({"log_entry": "x"}, ("log",), ["x"]),
+    "player.inventory": ({"player": {"inventory": ["map"]}}, ("player", "inventory"), ["map"]),
+    "player.current_location": ({"player": {"current_location": "Sea"}}, ("player", "current_location"), "Sea"),
+    "player.crew": ({"player": {"crew": ["Zoro"]}}, ("player", "crew"), ["Zoro"]),
+    "player.traits.abilities": ({"player": {"traits": {"abilities": ["Dash"]}}},
+                                ("player", "traits", "abilities"), ["Dash"]),
+    "player.stats": ({"player": {"stats": {"hp": 5}}}, ("player", "stats"), {"hp": 5, "stamina": 50}),
+    "player.reputation": ({"player": {"reputation": {"Pirates": 1}}}, ("player", "reputation"),
+                          {"Marines": 0, "Pirates": 1}),
+    "player.vehicle.status": ({"player": {"vehicle": {"status": {"hull": 80}}}}, ("player", "vehicle", "status"),
+                              {"hull": 80}),
+    "player.devil_fruit": ({"player": {"devil_fruit": {"awakened": True}}}, ("player", "devil_fruit"),
+                           {"name": "None", "awakened": True}),
+    "player.haki": ({"player": {"haki": {"armament": {"level": 3}}}}, ("player", "haki"),
+                    {"armament": {"level": 3}, "observation": {"level": 2}}),
+    "world.timeline": ({"world": {"timeline": [{"id": "E1", "status": "Active"}]}}, ("world", "timeline"),
+                       [{"id": "E1", "status": "Active"}]),
+    "world.events": ({"world": {"events": ["new"]}}, ("world", "events"), ["new"]),
+    "characters.*": ({"characters": {"New": {"status": "Active", "traits": {}}}}, ("characters", "New"),
+                     {"status": "Active", "traits": {}}),
+    "characters.*.status": ({"characters": {"Old": {"status": "Dead"}}}, ("characters", "Old", "status"), "Dead"),
+    "characters.*.location": ({"characters": {"Old": {"location": "Sea"}}}, ("characters", "Old", "location"), "Sea"),
+    "characters.*.current_location": ({"characters": {"Old": {"current_location": "Sea"}}},
+                                      ("characters", "Old", "current_location"), "Sea"),
+    "characters.*.stats": ({"characters": {"Old": {"stats": {"hp": 1}}}}, ("characters", "Old", "stats"), {"hp": 1}),
+    "characters.*.reputation": ({"characters": {"Old": {"reputation": {"Pirates": 2}}}},
+                                ("characters", "Old", "reputation"), {"Marines": 0, "Pirates": 2}),
+    "characters.*.friendship": ({"characters": {"Old": {"friendship": 40}}}, ("characters", "Old", "friendship"), 40),
+    "locations": ({"locations": {"Sea": {"status": "Storm"}}}, ("locations",),
+                  {"Port": {"status": "Calm"}, "Sea": {"status": "Storm"}}),
+    "unique_items": ({"unique_items": {"Map": {"current_owner": "Old"}}}, ("unique_items",),
+                     {"Map": {"current_owner": "Old"}}),
+}
+
+
+def _get(db, path):
+    for part in path:
+        db = db[part]
+    return db
+
+
+def test_every_rule_has_a_sample():
+    assert set(SAMPLES) == {path for path, *_ in RULES}
+
+
+@pytest.mark.parametrize("rule", sorted(SAMPLES))
+def test_rule_applies_and_replays(rule):
+    delta, path, expected = SAMPLES[rule]
+    db = make_db()
+    base = copy.deepcopy(db)
+    changes = apply_delta(db, delta)
+    assert changes.rejected == []
+    assert [c["path"].split(".")[0] for c in changes.applied] == [rule.split(".")[0]]
+    assert _get(db, path) == expected
+    assert replay_changes(base, changes.applied) == db
+
+
+@pytest.mark.parametrize("rule", sorted(SAMPLES))
+def test_rule_rejects_wrong_type(rule):
+    delta, _path, _expected = SAMPLES[rule]
+    # ค่า leaf ของ rule เป็น object ที่ไม่มีชนิดไหนรับ
+    wrong = copy.deepcopy(delta)
+    node, parts = wrong, rule.replace("*", next(iter(delta.get("characters", {"x": 0})))).split(".")
+    for part in parts[:-1]:
+        node = node[part]
+    node[parts[-1]] = object()
+    db = make_db()
+    before = copy.deepcopy(db)
+    changes = apply_delta(db, wrong)
+    assert changes.applied == []
+    assert [r["path"] for r in changes.rejected] == [".".join(parts)]
+    assert db == before
+
+
+def test_unknown_keys_are_rejected():
+    db = make_db()
+    changes = apply_delta(db, {"player": {"bounty_hack": 1}, "nonsense": 1})
+    assert {r["path"] for r in changes.rejected} == {"player.bounty_hack", "nonsense"}
+    assert changes.applied == []
+
+
+def test_insert_new_character_reports_no_field_rejections():
+    db = make_db()
+    changes = apply_delta(db, {"characters": {"New Guy": {"status": "Active", "traits": {}, "faction": "F"}}})
+    assert changes.rejected == []
+    assert db["characters"]["New Guy"]["faction"] == "F"
+
+
+def test_existing_character_only_gets_ruled_fields():
+    db = make_db()
+    changes = apply_delta(db, {"characters": {"Old": {"status": "Dead", "faction": "F"}}})
+    assert db["characters"]["Old"]["status"] == "Dead"
+    assert "faction" not in db["characters"]["Old"]
+    assert [r["path"] for r in changes.rejected] == ["characters.Old.faction"]
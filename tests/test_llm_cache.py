@@ -0,0 +1,120 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from llm_cache import ReplayMiss, ResponseCache
+
+
+def fake_create(text="สวัสดี ทะเล", calls=None):
+    def create(stream=False, **params):
+        if calls is not None:
+            calls.append(params)
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5, prompt_tokens_details=None)
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+        chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 3]))], usage=None)
+                  for i in range(0, len(text), 3)]
+        return iter(chunks + [SimpleNamespace(choices=[], usage=usage)])
+    return create
+
+
+def streamed_text(chunks):
+    return "".join(c.choices[0].delta.content for c in chunks if c.choices)
+
+
+def test_key_is_stable_and_covers_model_prompt_and_state(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    prompt = {"messages": [{"role": "user", "content": "ไปเกาะ"}], "temperature": 0.5}
+    key = cache.key("gpt-x", prompt, "s1")
+    assert key == ResponseCache(str(tmp_path / "other")).key("gpt-x", dict(reversed(list(prompt.items()))), "s1")
+    assert len({
+        key,
+        cache.key("gpt-y", prompt, "s1"),
+        cache.key("gpt-x", dict(prompt, temperature=0.6), "s1"),
+        cache.key("gpt-x", prompt, "s2"),
+        cache.key("gpt-x", prompt),
+    }) == 5
+
+
+def test_chat_key_ignores_transport_params(tmp_path):
+    calls = []
+    cache = ResponseCache(str(tmp_path), mode="cache")
+    params = dict(model="gpt-x", messages=[{"role": "user", "content": "hi"}])
+    first = cache.chat(fake_create(calls=calls), "s", timeout=30, **params)
+    # timeout / stream ไม่ใช่ส่วนของ prompt: เรียกซ้ำแบบ stream ต้อง hit ของเดิม
+    again = cache.chat(fake_create(calls=calls), "s", timeout=5, stream=True, stream_options={"include_usage": True},
+                       **params)
+    assert len(calls) == 1
+    chunks = list(again)
+    assert streamed_text(chunks) == first.choices[0].message.content
+    assert chunks[-1].usage.prompt_tokens == 10
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=10 ** 9)
+    keys = [cache.key("m", i) for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, {"kind": "story", "text": "x" * 200})
+    cache.max_bytes = cache._total
+    assert cache.get(keys[0])["text"] == "x" * 200
+    cache.put(keys[3], {"kind": "story", "text": "x" * 200})
+    # keys[1] เก่าสุดหลัง keys[0] ถูกใช้ จึงโดนลบ
+    assert cache.get(keys[1]) is None
+    assert not os.path.exists(cache._path(keys[1]))
+    assert all(cache.get(k) is not None for k in (keys[0], keys[2], keys[3]))
+    assert cache._total <= cache.max_bytes
+
+
+def test_lru_order_survives_restart(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    keys = [cache.key("m", i) for i in range(3)]
+    for age, key in zip((300, 200, 100), keys):
+        cache.put(key, {"kind": "story", "text": key})
+        stamp = os.path.getmtime(cache._path(key)) - age
+        os.utime(cache._path(key), (stamp, stamp))
+    reopened = ResponseCache(str(tmp_path))
+    reopened.get(keys[0])
+    reopened.max_bytes = reopened._total
+    reopened.put(cache.key("m", 3), {"kind": "story", "text": "new"})
+    assert reopened.get(keys[1]) is None
+    assert reopened.get(keys[0]) is not None
+
+
+def test_replay_miss_raises_without_calling_provider(tmp_path):
+    calls = []
+    cache = ResponseCache(str(tmp_path), mode="replay")
+    with pytest.raises(ReplayMiss):
+        cache.chat(fake_create(calls=calls), "s", model="gpt-x", messages=[])
+    model = SimpleNamespace(generate_content=lambda contents, **kw: calls.append(contents))
+    with pytest.raises(ReplayMiss):
+        cache.story(model, "gemini-x", "instr", "contents")
+    assert calls == [] and cache.misses == 2
+
+
+def test_record_then_replay(tmp_path):
+    recorder = ResponseCache(str(tmp_path), mode="record")
+    params = dict(model="gpt-x", messages=[{"role": "user", "content": "hi"}], stream=True)
+    assert streamed_text(list(recorder.chat(fake_create("เรื่องเล่า ยาว ๆ"), "s", **params))) == "เรื่องเล่า ยาว ๆ"
+    story_model = SimpleNamespace(generate_content=lambda contents, **kw: SimpleNamespace(text="story!"))
+    recorder.story(story_model, "gemini-x", "instr", "contents", "s")
+
+    replay = ResponseCache(str(tmp_path), mode="replay")
+    assert streamed_text(list(replay.chat(fake_create("ไม่ควรถูกเรียก"), "s", **params))) == "เรื่องเล่า ยาว ๆ"
+    assert replay.story(None, "gemini-x", "instr", "contents", "s").text == "story!"
+    # state เปลี่ยน = คนละ request
+    with pytest.raises(ReplayMiss):
+        replay.story(None, "gemini-x", "instr", "contents", "s2")
+
+
+def test_stream_closed_early_is_not_stored(tmp_path):
+    cache = ResponseCache(str(tmp_path), mode="cache")
+    params = dict(model="gpt-x", messages=[], stream=True)
+    stream = cache.chat(fake_create("abcdefghij"), "s", **params)
+    next(iter(stream))
+    stream.close()
+    assert cache.get(cache.key("gpt-x", {"model": "gpt-x", "messages": []}, "s")) is None
+    calls = []
+    list(cache.chat(fake_create(calls=calls), "s", **params))
+    assert len(calls) == 1
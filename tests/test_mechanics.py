@@ -0,0 +1,59 @@
+import pytest
+
+from mechanics import classify_action, resolve_turn
+
+COSTS = {
+    "chat": {"minutes": 15}, "rest": {"hours": 8}, "explore": {"hours": 3},
+    "fight_skirmish": {"minutes": 45}, "fight_boss": {"hours": 2}, "travel_local": {"minutes": 30},
+}
+
+
+def make_db(here="Calm Belt"):
+    return {
+        "world": {"current_time": "1524-03-21 02:35:00"},
+        "settings": {"action_costs": COSTS},
+        "player": {"current_location": here, "inventory": [], "crew": []},
+        "locations": {
+            "Calm Belt": {"connections": {"Amazon Lily": {"travel_days": 1, "req_item": "None"}}},
+            "Amazon Lily": {"connections": {"Calm Belt": {"travel_days": 1, "req_item": "None"}}},
+        },
+    }
+
+
+@pytest.mark.parametrize("prompt, action", [
+    ("rest here", "rest"),
+    ("พักผ่อนที่ท่าเรือ", "rest"),
+    ("ask the old man", "chat"),
+    ("คุยกับ Luffy", "chat"),
+    ("fight the boss", "fight_boss"),
+    ("attacking the guards", "fight_skirmish"),
+    # keyword อยู่ในคำอื่น
+    ("I am interested in the old map", None),
+    ("Tell me about the forest", None),
+    ("Look at the mask", None),
+    ("แน่นอน ฉันจะไปด้วย", None),
+    # ปฏิเสธ / หลาย action = ไม่แน่ใจ
+    ("don't rest yet", None),
+    ("อย่าเพิ่งนอน", None),
+    ("talk to him then rest", None),
+])
+def test_classify_action(prompt, action):
+    assert classify_action(prompt, COSTS) == action
+
+
+@pytest.mark.parametrize("prompt", ["sail to Amazon Lily", "ล่องเรือไป Amazon Lily", "heading to Amazon Lily"])
+def test_travel_needs_verb_before_destination(prompt):
+    facts = resolve_turn(make_db(), prompt)
+    assert facts["action"] == "travel"
+    assert facts["time_passed"] == {"days": 1}
+
+
+@pytest.mark.parametrize("prompt", [
+    "I have a good feeling about Amazon Lily",
+    "ฉันไม่อยากไป Amazon Lily",
+    "I don't want to go to Amazon Lily",
+])
+def test_mentioned_or_negated_destination_leaves_time_to_llm(prompt):
+    facts = resolve_turn(make_db(), prompt)
+    assert facts["travel"] is None
+    assert facts["time_passed"] is None
@@ -0,0 +1,68 @@
+import math
+import random
+
+import pytest
+
+from memory_index import MemoryIndex, tokenize
+
+WORDS = ["คลื่น", "ทะเล", "ดาบ", "โจรสลัด", "ทหารเรือ", "เกาะ", "พายุ", "สมบัติ", "ลูกเรือ", "กัปตัน",
+         "ค่าหัว", "ผลปีศาจ", "ฮาคิ", "เรือ", "หมอก", "ปืนใหญ่", "แผนที่", "เมือง", "ป่า", "ภูเขาไฟ"]
+
+
+def make_history(n, seed=0):
+    rng = random.Random(seed)
+    history = []
+    for i in range(n):
+        # คำท้าย ๆ ของ list เจอน้อยกว่า ให้ df ต่างกันจริง
+        text = " ".join(WORDS[min(int(rng.expovariate(0.3)), len(WORDS) - 1)] for _ in range(rng.randint(5, 40)))
+        history.append({"id": f"m{i}", "role": "assistant", "content": text})
+    return history
+
+
+def brute_force(index, query, k, skip_dialog_from=None):
+    """BM25 over every query term and every passage (no pruning)."""
+    docs = index._docs
+    n_docs = len(docs)
+    avg_len = index._total_len / n_docs
+    scores = {}
+    for term in set(tokenize(query)):
+        postings = index._postings.get(term, {})
+        if not postings:
+            continue
+        idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+        for doc_id, tf in postings.items():
+            norm = tf + index.k1 * (1 - index.b + index.b * docs[doc_id]["len"] / avg_len)
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (index.k1 + 1) / norm
+    ranked = sorted(((s, d) for d, s in scores.items()
+                     if skip_dialog_from is None or docs[d]["pos"] < skip_dialog_from), reverse=True)
+    return [round(s, 3) for s, _ in ranked[:k]]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pruned_search_matches_brute_force(seed):
+    index = MemoryIndex(max_query_terms=100, max_df=1.0)
+    history = make_history(300, seed)
+    index.sync(history)
+    rng = random.Random(seed + 100)
+    for _ in range(20):
+        query = " ".join(rng.sample(WORDS, 4))
+        hits = index.search(query, k=5, skip_dialog_from=280)
+        assert [h["score"] for h in hits] == brute_force(index, query, 5, skip_dialog_from=280)
+        assert all(h["pos"] < 280 for h in hits)
+
+
+def test_common_terms_are_skipped_only_when_rarer_ones_match():
+    index = MemoryIndex()
+    index.sync([{"role": "user", "content": "ทะเล"}, {"role": "user", "content": "ทะเล ภูเขาไฟ"}])
+    # "ทล" อยู่ทุก passage แต่ไม่มี term อื่นให้ใช้
+    assert len(index.search("ทะเล")) == 2
+    assert [h["pos"] for h in index.search("ทะเล ภูเขาไฟ")] == [1]
+
+
+def test_skip_window_follows_rewrites():
+    index = MemoryIndex()
+    history = make_history(20)
+    index.sync(history)
+    index.sync(history[:5])     # rewind
+    hits = index.search(" ".join(WORDS), k=10, skip_dialog_from=3)
+    assert hits and all(h["pos"] < 3 for h in hits)
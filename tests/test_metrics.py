@@ -0,0 +1,45 @@
+import json
+
+from metrics import Metrics
+
+
+def finished(metrics, label, session_id, ms, kind="turn", tokens=0):
+    trace = metrics.start_turn(label, session_id, kind=kind)
+    trace.add("gpt", ms / 1000, prompt_tokens=tokens)
+    trace.finish()
+    trace.ms = ms
+    return trace
+
+
+def test_background_traces_stay_out_of_turn_latencies():
+    metrics = Metrics()
+    for ms in (100, 200, 300):
+        finished(metrics, "turn", "s1", ms, tokens=10)
+    # fold สรุปนาน ๆ ต้องไม่ดัน p95 ของเทิร์น
+    finished(metrics, "summary", "s1", 60_000, kind="background", tokens=500)
+    stats = metrics.summary("s1")
+    assert stats["turns"] == 3
+    assert stats["p95_ms"] == 300
+    assert {row["span"]: row["n"] for row in stats["spans"]} == {"gpt": 3}
+    # แต่ token ที่ใช้ไปนับรวม
+    assert stats["totals"]["prompt_tokens"] == 530
+    assert [t.label for t in metrics.recent("s1", kind="turn")] == ["turn"] * 3
+    assert [t.label for t in metrics.recent("s1", kind="background")] == ["summary"]
+
+
+def test_export_trace_is_filtered_by_session():
+    metrics = Metrics()
+    finished(metrics, "mine", "s1", 100)
+    finished(metrics, "fold", "s1", 50, kind="background")
+    finished(metrics, "theirs", "s2", 100)
+    with metrics.span("save_json", path="db.json"):
+        pass
+
+    def rows(data):
+        events = json.loads(data)["traceEvents"]
+        return sorted(e["args"]["name"].split(" [")[0] for e in events if e["ph"] == "M")
+
+    assert rows(metrics.export_trace("s1")) == ["fold", "mine"]
+    assert rows(metrics.export_trace()) == ["(outside turns)", "fold", "mine", "theirs"]
+    kinds = {e["cat"] for e in json.loads(metrics.export_trace("s1"))["traceEvents"] if e["ph"] == "X"}
+    assert kinds == {"turn", "background", "span"}
@@ -0,0 +1,125 @@
+import pytest
+
+from providers import CircuitBreaker, CircuitOpen, Provider
+
+
+class Status(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def fail(status):
+    def call():
+        raise Status(status)
+    return call
+
+
+def make_provider(**kwargs):
+    provider = Provider("test", retries=0, breaker=CircuitBreaker(failures=2, reset_after=0.0), **kwargs)
+    provider.delay = lambda attempt: 0.0
+    return provider
+
+
+def test_breaker_opens_after_retryable_failures():
+    provider = Provider("test", retries=0, breaker=CircuitBreaker(failures=2, reset_after=60.0))
+    for _ in range(2):
+        with pytest.raises(Status):
+            provider.call(fail(503))
+    assert provider.breaker.state == "open"
+    with pytest.raises(CircuitOpen):
+        provider.call(lambda: "ok")
+
+
+def test_non_retryable_trial_failure_does_not_wedge_breaker():
+    provider = make_provider()
+    for _ in range(2):
+        with pytest.raises(Status):
+            provider.call(fail(503))
+    # half-open: trial call ได้ 400 (provider ตอบอยู่)
+    with pytest.raises(Status):
+        provider.call(fail(400))
+    assert provider.breaker.state == "closed"
+    assert provider.call(lambda: "ok") == "ok"
+
+
+def test_retryable_trial_failure_reopens():
+    provider = make_provider()
+    for _ in range(2):
+        with pytest.raises(Status):
+            provider.call(fail(503))
+    with pytest.raises(Status):
+        provider.call(fail(503))
+    assert provider.call(lambda: "ok") == "ok"
+
+
+def test_retries_then_succeeds():
+    provider = Provider("test", retries=2, breaker=CircuitBreaker(failures=5))
+    provider.delay = lambda attempt: 0.0
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Status(429)
+        return "ok"
+    assert provider.call_counted(flaky) == ("ok", 2)
+
+
+def test_spent_budget_fails_fast_instead_of_using_the_default_timeout():
+    from types import SimpleNamespace
+
+    from providers import ChatProvider, StoryProvider
+
+    calls = []
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **params: calls.append(params["timeout"]))))
+    chat = ChatProvider(client, retries=0)
+    with pytest.raises(TimeoutError):
+        chat.create(model="m", messages=[], timeout=0.0)
+    chat.create(model="m", messages=[])
+    assert calls == [pytest.approx(chat.timeout, abs=1.0)]
+
+    model = SimpleNamespace(generate_content=lambda contents, request_options: calls.append(request_options))
+    story = StoryProvider(lambda instruction: model, retries=0)("rules")
+    with pytest.raises(TimeoutError):
+        story.generate_content("x", request_options={"timeout": 0.0})
+    assert len(calls) == 1
+
+
+def test_non_retryable_error_does_not_reset_failure_count():
+    provider = Provider("test", retries=0, breaker=CircuitBreaker(failures=3, reset_after=60.0))
+    # ล่มสลับกับ 400 (flapping): 400 ไม่ได้แปลว่าหายล่ม ยอดที่ล้มต้องสะสมต่อ
+    for status in (503, 400, 503, 400, 503):
+        with pytest.raises(Status):
+            provider.call(fail(status))
+    assert provider.breaker.state == "open"
+
+
+def test_retries_come_back_with_the_result_from_any_thread():
+    from concurrent.futures import ThreadPoolExecutor
+    from types import SimpleNamespace
+
+    from providers import ChatProvider, retries_of
+
+    attempts = []
+
+    def create(**params):
+        attempts.append(1)
+        if len(attempts) % 2:
+            raise Status(503)
+        return SimpleNamespace(choices=[], usage=None)
+
+    chat = ChatProvider(SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))), retries=2)
+    chat.delay = lambda attempt: 0.0
+    # เหมือน hedge ของ router: เรียกใน thread อื่น แต่ยอด retry ติดมากับคำตอบ
+    with ThreadPoolExecutor(1) as pool:
+        response = pool.submit(chat.chat.completions.create, model="m", messages=[]).result()
+    assert retries_of(response) == 1
+    assert response.choices == []
+    failing = ChatProvider(SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **params: (_ for _ in ()).throw(Status(503))))), retries=2)
+    failing.delay = lambda attempt: 0.0
+    with pytest.raises(Status) as info:
+        failing.create(model="m", messages=[])
+    assert retries_of(info.value) == 2
@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from reply_parser import StreamingReplyParser, extract_reply, repair_json
+
+
+@pytest.mark.parametrize("text, expected, repair", [
+    ('{"a": 1, "s": ปกติ}', {"a": 1, "s": "ปกติ"}, "unquoted_value"),
+    ('{"a": [ok, 2]}', {"a": ["ok", 2]}, "unquoted_value"),
+    ('{"a": True, "b": None}', {"a": True, "b": None}, "python_literal"),
+    ('{"a": 1, // note\n "b": 2}', {"a": 1, "b": 2}, "comment"),
+    ('{"a": 1, /* x */ "b": 2}', {"a": 1, "b": 2}, "comment"),
+    ('{"a": [1, 2,], "b": 3,}', {"a": [1, 2], "b": 3}, "trailing_comma"),
+    ('{"a": "line\nbreak",}', {"a": "line\nbreak"}, "newline_in_string"),
+    ('noise {"a": 1} more', {"a": 1}, "leading_text"),
+    ('{"a": {"b": 1, "ke', {"a": {"b": 1}}, "truncated"),
+    ('{"a": 1, "b": tr', {"a": 1}, "dropped_dangling"),
+    ('{"a": [1, 2', {"a": [1, 2]}, "truncated"),
+    ('{"a": "unterminated', {"a": "unterminated"}, "truncated"),
+    ('{"t": 1.5e-3, "x": 1,}', {"t": 1.5e-3, "x": 1}, "trailing_comma"),
+    ('{"a": 1e5, // c\n "b":2,}', {"a": 1e5, "b": 2}, "comment"),
+    ('{"a": -2E+4, "b": ค่า}', {"a": -2e4, "b": "ค่า"}, "unquoted_value"),
+    ('{"a": [1, 2e3,]', {"a": [1, 2e3]}, "truncated"),
+    ('{"a": 1, "b": 1.5e', {"a": 1, "b": 1.5}, "dropped_dangling"),
+])
+def test_repair_json(text, expected, repair):
+    data, repairs = repair_json(text)
+    assert data == expected
+    assert repair in repairs
+
+
+def test_repair_json_reports_instead_of_raising():
+    data, repairs = repair_json('{"a": hello world}')
+    assert data is None
+    assert "unquoted_value" in repairs
+    assert repair_json("no object here") == (None, ["no_object"])
+
+
+def test_repair_json_is_linear():
+    body = ", ".join(f'"k{i}": ค่า{i}' for i in range(20000))
+    started = time.perf_counter()
+    data, _ = repair_json("{" + body + "}")
+    assert len(data) == 20000
+    assert time.perf_counter() - started < 2.0
+
+
+def test_parser_unquoted_thai_value_applies_state():
+    seen = []
+    parser = StreamingReplyParser(on_json=seen.append)
+    reply = 'เรื่อง\n```json\n{"log_entry": "x", "s": ปกติ}\n```'
+    for i in range(0, len(reply), 5):
+        parser.feed(reply[i:i + 5])
+    parser.finish()
+    assert parser.error is None
+    assert seen == [{"log_entry": "x", "s": "ปกติ"}]
+    assert parser.story.strip() == "เรื่อง"
+
+
+def test_parser_sets_error_for_unreadable_block():
+    parser = StreamingReplyParser()
+    parser.feed('story\n```json\n{"a": [1, 2 3]}\n```')
+    parser.finish()
+    assert parser.data is None
+    assert parser.error is not None
+    parser.accept({"a": 1}, "model_repair")
+    assert parser.error is None and parser.data == {"a": 1}
+    assert parser.repairs[-1] == "model_repair"
+
+
+def test_extract_reply_sections_and_extra_blocks():
+    reply = ('คลื่นซัด\n\n**[Result]:** Success\n**Choices:**\n1. ออกเรือ\n2. พัก\n\n'
+             '```json\n{"a": 1,}\n```\n```json\n{"b": 2}\n```')
+    out = extract_reply(reply)
+    assert out["story"] == "คลื่นซัด"
+    assert out["result"] == "Success"
+    assert out["choices"] == ["ออกเรือ", "พัก"]
+    assert out["data"] == {"a": 1}
+    assert out["repairs"] == ["trailing_comma", "extra_json_block"]
+
+
+def test_extract_reply_unfenced_and_code_blocks():
+    out = extract_reply('story\n```python\nprint(1)\n```\n{"a": 1}')
+    assert out["data"] == {"a": 1}
+    assert "unfenced_json" in out["repairs"]
+    assert "print(1)" in out["story"]
+
+
+def test_exponent_is_not_an_unquoted_value():
+    _, repairs = repair_json('{"t": 1.5e-3, "x": 1,}')
+    assert "unquoted_value" not in repairs
@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from router import Budget
+from turn_worker import TurnJob
+
+
+def test_budget_timeout_is_remaining_time_then_raises():
+    job = TurnJob("s", None, timeout=60)
+    job.started_at = time.time()
+    budget = Budget(job, 0.05)
+    assert 0 < budget.timeout("gpt") <= 0.05
+    time.sleep(0.06)
+    assert budget.remaining() == 0.0
+    with pytest.raises(TimeoutError):
+        budget.timeout("gpt")
+
+
+def test_hedged_stream_keeps_the_provider_retry_count():
+    from types import SimpleNamespace
+
+    from providers import ChatProvider, retries_of
+    from router import open_reply
+
+    attempts = []
+
+    def create(stream=False, **params):
+        attempts.append(params["model"])
+        if len(attempts) == 1:
+            raise TimeoutError("first attempt")
+        return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="hi"))], usage=None)])
+
+    chat = ChatProvider(SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))), retries=1)
+    chat.delay = lambda attempt: 0.0
+    response, model = open_reply(chat.create, dict(model="big", messages=[], stream=True), "small", hedge_after=5.0)
+    assert model == "big"
+    assert retries_of(response) == 1
+    assert [c.choices[0].delta.content for c in response] == ["hi"]
@@ -0,0 +1,73 @@
+import copy
+
+from scheduler import ACTIVE, MISSED, EventScheduler, TimelineCache, advance_timeline, timeline_changes
+
+
+def event(event_id, start=None, deadline=None, status="Pending", consequence=None):
+    e = {"id": event_id, "name": event_id, "status": status}
+    if start:
+        e["start_time"] = start
+    if deadline:
+        e["deadline_time"] = deadline
+    if consequence:
+        e["consequence_if_missed"] = consequence
+    return e
+
+
+def world(now, timeline):
+    return {"world": {"current_time": now, "timeline": timeline}, "log": []}
+
+
+def test_due_events_start_and_expire_future_ones_wait():
+    db = world("1524-03-21 12:00:00", [
+        event("start", start="1524-03-21 08:00:00", deadline="1524-03-25 00:00:00"),
+        event("later", start="1524-03-22 00:00:00"),
+        event("late", status=ACTIVE, deadline="1524-03-21 10:00:00", consequence="เมืองถูกเผา"),
+        event("done", start="1524-01-01 00:00:00", status="Completed"),
+    ])
+    transitions = advance_timeline(db)
+    assert [(t["id"], t["to"]) for t in transitions] == [("start", ACTIVE), ("late", MISSED)]
+    assert [e["status"] for e in db["world"]["timeline"]] == [ACTIVE, "Pending", MISSED, "Completed"]
+    assert db["log"] == [{"time": "1524-03-21 10:00:00", "text": "[Timeline] late: เมืองถูกเผา"}]
+
+
+def test_event_that_starts_and_expires_in_one_advance():
+    db = world("1524-03-23 00:00:00", [event("blink", start="1524-03-21 00:00:00", deadline="1524-03-22 00:00:00")])
+    assert [t["to"] for t in advance_timeline(db)] == [ACTIVE, MISSED]
+
+
+def test_ties_follow_timeline_order():
+    same = "1524-03-21 08:00:00"
+    db = world(same, [event(f"e{i}", start=same) for i in (3, 1, 2)])
+    assert [t["id"] for t in advance_timeline(db)] == ["e3", "e1", "e2"]
+
+
+def test_scheduler_is_reused_until_the_timeline_is_replaced():
+    db = world("1524-03-21 00:00:00", [event("a", start="1524-03-22 00:00:00"), event("b", start="1524-03-23 00:00:00")])
+    scheduler = EventScheduler(db["world"]["timeline"])
+    db["world"]["current_time"] = "1524-03-22 00:00:00"
+    assert [t["id"] for t in advance_timeline(db, scheduler)] == ["a"]
+    # GPT แทน timeline ทั้ง list (delta op ไม่แก้ของเดิม) heap ต้องสร้างใหม่จาก list ใหม่
+    db["world"]["timeline"] = [event("c", start="1524-03-21 00:00:00")]
+    assert [t["id"] for t in advance_timeline(db, scheduler)] == ["c"]
+    assert scheduler.timeline is db["world"]["timeline"]
+
+
+def test_timeline_cache_hands_over_only_at_the_saved_token():
+    timeline = [event("a", start="1524-03-22 00:00:00")]
+    cache = TimelineCache()
+    scheduler = cache.take(timeline, "v1")
+    cache.keep(scheduler, "v2")
+    copied = copy.deepcopy(timeline)
+    assert cache.take(copied, "v2") is scheduler and scheduler.timeline is copied
+    # ถูกเอาไปแล้ว เทิร์นอื่นได้ตัวใหม่
+    assert cache.take(copied, "v2") is not scheduler
+    cache.keep(scheduler, "v2")
+    assert cache.take(copied, "v3") is not scheduler
+
+
+def test_timeline_changes_snapshot_the_timeline():
+    db = world("1524-03-22 00:00:00", [event("a", start="1524-03-21 00:00:00")])
+    changes = timeline_changes(db, advance_timeline(db))
+    db["world"]["timeline"][0]["status"] = "Completed"
+    assert changes[0]["value"][0]["status"] == ACTIVE
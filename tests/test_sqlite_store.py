@@ -0,0 +1,96 @@
+import copy
+
+import pytest
+
+from file_lock import VersionConflict
+from sqlite_store import SqliteWorldStore
+
+
+def make_world():
+    return {
+        "world": {"current_time": "1524-03-21 02:35:00",
+                  "timeline": [{"id": "E1", "status": "Pending", "start_time": "1524-03-22 00:00:00"}]},
+        "player": {"name": "P", "current_location": "Port"},
+        "characters": {"A": {"status": "Active", "current_location": "Port", "faction": "F"},
+                       "B": {"status": "Active", "current_location": "Sea"}},
+        "locations": {"Port": {"region": "East"}},
+        "unique_items": {},
+        "log": [{"time": "t1", "text": "one"}, {"time": "t2", "text": "two"}],
+        "log_base": 0,
+    }
+
+
+def reopen(store):
+    return SqliteWorldStore(store.path).get()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteWorldStore(str(tmp_path / "world.sqlite"))
+    store.save(make_world())
+    return store
+
+
+def test_round_trip_keeps_key_order(store):
+    loaded = reopen(store)
+    assert loaded == make_world()
+    assert list(loaded) == list(make_world())
+
+
+def test_touched_save_writes_the_touched_rows(store):
+    db, token = store.snapshot_versioned()
+    db["characters"]["A"]["status"] = "Dead"
+    db["characters"]["New"] = {"status": "Active"}
+    db["world"]["current_time"] = "1524-03-21 05:00:00"
+    db["log"].append({"time": "t3", "text": "three"})
+    new_token = store.save(db, expected=token,
+                           touched=["characters.A.status", "characters.New", "world.current_time", "log"])
+    assert new_token != token
+    assert reopen(store) == db
+
+
+def test_touched_limits_what_is_compared(store):
+    db, token = store.snapshot_versioned()
+    db["characters"]["B"]["status"] = "Dead"     # ไม่ได้บอกใน touched ถือว่าไม่เปลี่ยน
+    db["characters"]["A"]["status"] = "Dead"
+    store.save(db, expected=token, touched=["characters.A.status"])
+    loaded = reopen(store)
+    assert loaded["characters"]["A"]["status"] == "Dead"
+    assert loaded["characters"]["B"]["status"] == "Active"
+
+
+def test_edit_earlier_in_the_log_is_saved(store):
+    db, token = store.snapshot_versioned()
+    db["log"][0] = {"time": "t1", "text": "edited"}
+    db["log"].append({"time": "t3", "text": "three"})
+    store.save(db, expected=token, touched=["log"])
+    assert reopen(store)["log"] == db["log"]
+    db, token = store.snapshot_versioned()
+    db["log"] = db["log"][2:]
+    db["log_base"] = 2
+    store.save(db, expected=token, touched=["log", "log_base"])
+    assert reopen(store)["log"] == [{"time": "t3", "text": "three"}]
+
+
+def test_timeline_and_removed_rows(store):
+    db = copy.deepcopy(store.get())
+    db["world"]["timeline"][0]["status"] = "Active"
+    del db["characters"]["B"]
+    store.save(db)
+    loaded = reopen(store)
+    assert loaded["world"]["timeline"][0]["status"] == "Active"
+    assert list(loaded["characters"]) == ["A"]
+
+
+def test_stale_token_conflicts_and_other_writers_disable_touched(store, tmp_path):
+    db, token = store.snapshot_versioned()
+    other = SqliteWorldStore(store.path)
+    changed = other.snapshot()
+    changed["characters"]["B"]["status"] = "Gone"
+    other.save(changed)
+    with pytest.raises(VersionConflict):
+        store.save(db, expected=token, touched=["characters.A"])
+    # ไม่มี expected: ไม่เชื่อ touched เทียบทุกแถว
+    db["characters"]["B"]["status"] = "Back"
+    store.save(db, touched=["characters.A"])
+    assert reopen(store)["characters"]["B"]["status"] == "Back"
@@ -0,0 +1,113 @@
+from types import SimpleNamespace
+
+import pytest
+
+from debug_store import DebugStore
+from dialog_store import DialogStore
+from prompt_builder import PromptLayout
+from state_store import WorldStore
+from story_summary import SummaryStore
+from turn_pipeline import TurnPipeline
+from turn_worker import TurnJob
+from version_log import VersionLog
+
+START = "1524-03-21 02:35:00"
+
+
+class ReplyClient:
+    """OpenAI stand-in that answers every call with a fixed reply (not streamed)."""
+
+    def __init__(self, text):
+        self.text = text
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **params):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.text))], usage=None)
+
+
+def make_pipeline(tmp_path, reply, summary_store=None):
+    world = WorldStore(str(tmp_path / "db.json"))
+    world.save({
+        "world": {"current_time": START},
+        "settings": {"action_costs": {"rest": {"hours": 8}}},
+        "player": {"current_location": "Port"},
+        "log": [],
+    })
+    version_log = VersionLog(str(tmp_path / "history"))
+    version_log.ensure_base(world.get(), 0)
+    story = SimpleNamespace(generate_content=lambda *a, **k: SimpleNamespace(text="draft"))
+    pipeline = TurnPipeline(
+        story_model=lambda instruction: story, gpt_client=ReplyClient(reply),
+        dialog_store=DialogStore(str(tmp_path / "dialog.json")), debug_store=DebugStore(str(tmp_path / "debug")),
+        world_store=world, stream=False, version_log=version_log, summary_store=summary_store,
+    )
+    return pipeline, world, version_log
+
+
+def run_turn(pipeline, prompt, history=()):
+    job = TurnJob("test", None, timeout=60)
+    history = list(history) + [{"id": "u1", "role": "user", "content": prompt}]
+    prompt_data = {"system_prompt": "rules", "story_prompt": "{context}\n{previous_story}"}
+    return pipeline.run(job, prompt, history, prompt_data, [], PromptLayout())
+
+
+def test_engine_time_is_saved_without_state_block(tmp_path):
+    pipeline, world, version_log = make_pipeline(tmp_path, "พักผ่อนจนเช้า ไม่มี JSON")
+    run_turn(pipeline, "rest here")
+    assert world.get()["world"]["current_time"] == "1524-03-21 10:35:00"
+    assert version_log.head == 1
+    assert version_log.state_at(1)["world"]["current_time"] == "1524-03-21 10:35:00"
+
+
+def test_unquoted_thai_value_still_applies_state(tmp_path):
+    pipeline, world, _ = make_pipeline(tmp_path, 'เรื่อง\n```json\n{"log_entry": "x", "s": ปกติ}\n```')
+    result = run_turn(pipeline, "look around")
+    assert result["message"]["content"] == "เรื่อง"
+    assert world.get()["log"][-1]["text"] == "x"
+
+
+def test_summary_fold_is_left_to_a_separate_job(tmp_path):
+    summary_store = SummaryStore(str(tmp_path / "summary.json"))
+    pipeline, _, _ = make_pipeline(tmp_path, "ตอบ", summary_store=summary_store)
+    calls = []
+    pipeline.generate = lambda instruction, contents, **kwargs: calls.append(contents) or SimpleNamespace(text="สรุป")
+    past = [{"id": f"m{i}", "role": "user" if i % 2 else "assistant", "content": f"turn {i}"} for i in range(12)]
+    result = run_turn(pipeline, "look around", history=past)
+    assert result["fold_summary"] and calls == [] and summary_store.for_history(past) == ("", 0)
+
+    history = past + [{"id": "u1", "role": "user", "content": "look around"}, result["message"]]
+    pipeline.fold_summary(TurnJob("test", None, timeout=60), history)
+    assert len(calls) == 1 and summary_store.for_history(history)[0] == "สรุป"
+    # fold ที่คิวซ้อนมาอ่าน checkpoint ล่าสุดเอง ไม่สรุป batch เดิมซ้ำ
+    pipeline.fold_summary(TurnJob("test", None, timeout=60), history)
+    assert len(calls) == 1
+
+
+def test_spent_profile_budget_fails_before_the_gpt_call(tmp_path):
+    from router import ModelRouter
+
+    pipeline, world, _ = make_pipeline(tmp_path, "ตอบ")
+    calls = []
+    pipeline.gpt_client.create = lambda **params: calls.append(params)
+    pipeline.router = ModelRouter(budgets={"fast": 0.0, "full": 0.0})
+    with pytest.raises(TimeoutError):
+        run_turn(pipeline, "rest here")
+    assert calls == []
+    assert world.get()["world"]["current_time"] == START
+
+
+def test_timeline_heap_is_kept_between_turns(tmp_path):
+    from scheduler import TimelineCache
+
+    pipeline, world, _ = make_pipeline(tmp_path, "พัก")
+    db = world.get()
+    db["world"]["timeline"] = [{"id": "E1", "name": "E1", "status": "Pending", "start_time": "1524-03-21 09:00:00"},
+                               {"id": "E2", "name": "E2", "status": "Pending", "start_time": "1524-03-21 16:00:00"}]
+    world.save(db)
+    pipeline.timeline_cache = cache = TimelineCache()
+    run_turn(pipeline, "rest here")
+    kept = cache._scheduler
+    assert kept is not None and world.get()["world"]["timeline"][0]["status"] == "Active"
+    run_turn(pipeline, "rest here")
+    assert cache._scheduler is kept
+    assert [e["status"] for e in world.get()["world"]["timeline"]] == ["Active", "Active"]
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from turn_worker import TurnExecutor
+
+
+def test_background_job_waits_for_queued_turns_and_stays_hidden():
+    executor = TurnExecutor(max_workers=2)
+    gate = threading.Event()
+    order = []
+
+    def turn(name):
+        def fn(job):
+            if name == "t1":
+                gate.wait(5)
+            order.append(name)
+            return name
+        return fn
+
+    t1 = executor.submit("s", turn("t1"))
+    fold = executor.submit("s", turn("fold"), background=True)
+    t2 = executor.submit("s", turn("t2"))
+    assert executor.latest("s") is t2
+    assert fold not in executor.active("s")
+    gate.set()
+    deadline = time.time() + 5
+    while fold.finished_at is None and time.time() < deadline:
+        time.sleep(0.01)
+    assert order == ["t1", "t2", "fold"]
+    assert t1.status == t2.status == fold.status == "done"
+
+
+def wait_done(jobs):
+    deadline = time.time() + 5
+    while any(job.finished_at is None for job in jobs) and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_per_session_state_is_pruned():
+    executor = TurnExecutor(max_workers=4, max_sessions=3)
+    jobs = []
+    for i in range(10):
+        # ทีละ session ให้ลำดับการใช้งานแน่นอน (ถ้ารันพร้อมกัน job ที่จบทีหลังจะถูกนับว่าใช้ล่าสุด)
+        jobs.append(executor.submit(f"s{i}", lambda job: None))
+        wait_done(jobs[-1:])
+    assert executor._queues == {} and executor._background == {} and executor._running == {}
+    assert list(executor._history) == ["s7", "s8", "s9"]
+    # poll นับเป็นการใช้ session ที่ถูก poll อยู่ไม่โดนลืมก่อน
+    assert executor.latest("s7") is jobs[7]
+    wait_done([executor.submit("s10", lambda job: None)])
+    assert list(executor._history) == ["s9", "s7", "s10"]
+
+
+def test_busy_session_is_not_forgotten():
+    executor = TurnExecutor(max_workers=2, max_sessions=1)
+    gate = threading.Event()
+    busy = executor.submit("busy", lambda job: gate.wait(5))
+    idle = executor.submit("idle", lambda job: None)
+    assert executor.latest("busy") is busy
+    gate.set()
+    wait_done([busy, idle])
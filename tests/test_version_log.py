@@ -0,0 +1,88 @@
+import copy
+import os
+
+import pytest
+
+from delta_engine import replay_changes
+from version_log import VersionLog
+
+
+def turn(hp):
+    return [{"path": "player.stats.hp", "op": "replace", "target": "player.stats.hp", "value": hp, "options": {}}]
+
+
+def play(log, db, start, end):
+    """Record turns ``start..end - 1`` (hp = version number); returns the state after each, by version."""
+    states = {}
+    for hp in range(start, end):
+        applied = turn(hp)
+        replay_changes(db, applied)
+        version = log.record(applied, db, dialog_len=2 * hp, label=f"turn {hp}")
+        states[version] = copy.deepcopy(db)
+    return states
+
+
+@pytest.fixture
+def base():
+    return {"world": {"current_time": "1524-01-01 00:00:00"}, "player": {"stats": {"hp": 0}}}
+
+
+def test_state_at_across_snapshot_boundary(tmp_path, base):
+    log = VersionLog(str(tmp_path / "history"), snapshot_every=5)
+    log.ensure_base(base)
+    db = copy.deepcopy(base)
+    states = {0: copy.deepcopy(base)}
+    states.update(play(log, db, 1, 13))
+    kinds = {m["v"]: m["kind"] for m in log.versions()}
+    assert kinds[5] == kinds[10] == "delta+snapshot"
+    assert kinds[4] == kinds[6] == "delta"
+    for version, expected in states.items():
+        assert log.state_at(version) == expected
+    # snapshot แก้ด้วยมือ: version ถัดไปต้อง replay จาก snapshot นี้ ไม่ใช่จาก delta ก่อนหน้า
+    edited = dict(copy.deepcopy(db), note="edited")
+    edit_v = log.record_snapshot(edited, dialog_len=99)
+    after = play(log, edited, 100, 102)
+    assert log.state_at(edit_v)["note"] == "edited"
+    assert log.state_at(edit_v + 2) == after[edit_v + 2]
+    # ข้อมูลที่คืนเป็นของใหม่ทุกครั้ง แก้แล้วไม่กระทบครั้งต่อไป
+    log.state_at(3)["player"]["stats"]["hp"] = -1
+    assert log.state_at(3) == states[3]
+
+
+def test_truncate_drops_later_versions_and_snapshots(tmp_path, base):
+    log = VersionLog(str(tmp_path / "history"), snapshot_every=5)
+    log.ensure_base(base)
+    db = copy.deepcopy(base)
+    states = play(log, db, 1, 12)
+    meta = log.truncate(7)
+    assert meta["v"] == 7 and meta["dialog_len"] == 14 and "writes" not in meta
+    assert log.head == 7
+    assert [m["v"] for m in log.versions()] == list(range(8))
+    assert sorted(os.listdir(tmp_path / "history" / "snapshots")) == ["v000000.json.z", "v000005.json.z"]
+    assert log.state_at(7) == states[7]
+    # เล่นต่อหลัง rewind ได้ version ต่อจากจุดที่ตัด
+    db = copy.deepcopy(states[7])
+    assert log.record(turn(50), replay_changes(db, turn(50)), dialog_len=16) == 8
+    assert log.state_at(8)["player"]["stats"]["hp"] == 50
+    # instance อื่น (อีก process) อ่านไฟล์ใหม่ได้ตรงกัน
+    assert VersionLog(str(tmp_path / "history"), snapshot_every=5).head == 8
+    with pytest.raises(KeyError):
+        log.truncate(-1)
+
+
+def test_branch_starts_new_log_from_version(tmp_path, base):
+    log = VersionLog(str(tmp_path / "history"), snapshot_every=5)
+    log.ensure_base(base)
+    db = copy.deepcopy(base)
+    states = play(log, db, 1, 9)
+    target = tmp_path / "branch" / "history"
+    branch, branch_db = log.branch(6, str(target))
+    assert branch_db == states[6]
+    assert [(m["v"], m["kind"], m["dialog_len"]) for m in branch.versions()] == [(0, "snapshot", 12)]
+    assert branch.state_at(0) == states[6]
+    # สองสายแยกกันจริง
+    branch.record(turn(77), replay_changes(copy.deepcopy(branch_db), turn(77)), dialog_len=14)
+    assert log.head == 8 and branch.head == 1
+    assert log.state_at(6) == states[6]
+    with pytest.raises(KeyError):
+        log.branch(42, str(tmp_path / "nope"))
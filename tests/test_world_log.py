@@ -0,0 +1,100 @@
+import copy
+from datetime import datetime, timedelta
+
+from delta_engine import replay_changes
+from game_state import TIME_FMT
+from world_log import LOG_LIMIT, LOG_SEGMENT, LogArchive, log_record, roll_log
+
+START = datetime(1524, 3, 1)
+
+
+def make_log(n, hours=1):
+    # entry ละ ``hours`` ชั่วโมง (hours=1 คือวันละ 24 entry)
+    return [log_record((START + timedelta(hours=i * hours)).strftime(TIME_FMT), f"entry {i}") for i in range(n)]
+
+
+def test_log_stays_in_db_up_to_the_limit(tmp_path):
+    archive = LogArchive(str(tmp_path / "archive"))
+    db = {"log": make_log(LOG_LIMIT)}
+    assert roll_log(db, archive) == []
+    assert len(db["log"]) == LOG_LIMIT and "log_base" not in db
+    assert archive.segments() == []
+
+
+def test_rollover_moves_one_segment_past_the_limit(tmp_path):
+    archive = LogArchive(str(tmp_path / "archive"))
+    entries = make_log(LOG_LIMIT + 1)
+    db = {"log": list(entries)}
+    before = copy.deepcopy(db)
+    applied = roll_log(db, archive)
+    assert db["log_base"] == LOG_SEGMENT
+    assert db["log"] == entries[LOG_SEGMENT:]
+    assert [(s["start"], s["count"]) for s in archive.segments()] == [(0, LOG_SEGMENT)]
+    assert archive.read_segment(0) == entries[:LOG_SEGMENT]
+    assert archive.segments()[0]["first_time"] == entries[0]["time"]
+    assert archive.segments()[0]["last_time"] == entries[LOG_SEGMENT - 1]["time"]
+    # version log replay ต้องได้ log ที่ตัดแล้วเหมือนกัน
+    assert replay_changes(before, applied) == db
+    # retry เทิร์นเดิม (rebase) เขียน segment เดิมซ้ำได้ ไม่เกิด segment ใหม่
+    roll_log({"log": list(entries)}, archive)
+    assert [(s["start"], s["count"]) for s in archive.segments()] == [(0, LOG_SEGMENT)]
+
+
+def test_trim_keeps_the_log_at_or_under_the_limit(tmp_path):
+    archive = LogArchive(str(tmp_path / "archive"))
+    db = {"log": [], "log_base": 0}
+    entries = make_log(2 * LOG_LIMIT + 50)
+    for entry in entries:
+        db["log"].append(entry)
+        roll_log(db, archive)
+        assert len(db["log"]) <= LOG_LIMIT
+    assert db["log_base"] + len(db["log"]) == len(entries)
+    assert [s["start"] for s in archive.segments()] == list(range(0, db["log_base"], LOG_SEGMENT))
+    archived = [e for s in archive.segments() for e in archive.read_segment(s["start"])]
+    assert archived + db["log"] == entries
+
+    # roll ทีเดียวจาก log ยาว ๆ ก็ได้ผลเดียวกัน
+    bulk = {"log": list(entries)}
+    roll_log(bulk, LogArchive(str(tmp_path / "bulk")))
+    assert bulk["log_base"] == db["log_base"] and bulk["log"] == db["log"]
+
+
+def test_query_by_day_spans_segments_and_live_log(tmp_path):
+    archive = LogArchive(str(tmp_path / "archive"))
+    # 3 ชั่วโมงต่อ entry = วันละ 8 ตัว segment แรกจบกลางวันที่ 13
+    entries = make_log(LOG_LIMIT + 2 * LOG_SEGMENT + 10, hours=3)
+    db = {"log": list(entries)}
+    roll_log(db, archive)
+    assert [s["start"] for s in archive.segments()] == [0, 100, 200]
+
+    opened = []
+    read_segment = archive.read_segment
+    archive.read_segment = lambda start: opened.append(start) or read_segment(start)
+
+    boundary_day = entries[LOG_SEGMENT]["time"][:10]
+    hits = archive.query(boundary_day, log=db["log"], log_base=db["log_base"])
+    expected = [i for i, e in enumerate(entries) if e["time"].startswith(boundary_day)]
+    assert [h["seq"] for h in hits] == expected
+    assert expected[0] < LOG_SEGMENT <= expected[-1]
+    assert sorted(opened) == [0, 100]
+    assert hits[0]["text"] == entries[expected[0]]["text"]
+
+    # ช่วงเวลาที่คร่อม archive กับ log ใน DB
+    opened.clear()
+    last_archived = db["log_base"] - 1
+    hits = archive.query(entries[last_archived - 1]["time"], entries[db["log_base"] + 2]["time"],
+                         log=db["log"], log_base=db["log_base"])
+    assert [h["seq"] for h in hits] == list(range(last_archived - 1, db["log_base"] + 2))
+    assert opened == [200]
+
+
+def test_segments_past_log_base_are_ignored_after_rewind(tmp_path):
+    archive = LogArchive(str(tmp_path / "archive"))
+    entries = make_log(LOG_LIMIT + LOG_SEGMENT + 1)
+    rewound = {"log": entries[:LOG_LIMIT + 1]}
+    roll_log({"log": list(entries)}, archive)
+    # ย้อนไปตอนที่ archive ยังมีแค่ segment แรก: segment 100 ที่ค้างอยู่ต้องไม่ถูกนับ
+    roll_log(rewound, archive)
+    day = entries[LOG_SEGMENT + 5]["time"][:10]
+    hits = archive.query(day, log=rewound["log"], log_base=rewound["log_base"])
+    assert [h["seq"] for h in hits] == [i for i, e in enumerate(entries[:LOG_LIMIT + 1]) if e["time"].startswith(day)]
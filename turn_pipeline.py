@@ -0,0 +1,531 @@
+import functools
+import re
+import time
+
+from context_builder import DEFAULT_TOKEN_BUDGET, CharacterIndexCache, build_context_data, estimate_tokens
+from delta_engine import apply_delta, replay_changes
+from file_lock import VersionConflict
+from llm_cache import ReplayMiss, content_hash
+from mechanics import apply_facts, render_facts, resolve_turn
+from memory_index import MEMORY_TOP_K, render_memories
+from metrics import TurnTrace, record_usage
+from prompt_builder import JSON_REPAIR_INSTRUCTION, OUTPUT_FORMAT, render_state, static_prefix
+from providers import retries_of
+from reply_parser import StreamingReplyParser, repair_json
+from router import DIRECT_STORY_NOTE, FALLBACK, Budget, open_reply
+from scheduler import advance_timeline, timeline_changes
+from story_summary import (FOLD_BATCH, RECENT_MESSAGES, SUMMARY_INSTRUCTION, SUMMARY_TOKEN_CAP, clip_tokens,
+                           fold_prompt, pending_messages, recent_window, render_summary)
+from world_log import log_record, roll_log
+
+
+class TurnPipeline:
+    """The two-stage turn (Gemini story -> GPT verify + state JSON) without any Streamlit calls.
+
+    Runs inside a TurnExecutor worker thread: progress goes to ``job.report``
+    and ``job.check`` is called between stages and stream chunks so a turn
+    can be stopped or time out.
+
+    The world is read from ``world_store`` when the turn starts and written
+    back with an optimistic version check: if another session saved in the
+    meantime, this turn's writes are replayed on top of the newer state.
+
+    With a ``summary_store`` the model sees a running campaign summary plus
+    the last ``recent_messages`` (clipped) instead of raw history; older
+    turns are folded into the summary in batches by ``fold_summary``, which
+    the caller runs as a separate job once ``run`` reports it is due.
+    A ``memory_index`` adds the past passages most relevant to the input.
+    With ``mechanics`` on, time costs and travel routes are computed locally
+    (mechanics.py) and given to both models as facts.
+    Every model call goes through ``llm_cache`` when one is given (response
+    cache / record / replay, see llm_cache.py).
+    Each turn is traced into ``metrics`` (wall time, tokens, payload bytes
+    and retries per stage, see metrics.py).
+    A ``router`` (router.py) picks the profile per turn: cheap actions skip
+    the Gemini draft and use a fast model, and failed / slow stages fall
+    back within the profile's latency budget.
+    The reply is split by reply_parser.py, which repairs the usual JSON
+    mistakes itself; a state block it still cannot read is sent alone to
+    ``repair_model`` (a cheap call) instead of re-rolling the whole turn.
+    Log entries are stamped with the in-game time the turn started at; with
+    a ``log_archive`` the oldest ones are moved out of the world DB on save
+    (world_log.py), so ``db['log']`` stays bounded.
+
+    A turn commits as a unit: the user and assistant messages are written
+    together at the end, and nothing is written if a provider fails before
+    the state block was applied. ``history[-1]`` (the user's message) need
+    not be in the dialog store yet.
+    """
+
+    SAVE_RETRIES = 3
+
+    def __init__(self, story_model, gpt_client, dialog_store, debug_store, world_store,
+                 gpt_model="gpt-5.2-pro", stream=True, token_budget=DEFAULT_TOKEN_BUDGET, version_log=None,
+                 summary_store=None, summary_cap=SUMMARY_TOKEN_CAP, recent_messages=RECENT_MESSAGES,
+                 memory_index=None, memory_top_k=MEMORY_TOP_K, mechanics=True,
+                 llm_cache=None, story_model_name="gemini-2.5-flash", metrics=None,
+                 router=None, repair_model=None, log_archive=None, timeline_cache=None, character_index=None):
+        # story_model(system_instruction) -> object ที่มี generate_content(prompt)
+        self.story_model = story_model
+        self.gpt_client = gpt_client
+        self.dialog_store = dialog_store
+        self.debug_store = debug_store
+        self.world_store = world_store
+        self.gpt_model = gpt_model
+        self.stream = stream
+        self.token_budget = token_budget
+        self.version_log = version_log
+        self.summary_store = summary_store
+        self.summary_cap = summary_cap
+        self.recent_messages = recent_messages
+        self.memory_index = memory_index
+        self.memory_top_k = memory_top_k
+        self.mechanics = mechanics
+        self.llm_cache = llm_cache
+        self.story_model_name = story_model_name
+        self.metrics = metrics
+        self.router = router
+        self.repair_model = repair_model
+        self.log_archive = log_archive
+        self.timeline_cache = timeline_cache
+        # index NPC ตามที่อยู่ / ฝ่าย / ชื่อ ใช้ซ้ำข้ามเทิร์นจนกว่าโลกจะถูกบันทึกใหม่ (ส่งของแคมเปญมาจะได้อยู่ข้าม rerun)
+        self.character_index = character_index if character_index is not None else CharacterIndexCache()
+
+    def generate(self, instruction, contents, state_hash="", **kwargs):
+        # story_model(instruction).generate_content(...) ผ่าน cache (ถ้ามี)
+        model = self.story_model(instruction)
+        if self.llm_cache is None:
+            return model.generate_content(contents, **kwargs)
+        return self.llm_cache.story(model, self.story_model_name, instruction, contents, state_hash, **kwargs)
+
+    def ask_gemini_story(self, prompt, context, prompt_data, previous_story, layout=None, timeout=None, state_hash="",
+                         span=None):
+        template = prompt_data.get("story_prompt", "")
+        validator_instruction = template.format(
+            context=context,
+            previous_story=previous_story
+        )
+        stats = None
+        if layout is not None:
+            # story_prompt วาง Context ไว้ท้ายสุดอยู่แล้ว ส่วนหัวจึงคงที่ทุกเทิร์น
+            validator_instruction, stats = layout.build("gemini", [validator_instruction])
+
+        # ส่วนคงที่ของ story_prompt เป็น system instruction (ใช้ model ใน pool ซ้ำได้)
+        # ส่วน Context / Previous story ที่เปลี่ยนทุกเทิร์นส่งไปกับข้อความแทน
+        instruction = static_prefix(template)
+        if not validator_instruction.startswith(instruction):
+            instruction = validator_instruction
+        turn_context = validator_instruction[len(instruction):]
+
+        try:
+            if timeout is not None and timeout <= 0:
+                raise TimeoutError("no time left for the draft")
+            kwargs = {"request_options": {"timeout": timeout}} if timeout is not None else {}
+            contents = [turn_context, prompt] if turn_context.strip() else prompt
+            response = self.generate(instruction, contents, state_hash, **kwargs)
+            text = response.text
+            if span is not None:
+                span["retries"] = retries_of(response)
+                # cache hit ไม่มี usage_metadata (ไม่ได้เรียก provider) เลยไม่มี token
+                record_usage(span, getattr(response, "usage_metadata", None))
+                span["bytes_in"] = len(instruction.encode('utf-8')) + len(turn_context.encode('utf-8')) + len(prompt.encode('utf-8'))
+                span["bytes_out"] = len(text.encode('utf-8'))
+            gemini_clean_response = re.sub(r'([a-zA-Z\u0E00-\u0E7F])\1{10,}', r'\1\1\1\1\1', text)
+            return gemini_clean_response, stats
+
+        except ReplayMiss:
+            # replay ต้องล้มให้เห็น ไม่ใช่กลายเป็นเนื้อเรื่อง "error ..."
+            raise
+        except Exception as e:
+            if span is not None:
+                span["error"] = type(e).__name__
+                span["retries"] = retries_of(e)
+            # ไม่มีร่าง ให้ GPT เขียนเองจาก state (เดิมส่งข้อความ "error ..." ไปเป็นเนื้อเรื่อง)
+            print(f"[Gemini Crosscheck Error]: {e}")
+            return "", stats
+
+    def repair_state_json(self, json_text, state_hash="", timeout=None, span=None):
+        """Ask ``repair_model`` to fix a state block the parser could not read; returns the dict or None."""
+        create = self.gpt_client.chat.completions.create
+        if self.llm_cache is not None:
+            create = functools.partial(self.llm_cache.chat, create, state_hash)
+        response = create(
+            model=self.repair_model,
+            messages=[{"role": "system", "content": JSON_REPAIR_INSTRUCTION}, {"role": "user", "content": json_text}],
+            stream=False,
+            timeout=timeout,
+        )
+        text = response.choices[0].message.content or ""
+        if span is not None:
+            record_usage(span, getattr(response, "usage", None))
+            span["retries"] = retries_of(response)
+            span["bytes_in"] = len(json_text.encode('utf-8'))
+            span["bytes_out"] = len(text.encode('utf-8'))
+        data, _repairs = repair_json(text)
+        return data
+
+    def save_world(self, db, token, applied, span=None):
+        """Save ``db`` if the store is still at ``token``, else rebase ``applied`` on the newer state.
+
+        Returns ``(saved state, its store token)``. With a ``log_archive`` the
+        log is rolled just before each attempt (on the state actually
+        written); the trim is added to ``applied``.
+        """
+        for attempt in range(self.SAVE_RETRIES):
+            rolled = roll_log(db, self.log_archive) if self.log_archive is not None else []
+            try:
+                touched = [change["target"] for change in applied + rolled]
+                saved_token = self.world_store.save(db, expected=token, touched=touched)
+                applied.extend(rolled)
+                return db, saved_token
+            except VersionConflict:
+                if span is not None:
+                    span["retries"] = attempt + 1
+                print("[System Warning]: world changed during the turn, rebasing this turn's changes")
+                db, token = self.world_store.snapshot_versioned()
+                replay_changes(db, applied)
+        raise VersionConflict("world kept changing during save")
+
+    def rollback(self, version):
+        """Undo the world write of a turn whose dialog commit failed (only if nothing was recorded after it)."""
+        if self.version_log is None or version is None:
+            return
+        if self.version_log.head != version:
+            print(f"[System Warning]: v{version} is no longer the latest version, not rolling back")
+            return
+        self.world_store.save(self.version_log.state_at(version - 1))
+        self.version_log.truncate(version - 1)
+        print(f"[System]: rolled back v{version} (dialog commit failed)")
+
+    def fold_due(self, history):
+        """Whether enough messages have left the recent window for ``fold_summary`` to run."""
+        if self.summary_store is None:
+            return False
+        _, upto = self.summary_store.for_history(history)
+        return len(pending_messages(history, upto, self.recent_messages)) >= FOLD_BATCH
+
+    def fold_summary(self, job, history):
+        """Fold messages that left the recent window into the summary (at most two batches per call).
+
+        Runs as its own low-priority job after the turn's result is out (see
+        ``TurnExecutor.submit``). The newest checkpoint is read here rather
+        than at turn time, so folds queued back to back never redo a batch.
+        """
+        if self.summary_store is None:
+            return
+        summary, upto = self.summary_store.for_history(history)
+        pending = pending_messages(history, upto, self.recent_messages)
+        if len(pending) < FOLD_BATCH:
+            return
+        batch = pending[:FOLD_BATCH * 2]
+        job.report(stage="summary")
+        if self.metrics is not None:
+            trace = self.metrics.start_turn("summary", job.session_id, kind="background")
+        else:
+            trace = TurnTrace("summary", job.session_id, kind="background")
+        instruction = SUMMARY_INSTRUCTION.format(cap=self.summary_cap, chars=self.summary_cap * 4 // 3)
+        job.check()
+        timeout = job.remaining()
+        kwargs = {"request_options": {"timeout": timeout}} if timeout is not None else {}
+        contents = fold_prompt(summary, batch)
+        try:
+            with trace.span("summary", model=self.story_model_name, messages=len(batch)) as span:
+                response = self.generate(instruction, contents, **kwargs)
+                text = response.text.strip()
+                record_usage(span, getattr(response, "usage_metadata", None))
+                span["bytes_in"] = len(instruction.encode('utf-8')) + len(contents.encode('utf-8'))
+                span["bytes_out"] = len(text.encode('utf-8'))
+            # model เขียนเกินก็ตัดทิ้ง ให้ขนาด input ต่อเทิร์นคงที่จริงๆ (เก็บท้ายไว้ เพราะเป็นเรื่องล่าสุด)
+            self.summary_store.save(clip_tokens(text, self.summary_cap, keep="tail"), upto + len(batch), history)
+        except BaseException as e:
+            trace.finish(type(e).__name__)
+            raise
+        trace.finish()
+
+    def run(self, job, prompt, history, prompt_data, previous_story, layout):
+        """Run one turn. ``history`` already ends with the user's message.
+
+        ``previous_story`` is the caller's (per-session) list of recent Gemini
+        stories; it is updated in place.
+        """
+        label = prompt.strip().splitlines()[0][:60] if prompt.strip() else ""
+        if self.metrics is not None:
+            trace = self.metrics.start_turn(label, job.session_id)
+        else:
+            trace = TurnTrace(label, job.session_id)
+        try:
+            result = self._run(trace, job, prompt, history, prompt_data, previous_story, layout)
+        except BaseException as e:
+            trace.finish(type(e).__name__)
+            raise
+        trace.finish()
+        return result
+
+    def _run(self, trace, job, prompt, history, prompt_data, previous_story, layout):
+        prompt_stats = {}
+        db, token = self.world_store.snapshot_versioned()
+        summary, upto = self.summary_store.for_history(history) if self.summary_store is not None else ("", 0)
+        summary_text = render_summary(summary)
+
+        # เวลา / เส้นทางที่คำนวณเองได้ ไม่ต้องให้ LLM เดา (เวลาถูกบวกเข้า db เลย ก่อนส่ง state)
+        # เวลาในเกมตอนเริ่มเทิร์น ใช้ประทับ log_entry ของเทิร์นนี้
+        turn_time = (db.get('world') or {}).get('current_time')
+        facts = resolve_turn(db, prompt) if self.mechanics else {}
+        timeline = (db.get('world') or {}).get('timeline')
+        scheduler = None
+        if self.timeline_cache is not None and isinstance(timeline, list):
+            # heap ของ timeline จากเทิร์นก่อน (ถ้าโลกยังเป็น version ที่เราบันทึกไว้) ไม่ต้องไล่ event ใหม่ทั้งหมด
+            scheduler = self.timeline_cache.take(timeline, token)
+        engine_changes = apply_facts(db, facts, scheduler)
+        facts_text = render_facts(facts)
+        route = self.router.route(prompt, db, facts) if self.router is not None else None
+        budget = Budget(job, route["budget"] if route is not None else None)
+
+        # Prepare Data
+        # เลือกเฉพาะ NPC ที่เกี่ยวข้องกับเทิร์นนี้ (อยู่ที่เดียวกัน / ถูกพูดถึง / ฝ่ายเดียวกัน) แทนการส่งทั้งโลก
+        job.report(stage="context")
+        with trace.span("context") as span:
+            ctx = build_context_data(
+                db,
+                prompt,
+                recent_texts=[m.get("content", "") for m in history[-self.recent_messages:]],
+                token_budget=self.token_budget,
+                # engine แก้แค่เวลา / timeline ก่อนถึงตรงนี้ ตัวละครยังเป็นของ version ที่ token ชี้
+                index=self.character_index.get(db.get('characters'), token)
+            )
+            # serialize state ครั้งเดียว ใช้ร่วมกันทั้ง Gemini และ GPT
+            state_text = render_state(ctx)
+            span["state_tokens"] = estimate_tokens(state_text)
+            span["characters"] = len(ctx.get("characters") or {})
+        memory_text = ""
+        if self.memory_index is not None and self.memory_top_k > 0:
+            # index เฉพาะข้อความ/log ที่เพิ่มมาใหม่ แล้วดึงเหตุการณ์เก่าที่เกี่ยวกับคำสั่งนี้
+            # (ไม่เอาข้อความล่าสุดที่ส่งแบบเต็มอยู่แล้ว)
+            with trace.span("memory") as span:
+                self.memory_index.sync(history, db.get('log'), db.get('log_base', 0))
+                hits = self.memory_index.search(
+                    prompt, k=self.memory_top_k, skip_dialog_from=max(upto, len(history) - self.recent_messages)
+                )
+                memory_text = render_memories(hits)
+                span["hits"] = len(hits)
+        # key ของ response cache: สิ่งที่ model เห็นจากโลกในเทิร์นนี้
+        state_hash = content_hash([summary_text, state_text, memory_text, facts_text])
+        # สรุปแคมเปญเปลี่ยนแค่ตอน fold เลยวางไว้ก่อน state (prefix ยังซ้ำกันได้เกือบทุกเทิร์น)
+        story_context = "\n".join(seg for seg in (summary_text, state_text, memory_text, facts_text) if seg)
+
+        job.check()
+        gemini_story = ""
+        if route is None or route["story"]:
+            job.report(stage="gemini")
+            with trace.span("gemini", model=self.story_model_name) as span:
+                gemini_story, prompt_stats["gemini"] = self.ask_gemini_story(
+                    prompt, story_context, prompt_data, list(previous_story), layout, timeout=budget.remaining(),
+                    state_hash=state_hash, span=span
+                )
+            job.check()
+            if "error" in span:
+                # ร่างล้ม / เกินงบเวลา ให้ GPT เขียนเองแทน
+                if route is not None:
+                    route["profile"] = FALLBACK
+            else:
+                # เก็บ 3 เรื่องล่าสุดแบบเลื่อน (ของเก่ากว่านั้นอยู่ในสรุปแคมเปญแล้ว)
+                previous_story.append(gemini_story)
+                del previous_story[:-3]
+        if route is not None:
+            trace.add("route", 0.0, profile=route["profile"], action=route["action"], model=route["model"])
+
+        story = f"Story: {gemini_story}" if gemini_story else DIRECT_STORY_NOTE
+        raw_template = prompt_data.get("system_prompt", "")
+
+        # ส่วนคงที่ (กฎ + รูปแบบ output) ไว้ข้างหน้า ส่วนที่เปลี่ยนทุกเทิร์น (state + story) ไว้ท้าย
+        # provider จะ cache prefix ที่ซ้ำกันได้
+        system_prompt, prompt_stats["gpt"] = layout.build("gpt", [raw_template, OUTPUT_FORMAT, summary_text, state_text, memory_text, facts_text, story])
+        print(f"[Prompt Reuse]: {prompt_stats}")
+
+        messages_payload = [{"role": "system", "content": system_prompt}]
+        # ส่งประวัติเฉพาะข้อความล่าสุด (ตัดความยาวแต่ละอัน) ที่เก่ากว่านั้นอยู่ในสรุปแคมเปญ
+        for msg in recent_window(history, upto, self.recent_messages):
+            if msg["role"] != "system":
+                messages_payload.append({"role": msg["role"], "content": msg["content"]})
+
+        committed = []
+        committed_versions = []
+        save_errors = []
+        callback_seconds = []
+
+        def on_state_block(data):
+            # block JSON ปิดแล้ว อัปเดต DB ได้เลยไม่ต้องรอเนื้อเรื่องที่เหลือ
+            started = time.perf_counter()
+            try:
+                ignored_time = bool(engine_changes) and isinstance(data, dict) and "time_passed" in data
+                if ignored_time:
+                    data = {k: v for k, v in data.items() if k != "time_passed"}
+                if isinstance(data, dict) and isinstance(data.get("log_entry"), str):
+                    # เก็บเวลาไว้กับ entry (ค้นตามวันที่ได้ และ version log replay ได้ค่าเดิม)
+                    data = dict(data, log_entry=log_record(turn_time, data["log_entry"]))
+                time_before = db.get('world', {}).get('current_time')
+                with trace.span("merge") as span:
+                    changes = apply_delta(db, data)
+                    span["applied"] = len(changes.applied)
+                    span["rejected"] = len(changes.rejected)
+                # เวลาที่ engine บวกไปแล้ว นับเป็นส่วนหนึ่งของเทิร์นนี้ (version log จะได้ replay ได้)
+                changes.applied[:0] = engine_changes
+                if db.get('world', {}).get('current_time') != time_before:
+                    # GPT เป็นคนเดินเวลา (engine ไม่รู้จัก action นี้) ให้ timeline ตามไปด้วย
+                    changes.applied.extend(timeline_changes(db, advance_timeline(db, scheduler)))
+                if ignored_time:
+                    changes.rejected.append({"path": "time_passed", "reason": "set by mechanics engine"})
+                for item in changes.rejected:
+                    print(f"[System Warning]: ignored {item['path']} ({item['reason']})")
+                if changes:
+                    try:
+                        with trace.span("db_save", retries=0) as span:
+                            saved, saved_token = self.save_world(db, token, changes.applied, span=span)
+                    except Exception as e:
+                        # เขียนโลกไม่ได้ ทั้งเทิร์นต้องไม่ถูกบันทึก (ไม่ใช่ได้ข้อความแต่ state ไม่เปลี่ยน)
+                        save_errors.append(e)
+                        raise
+                    if scheduler is not None and (saved.get('world') or {}).get('timeline') is scheduler.timeline:
+                        # heap ตรงกับโลกที่เพิ่งบันทึก (ไม่ได้ rebase ทับของคนอื่น) เก็บไว้ใช้เทิร์นหน้า
+                        self.timeline_cache.keep(scheduler, saved_token)
+                    if self.version_log is not None:
+                        # เก็บเฉพาะสิ่งที่เปลี่ยนในเทิร์นนี้ (+1 คือข้อความ assistant ที่กำลังจะต่อท้าย)
+                        with trace.span("version_log"):
+                            committed_versions.append(self.version_log.record(
+                                changes.applied, saved, dialog_len=len(history) + 1, label=str(data.get('log_entry', ''))
+                            ))
+                committed.append(changes)
+            except Exception as e:
+                print(f"[System Error]: Update Failed ({e})")
+            finally:
+                # ถูกเรียกจากใน parser.feed ไม่นับเป็นเวลา parse
+                callback_seconds.append(time.perf_counter() - started)
+
+        parser = StreamingReplyParser(on_json=on_state_block)
+
+        job.report(stage="gpt")
+        gpt_model = route["model"] if route is not None else self.gpt_model
+        gpt_span = trace.begin("gpt", model=gpt_model, stream=self.stream,
+                               bytes_in=sum(len(m["content"].encode('utf-8')) for m in messages_payload))
+        parse_seconds = 0.0
+        create = self.gpt_client.chat.completions.create
+        if self.llm_cache is not None:
+            create = functools.partial(self.llm_cache.chat, self.gpt_client.chat.completions.create, state_hash)
+        params = dict(
+            model=gpt_model,
+            messages=messages_payload,
+            temperature=0.5,
+            stream=self.stream,
+            timeout=budget.timeout("gpt"),
+            **({"stream_options": {"include_usage": True}} if self.stream else {}),
+        )
+        if route is None:
+            response = create(**params)
+        else:
+            response, used_model = open_reply(create, params, route["fallback"], route["hedge_after"],
+                                              check=job.check, timeout=budget.timeout("gpt"))
+            if used_model != gpt_model:
+                route["profile"] = FALLBACK
+                gpt_span["model"] = used_model
+        gpt_span["retries"] = retries_of(response)
+        cancelled = False
+        if self.stream:
+            # ได้ chunk แรกเมื่อไหร่ก็เริ่มส่งเนื้อเรื่องให้ UI ทันที
+            usage = None
+            try:
+                for chunk in response:
+                    job.check()
+                    trace.mark(gpt_span, "ttft_ms")
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    started = time.perf_counter()
+                    fed = parser.feed(chunk.choices[0].delta.content or "")
+                    parse_seconds += time.perf_counter() - started
+                    if fed:
+                        job.report(partial=parser.story)
+            except Exception:
+                # กด stop หลัง DB อัปเดตไปแล้ว ต้องเก็บข้อความไว้ด้วย ไม่งั้นประวัติกับ DB จะไม่ตรงกัน
+                if not committed:
+                    raise
+                cancelled = True
+            finally:
+                close = getattr(response, "close", None)
+                if close is not None:
+                    close()
+        else:
+            usage = getattr(response, "usage", None)
+            started = time.perf_counter()
+            parser.feed(response.choices[0].message.content or "")
+            parse_seconds += time.perf_counter() - started
+        if not cancelled:
+            started = time.perf_counter()
+            parser.finish()
+            parse_seconds += time.perf_counter() - started
+        job.report(partial=parser.story)
+        record_usage(gpt_span, usage)
+        gpt_span["bytes_out"] = len(parser.raw.encode('utf-8'))
+        if cancelled:
+            gpt_span["error"] = "cancelled"
+        trace.end(gpt_span)
+        # แยกเวลา parse ออกมา (เกิดกระจายอยู่ระหว่าง chunk ของ stream)
+        trace.add("extract", parse_seconds - sum(callback_seconds), ok=parser.error is None,
+                  json_bytes=len((parser.json_text or "").encode('utf-8')), repairs=list(parser.repairs))
+        if parser.error is not None and not cancelled and self.repair_model:
+            # ซ่อมเองไม่ได้ ส่งเฉพาะ JSON block ให้ model เล็กแก้ (ไม่ต้องให้ตัวใหญ่เขียนเทิร์นใหม่ทั้งหมด)
+            job.report(stage="repair")
+            try:
+                with trace.span("json_repair", model=self.repair_model) as span:
+                    data = self.repair_state_json(parser.json_text, state_hash, timeout=budget.timeout("json_repair"),
+                                                  span=span)
+                    span["ok"] = data is not None
+                if data is not None:
+                    parser.accept(data, "model_repair")
+            except ReplayMiss:
+                raise
+            except Exception as e:
+                print(f"[System Error]: JSON repair failed ({e})")
+        if not committed and not save_errors and engine_changes:
+            # ไม่มี state block แต่ engine เดินเวลา / timeline ไปแล้ว (และบอก model ไปแล้ว) ต้องบันทึกด้วย
+            on_state_block({})
+
+        details = getattr(usage, "prompt_tokens_details", None)
+        if details is not None:
+            print(f"[Prompt Cache]: cached_tokens={getattr(details, 'cached_tokens', 0)} / prompt_tokens={usage.prompt_tokens}")
+
+        gpt_content = parser.raw
+        story_text = parser.story.strip() if parser.json_text else gpt_content
+        json_str = parser.json_text
+        if parser.error is not None:
+            print(f"[System Error]: AI ส่ง JSON ผิดรูปแบบ Parsing Failed ({parser.error}).")
+        elif parser.repairs:
+            print(f"[System Warning]: ซ่อม JSON จาก AI: {', '.join(parser.repairs)}")
+        if save_errors:
+            raise save_errors[0]
+
+        # 2. Commit: ข้อความ user + assistant ลง journal พร้อมกันครั้งเดียว (debug เก็บแยกไว้ใน debug_store)
+        # id ที่อยู่ใน dialog แล้วจะถูกข้าม เรียกซ้ำได้ไม่ซ้ำซ้อน
+        try:
+            with trace.span("dialog_save") as span:
+                message = {
+                    "role": "assistant",
+                    "content": story_text,
+                    "debug_ref": self.debug_store.put({
+                        "debug_json": json_str,
+                        "sections": parser.sections,
+                        "repairs": parser.repairs,
+                        "gpt_raw": gpt_content,
+                        "gemini_raw": gemini_story,
+                        "changes": committed[0].as_dict() if committed else None
+                    })
+                }
+                self.dialog_store.append_many([history[-1], message] if history else [message])
+                span["bytes_out"] = len(story_text.encode('utf-8'))
+        except Exception:
+            self.rollback(committed_versions[-1] if committed_versions else None)
+            raise
+
+        # fold summary ไม่ทำในเทิร์น (เรียก Gemini อีกรอบ) ผู้เรียกส่งเป็น job แยกหลังได้ผลลัพธ์แล้ว
+        fold = not cancelled and self.fold_due(history + [message])
+        return {"message": message, "prompt_stats": prompt_stats, "route": route, "fold_summary": fold}
@@ -0,0 +1,183 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TurnCancelled(Exception):
+    pass
+
+
+class TurnTimeout(Exception):
+    pass
+
+
+class TurnJob:
+    """One queued turn. The worker reports progress here and the UI polls it."""
+
+    def __init__(self, session_id, fn, timeout):
+        self.id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.fn = fn
+        self.timeout = timeout
+        self.status = "queued"  # queued / running / done / failed / cancelled / timeout
+        self.stage = ""
+        self.partial = ""
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def remaining(self):
+        # เวลาที่เหลือ (วินาที) ใช้เป็น timeout ของ provider call แต่ละตัว
+        if self.started_at is None:
+            return self.timeout
+        return max(0.0, self.timeout - (time.time() - self.started_at))
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check(self):
+        """Checkpoint for the worker: raises if the user pressed stop or time ran out."""
+        if self._cancel.is_set():
+            raise TurnCancelled()
+        if self.started_at is not None and self.remaining() <= 0:
+            raise TurnTimeout(f"turn exceeded {self.timeout}s")
+
+    def report(self, stage=None, partial=None):
+        with self._lock:
+            if stage is not None:
+                self.stage = stage
+            if partial is not None:
+                self.partial = partial
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "stage": self.stage,
+                "partial": self.partial,
+                "error": self.error,
+                "elapsed": (self.finished_at or time.time()) - (self.started_at or self.created_at),
+            }
+
+
+class TurnExecutor:
+    """Thread pool shared by all sessions with a FIFO job queue per session.
+
+    Turns of one session run one after another; different sessions run in
+    parallel up to ``max_workers``. The Streamlit script thread only submits
+    and polls, so it never blocks on the LLM calls.
+
+    Background jobs (e.g. the summary fold after a turn) run in the same
+    per-session order but only when no turn is queued, and are left out of
+    ``latest`` / ``active`` so the UI neither waits for nor shows them.
+
+    A session's queue is dropped once it drains, and the recent jobs are
+    kept for at most ``max_sessions`` sessions; the least recently used idle
+    session is forgotten first.
+    """
+
+    def __init__(self, max_workers=4, history_per_session=5, max_sessions=256):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="turn")
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._background = {}
+        self._running = {}
+        self._history = OrderedDict()   # session_id -> job ล่าสุด เรียงตามที่ใช้ล่าสุดอยู่ท้าย
+        self._history_per_session = history_per_session
+        self._max_sessions = max_sessions
+
+    def submit(self, session_id, fn, timeout=300, background=False):
+        """Queue ``fn(job)`` for ``session_id`` and return the job handle.
+
+        A ``background`` job waits until the session has no turn queued.
+        """
+        job = TurnJob(session_id, fn, timeout)
+        with self._lock:
+            if background:
+                self._background.setdefault(session_id, deque()).append(job)
+            else:
+                self._queues.setdefault(session_id, deque()).append(job)
+                self._touch(session_id).append(job)
+                self._evict()
+            if session_id not in self._running:
+                self._start_next(session_id)
+        return job
+
+    def latest(self, session_id):
+        with self._lock:
+            history = self._history.get(session_id)
+            if not history:
+                return None
+            self._history.move_to_end(session_id)
+            return history[-1]
+
+    def active(self, session_id):
+        with self._lock:
+            return [job for job in self._history.get(session_id, ()) if job.active]
+
+    def _touch(self, session_id):
+        # ต้องถือ self._lock อยู่ตอนเรียก
+        history = self._history.get(session_id)
+        if history is None:
+            history = self._history[session_id] = deque(maxlen=self._history_per_session)
+        self._history.move_to_end(session_id)
+        return history
+
+    def _evict(self):
+        # ต้องถือ self._lock อยู่ตอนเรียก ลืม session ที่ไม่ได้ใช้นานที่สุดก่อน (ข้าม session ที่ยังมีงานค้าง)
+        excess = len(self._history) - self._max_sessions
+        if excess <= 0:
+            return
+        idle = [sid for sid, jobs in self._history.items()
+                if sid not in self._running and not any(job.active for job in jobs)]
+        for sid in idle[:excess]:
+            del self._history[sid]
+
+    def _start_next(self, session_id):
+        # ต้องถือ self._lock อยู่ตอนเรียก
+        # เทิร์นของผู้เล่นมาก่อนเสมอ งานเบื้องหลังรอจนไม่มีเทิร์นค้างในคิว
+        for queues in (self._queues, self._background):
+            queue = queues.get(session_id)
+            if queue:
+                job = queue.popleft()
+                if not queue:
+                    del queues[session_id]
+                break
+        else:
+            self._running.pop(session_id, None)
+            return
+        self._running[session_id] = job
+        self._pool.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            if job._cancel.is_set():
+                job.status = "cancelled"
+                return
+            job.started_at = time.time()
+            job.status = "running"
+            job.result = job.fn(job)
+            job.status = "done"
+        except TurnCancelled:
+            job.status = "cancelled"
+        except TurnTimeout as e:
+            job.error = str(e)
+            job.status = "timeout"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._start_next(job.session_id)
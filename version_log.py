@@ -0,0 +1,187 @@
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+
+from delta_engine import replay_changes
+from file_lock import FileLock
+
+
+class VersionLog:
+    """Per-turn delta log of the world with a full snapshot every ``snapshot_every`` versions.
+
+    Version 0 is the base snapshot. Each later version stores only the writes
+    of one turn (the ``applied`` list of a ChangeSet), so disk use grows with
+    the size of the changes rather than turns x world size. Any version is
+    rebuilt from the nearest snapshot at or before it plus the deltas after.
+    Manual edits (debug editor, uploads) are stored as snapshot versions.
+    Writes hold a FileLock on the directory and the cached records are
+    re-read when another process has changed the log.
+    """
+
+    def __init__(self, root_dir, snapshot_every=25):
+        self.root_dir = root_dir
+        self.snapshot_every = snapshot_every
+        self.log_path = os.path.join(root_dir, 'versions.jsonl')
+        self.snapshot_dir = os.path.join(root_dir, 'snapshots')
+        self._records = None
+        self._records_stamp = None
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(root_dir.rstrip('/\\'))
+
+    # ---------- storage ----------
+    def _snapshot_path(self, version):
+        return os.path.join(self.snapshot_dir, f'v{version:06d}.json.z')
+
+    def _write_snapshot(self, version, db):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        raw = json.dumps(db, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        path = self._snapshot_path(version)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(zlib.compress(raw, 6))
+        os.replace(path + '.tmp', path)
+
+    def _read_snapshot(self, version):
+        with open(self._snapshot_path(version), 'rb') as f:
+            return json.loads(zlib.decompress(f.read()).decode('utf-8'))
+
+    def _log_stamp(self):
+        try:
+            st = os.stat(self.log_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load_records(self):
+        stamp = self._log_stamp()
+        if self._records is not None and stamp == self._records_stamp:
+            return self._records
+        records = []
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        self._records = records
+        self._records_stamp = stamp
+        return records
+
+    def _append_record(self, record):
+        records = self._load_records()
+        os.makedirs(self.root_dir, exist_ok=True)
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        # ถือ file lock อยู่ cache จึงตรงกับไฟล์ก่อนเขียน ต่อท้ายเองแล้วขยับ stamp ตาม
+        records.append(record)
+        self._records_stamp = self._log_stamp()
+
+    # ---------- API ----------
+    @property
+    def head(self):
+        with self._lock:
+            records = self._load_records()
+            return records[-1]['v'] if records else None
+
+    def versions(self):
+        """Metadata of every version (without the delta payloads), oldest first."""
+        with self._lock:
+            return [{k: v for k, v in r.items() if k != 'writes'} for r in self._load_records()]
+
+    def ensure_base(self, db, dialog_len=0):
+        with self._lock, self._file_lock:
+            if self._load_records():
+                return
+            self._write_snapshot(0, db)
+            self._append_record({
+                "v": 0, "kind": "snapshot", "dialog_len": dialog_len,
+                "time": db.get('world', {}).get('current_time'), "label": "base", "at": time.time()
+            })
+
+    def record(self, applied, db_after, dialog_len, label=""):
+        """Log one turn's writes. Every ``snapshot_every`` versions also store the full state."""
+        with self._lock, self._file_lock:
+            version = (self.head or 0) + 1
+            kind = "delta"
+            if version % self.snapshot_every == 0:
+                self._write_snapshot(version, db_after)
+                kind = "delta+snapshot"
+            self._append_record({
+                "v": version, "kind": kind, "writes": applied, "dialog_len": dialog_len,
+                "time": db_after.get('world', {}).get('current_time'), "label": label[:80], "at": time.time()
+            })
+            return version
+
+    def record_snapshot(self, db, dialog_len, label="edit"):
+        """Log a manual edit as a full snapshot (it has no replayable delta)."""
+        with self._lock, self._file_lock:
+            version = (self.head or 0) + 1
+            self._write_snapshot(version, db)
+            self._append_record({
+                "v": version, "kind": "snapshot", "dialog_len": dialog_len,
+                "time": db.get('world', {}).get('current_time'), "label": label, "at": time.time()
+            })
+            return version
+
+    def state_at(self, version):
+        """Rebuild the world as it was right after ``version``."""
+        with self._lock:
+            records = [r for r in self._load_records() if r['v'] <= version]
+            base = None
+            for i in range(len(records) - 1, -1, -1):
+                if records[i]['kind'] != "delta":
+                    base = i
+                    break
+            if base is None:
+                raise KeyError(f"no snapshot at or before version {version}")
+            db = self._read_snapshot(records[base]['v'])
+            for record in records[base + 1:]:
+                replay_changes(db, record.get('writes', []))
+            return db
+
+    def truncate(self, version):
+        """Drop every version after ``version`` (rewind). Returns that version's metadata."""
+        with self._lock, self._file_lock:
+            records = [r for r in self._load_records() if r['v'] <= version]
+            if not records:
+                raise KeyError(f"unknown version {version}")
+            tmp_path = self.log_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            os.replace(tmp_path, self.log_path)
+            for name in os.listdir(self.snapshot_dir) if os.path.isdir(self.snapshot_dir) else []:
+                if name.startswith('v') and name.endswith('.json.z') and int(name[1:7]) > version:
+                    os.remove(os.path.join(self.snapshot_dir, name))
+            self._records = records
+            self._records_stamp = self._log_stamp()
+            return {k: v for k, v in records[-1].items() if k != 'writes'}
+
+    def branch(self, version, target_dir):
+        """Start a new log in ``target_dir`` whose base is the state at ``version``."""
+        with self._lock:
+            meta = next((r for r in self._load_records() if r['v'] == version), None)
+            if meta is None:
+                raise KeyError(f"unknown version {version}")
+            db = self.state_at(version)
+            if os.path.exists(target_dir):
+                shutil.rmtree(target_dir)
+            branch = VersionLog(target_dir, self.snapshot_every)
+            branch.ensure_base(db, meta.get('dialog_len', 0))
+            return branch, db
+
+    def clear(self):
+        with self._lock, self._file_lock:
+            if os.path.isdir(self.root_dir):
+                shutil.rmtree(self.root_dir)
+            self._records = None
+            self._records_stamp = None
+
@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from dialog_store import atomic_write_json
+from file_lock import FileLock
+from game_state import TIME_FMT
+
+# entry ล่าสุดที่เก็บไว้ใน db['log'] เกินนี้ย้ายของเก่าไป archive ทีละ segment
+LOG_LIMIT = 200
+LOG_SEGMENT = 100
+DATE_FMT = "%Y-%m-%d"
+
+
+def log_record(time, text):
+    """A ``db['log']`` entry stamped with the in-game time it happened at."""
+    return {"time": time, "text": text}
+
+
+def entry_text(entry):
+    # entry เก่าเป็น str ล้วน (ไม่มีเวลา)
+    return str(entry.get("text", "")) if isinstance(entry, dict) else str(entry)
+
+
+def entry_time(entry):
+    return entry.get("time") if isinstance(entry, dict) else None
+
+
+def time_range(start, end=None):
+    """``[start, end)`` as TIME_FMT strings; a bare date (``"1524-03-20"``) without ``end`` means that whole day."""
+    if end is None and len(start) == len("0000-00-00"):
+        day = datetime.strptime(start, DATE_FMT)
+        return day.strftime(TIME_FMT), (day + timedelta(days=1)).strftime(TIME_FMT)
+    if len(start) == len("0000-00-00"):
+        start += " 00:00:00"
+    if end is not None and len(end) == len("0000-00-00"):
+        end += " 00:00:00"
+    return start, end
+
+
+class LogArchive:
+    """Older ``db['log']`` entries, moved out of the world DB in compressed segments.
+
+    ``db['log']`` keeps only the latest entries and ``db['log_base']`` is the
+    number of entries archived before it, so every entry has a stable
+    sequence number (``log_base + position``). Each segment is one zlib
+    file of ``LOG_SEGMENT`` entries; ``index.json`` records the in-game
+    time range of every segment, so a query for a day only opens the
+    segments that overlap it.
+
+    Segments are named by their first sequence number and rewritten with the
+    same entries if a turn is retried, so rolling is idempotent. Segments at
+    or after a state's ``log_base`` (left behind by a rewind) are ignored.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.index_path = os.path.join(root_dir, 'index.json')
+        self._file_lock = FileLock(self.index_path)
+        self._lock = threading.Lock()
+        self._index = None
+        self._stamp = None
+        self._cache = {}        # start -> entries ของ segment ที่อ่านล่าสุด (segment ไม่เปลี่ยนหลังเขียน)
+
+    def _path(self, start):
+        return os.path.join(self.root_dir, f'seg-{start:08d}.json.z')
+
+    def _index_stamp(self):
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def segments(self):
+        """``[{"start", "count", "first_time", "last_time"}]`` sorted by ``start``."""
+        with self._lock:
+            stamp = self._index_stamp()
+            if self._index is None or stamp != self._stamp:
+                try:
+                    with open(self.index_path, 'r', encoding='utf-8') as f:
+                        self._index = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    self._index = []
+                self._stamp = stamp
+            return list(self._index)
+
+    def write_segment(self, start, entries):
+        times = [t for t in map(entry_time, entries) if t]
+        info = {"start": start, "count": len(entries),
+                "first_time": min(times) if times else None, "last_time": max(times) if times else None}
+        os.makedirs(self.root_dir, exist_ok=True)
+        path = self._path(start)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(json.dumps(entries, ensure_ascii=False).encode('utf-8'), 6))
+        os.replace(tmp_path, path)
+        with self._file_lock:
+            index = [seg for seg in self.segments() if seg["start"] != start]
+            index.append(info)
+            index.sort(key=lambda seg: seg["start"])
+            atomic_write_json(self.index_path, index)
+            with self._lock:
+                self._index, self._stamp = index, self._index_stamp()
+                self._cache.pop(start, None)
+        return info
+
+    def read_segment(self, start):
+        with self._lock:
+            cached = self._cache.get(start)
+        if cached is not None:
+            return cached
+        try:
+            with open(self._path(start), 'rb') as f:
+                entries = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except (OSError, ValueError, zlib.error):
+            return []
+        with self._lock:
+            self._cache = {start: entries}
+        return entries
+
+    def query(self, start, end=None, log=None, log_base=0):
+        """Entries whose in-game time is in ``[start, end)`` as ``[{"seq", "time", "text"}]``, oldest first.
+
+        ``start`` / ``end`` are TIME_FMT strings or bare dates (see
+        ``time_range``). ``log`` / ``log_base`` are the live ``db['log']``
+        and ``db['log_base']``, searched after the archive. Untimed (old
+        string) entries never match a time range.
+        """
+        start, end = time_range(start, end)
+        hits = []
+        for seg in self.segments():
+            if seg["start"] + seg["count"] > log_base or seg["first_time"] is None:
+                continue
+            if seg["last_time"] < start or (end is not None and seg["first_time"] >= end):
+                continue
+            hits.extend(self._match(self.read_segment(seg["start"]), seg["start"], start, end))
+        hits.extend(self._match(log or [], log_base, start, end))
+        return hits
+
+    @staticmethod
+    def _match(entries, base, start, end):
+        out = []
+        for pos, entry in enumerate(entries):
+            time = entry_time(entry)
+            if time and time >= start and (end is None or time < end):
+                out.append({"seq": base + pos, "time": time, "text": entry_text(entry)})
+        return out
+
+    def copy_to(self, other, upto):
+        """Copy the segments before sequence ``upto`` into ``other`` (branching a campaign)."""
+        for seg in self.segments():
+            if seg["start"] + seg["count"] <= upto:
+                other.write_segment(seg["start"], self.read_segment(seg["start"]))
+
+    def clear(self):
+        with self._file_lock:
+            for seg in self.segments():
+                try:
+                    os.remove(self._path(seg["start"]))
+                except FileNotFoundError:
+                    pass
+            atomic_write_json(self.index_path, [])
+            with self._lock:
+                self._index, self._stamp = [], self._index_stamp()
+                self._cache = {}
+
+
+def roll_log(db, archive, limit=LOG_LIMIT, segment=LOG_SEGMENT):
+    """Move the oldest ``db['log']`` entries into ``archive`` once it holds more than ``limit`` (in place).
+
+    Returns the writes in the delta engine's ``applied`` format, so the
+    version log replays the trim.
+    """
+    log = db.get('log')
+    if not isinstance(log, list) or len(log) <= limit:
+        return []
+    base = db.get('log_base', 0)
+    moved = 0
+    while len(log) - moved > limit:
+        chunk = log[moved:moved + segment]
+        archive.write_segment(base + moved, chunk)
+        moved += len(chunk)
+    db['log'] = log[moved:]
+    db['log_base'] = base + moved
+    return [
+        {"path": "log", "op": "drop_head", "target": "log", "value": moved, "options": {}},
+        {"path": "log_base", "op": "replace", "target": "log_base", "value": base + moved, "options": {}},
+    ]